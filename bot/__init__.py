@@ -46,6 +46,15 @@ MAX_FILE_SIZE = int(environ.get('MAX_FILE_SIZE', 2000))  # MB
 MAX_DURATION = int(environ.get('MAX_DURATION', 7200))  # seconds
 TG_MAX_FILE_SIZE = int(environ.get('TG_MAX_FILE_SIZE', 2000))  # MB
 
+# Disk space management
+DISK_RESERVE_MB = int(environ.get('DISK_RESERVE_MB', 500))  # always keep this much free
+JANITOR_INTERVAL = int(environ.get('JANITOR_INTERVAL', 1800))  # seconds between cleanup runs
+JANITOR_MAX_AGE_HOURS = int(environ.get('JANITOR_MAX_AGE_HOURS', 24))  # orphaned files older than this are removed
+INPUT_CACHE_TTL = int(environ.get('INPUT_CACHE_TTL', 3600))  # seconds a downloaded input is kept for follow-up operations
+
+# Offer a short preview clip before re-encoding videos at least this long (seconds, 0 = never)
+PREVIEW_MIN_DURATION = int(environ.get('PREVIEW_MIN_DURATION', 300))
+
 # Google Drive
 GDRIVE_ENABLED = environ.get('GDRIVE_ENABLED', 'False').lower() == 'true'
 GDRIVE_CREDENTIALS = environ.get('GDRIVE_CREDENTIALS', 'credentials.json')
@@ -53,6 +62,9 @@ GDRIVE_FOLDER_ID = environ.get('GDRIVE_FOLDER_ID', '')
 
 # External download helpers
 ENABLE_YTDLP = environ.get('ENABLE_YTDLP', 'False').lower() == 'true'
+YTDLP_CONCURRENT_FRAGMENTS = int(environ.get('YTDLP_CONCURRENT_FRAGMENTS', 4))  # parallel HLS/DASH fragments per download
+MAX_CONNECTIONS_PER_HOST = int(environ.get('MAX_CONNECTIONS_PER_HOST', 8))  # to one media host, across all URL downloads
+DOWNLOAD_SPEED_LIMIT = float(environ.get('DOWNLOAD_SPEED_LIMIT', 0))  # MB/s shared by all URL downloads, 0 = unlimited
 
 # FFmpeg Defaults
 DEFAULT_VIDEO_CODEC = environ.get('DEFAULT_VIDEO_CODEC', 'libx264')
@@ -81,6 +93,28 @@ LOG_CHANNEL = int(environ.get('LOG_CHANNEL', 0))
 
 # Queue / rate limiting
 MAX_QUEUE_PER_USER = int(environ.get('MAX_QUEUE_PER_USER', 3))
+MAX_BATCH_FILES = int(environ.get('MAX_BATCH_FILES', 20))  # files per batch session
+
+# Broadcast delivery (Telegram allows about 30 messages per second in bulk)
+BROADCAST_RATE = float(environ.get('BROADCAST_RATE', 25))  # messages per second
+BROADCAST_CONCURRENCY = int(environ.get('BROADCAST_CONCURRENCY', 10))  # sends in flight
+
+# Bot-wide concurrency per stage (shared by all users)
+MAX_CONCURRENT_DOWNLOADS = int(environ.get('MAX_CONCURRENT_DOWNLOADS', 2))
+MAX_CONCURRENT_FFMPEG = int(environ.get('MAX_CONCURRENT_FFMPEG', 2))
+MAX_CONCURRENT_UPLOADS = int(environ.get('MAX_CONCURRENT_UPLOADS', 2))
+
+# Fair sharing of FFmpeg slots between users and groups
+FAIRSHARE_WINDOW = int(environ.get('FAIRSHARE_WINDOW', 3600))  # seconds of CPU usage history
+USER_CPU_QUOTA = float(environ.get('USER_CPU_QUOTA', 0))  # CPU-seconds per user per window (0 = no quota)
+CUSTOM_MAX_PRESET = environ.get('CUSTOM_MAX_PRESET', 'slow')  # slowest x264/x265 preset custom FFmpeg commands may use
+
+# Stall watchdog: seconds without progress before a stage is killed and retried (0 = not watched)
+FFMPEG_STALL_TIMEOUT = int(environ.get('FFMPEG_STALL_TIMEOUT', 120))
+DOWNLOAD_STALL_TIMEOUT = int(environ.get('DOWNLOAD_STALL_TIMEOUT', 180))
+UPLOAD_STALL_TIMEOUT = int(environ.get('UPLOAD_STALL_TIMEOUT', 180))
+STALL_RETRIES = int(environ.get('STALL_RETRIES', 2))
+STALL_FALLBACK = environ.get('STALL_FALLBACK', 'True').lower() == 'true'  # retry FFmpeg with software decoding and -err_detect ignore_err
 
 # Create directories
 for directory in [DOWNLOAD_DIR, OUTPUT_DIR]:
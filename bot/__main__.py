@@ -3,7 +3,7 @@
 
 import asyncio
 from pyrogram import idle
-from bot import bot, LOGGER, MONGO_URI, DATABASE_NAME, OWNER_ID, db
+from bot import bot, LOGGER, MONGO_URI, DATABASE_NAME, OWNER_ID, GDRIVE_ENABLED, db
 from bot.utils.db_handler import Database
 
 async def main():
@@ -28,13 +28,35 @@ async def main():
     bot_info = await bot.get_me()
     LOGGER.info(f"Bot started: @{bot_info.username}")
     
+    # Learn this host's processing speeds from earlier runs
+    from bot.utils.eta import get_eta_model
+    await get_eta_model().load()
+    
+    # Owner-set fair share weights and quotas
+    from bot.utils.scheduler import get_scheduler
+    await get_scheduler().ffmpeg.load()
+    
+    # Start background disk janitor
+    from bot.utils.disk import janitor_loop
+    janitor = asyncio.create_task(janitor_loop())
+    
+    # Warm up heavy optional libraries in the background once online
+    if GDRIVE_ENABLED:
+        from bot.utils.lazy import preload
+        from bot.utils.gdrive import GOOGLE_MODULES
+        asyncio.create_task(preload(*GOOGLE_MODULES))
+    
     # Notify owner
     try:
+        from bot.utils.db_handler import get_db
+        db = get_db()
+        unfinished = db and await db.get_broadcast_state()
         await bot.send_message(
             OWNER_ID,
             "🚀 <b>FFmpeg Processor Bot Started!</b>\n\n"
             f"<b>Bot:</b> @{bot_info.username}\n"
             "<b>Status:</b> Online ✅"
+            + ("\n\n📢 A broadcast was interrupted, continue it with /broadcast resume" if unfinished else "")
         )
     except Exception as e:
         LOGGER.warning(f"Could not notify owner: {e}")
@@ -42,6 +64,9 @@ async def main():
     await idle()
     
     # Cleanup
+    janitor.cancel()
+    from bot.utils.pipeline import get_pipeline
+    await get_pipeline().stop()
     await bot.stop()
     LOGGER.info("Bot stopped")
 
@@ -6,10 +6,31 @@ import re
 import json
 import asyncio
 import logging
+from collections import OrderedDict
 from typing import Optional, Tuple, Dict, Any, Callable
 
 LOGGER = logging.getLogger(__name__)
 
+# ffprobe results keyed by (path, size, mtime) so edits invalidate them
+PROBE_CACHE_SIZE = 64
+_probe_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+# Retries of stalled runs drop these (input option, value) pairs to decode in software
+HWACCEL_OPTIONS = ('-hwaccel', '-hwaccel_device', '-hwaccel_output_format')
+# Outputs that make stdout the media stream, leaving no room for -progress
+STDOUT_OUTPUTS = ('-', 'pipe:', 'pipe:1')
+# Enough of stderr to show why FFmpeg failed
+STDERR_TAIL_BYTES = 16384
+
+
+def _probe_key(path: str) -> Optional[tuple]:
+    """Cache key for a local file, None for URLs or missing files"""
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return None
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
 
 class FFmpeg:
     """FFmpeg wrapper for video processing"""
@@ -26,7 +47,12 @@ class FFmpeg:
         return f"{base}_processed{ext}"
     
     async def get_media_info(self) -> Dict[str, Any]:
-        """Get media information using ffprobe"""
+        """Get media information using ffprobe (cached per file version)"""
+        key = _probe_key(self.input_file)
+        if key and key in _probe_cache:
+            _probe_cache.move_to_end(key)
+            return _probe_cache[key]
+        
         cmd = [
             'ffprobe', '-v', 'quiet',
             '-print_format', 'json',
@@ -34,7 +60,8 @@ class FFmpeg:
             self.input_file
         ]
         
-        process = await asyncio.create_subprocess_exec(
+        from bot.utils.jobs import spawn
+        process = await spawn(
             *cmd,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
@@ -47,9 +74,15 @@ class FFmpeg:
             return {}
         
         try:
-            return json.loads(stdout.decode())
+            info = json.loads(stdout.decode())
         except json.JSONDecodeError:
             return {}
+        
+        if key:
+            _probe_cache[key] = info
+            if len(_probe_cache) > PROBE_CACHE_SIZE:
+                _probe_cache.popitem(last=False)
+        return info
     
     async def get_duration(self) -> float:
         """Get video duration in seconds"""
@@ -94,54 +127,21 @@ class FFmpeg:
         full_cmd.extend(cmd)
         full_cmd.append(self.output_file)
         
-        LOGGER.info(f"Running: {' '.join(full_cmd)}")
-        
-        self.process = await asyncio.create_subprocess_exec(
-            *full_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        # Parse progress output
-        while True:
-            if self.cancelled:
-                self.process.terminate()
-                return False, "Cancelled"
-            
-            line = await self.process.stdout.readline()
-            if not line:
-                break
-                
-            line = line.decode().strip()
-            
-            # Parse out_time for progress
-            if line.startswith('out_time_ms='):
-                try:
-                    time_ms = int(line.split('=')[1])
-                    current_time = time_ms / 1_000_000
-                    if progress_callback and duration > 0:
-                        await progress_callback(current_time)
-                except ValueError:
-                    pass
-        
-        await self.process.wait()
+        from bot.ffmpeg.preview import preview_command
+        full_cmd = preview_command(full_cmd)
         
-        if self.process.returncode != 0:
-            stderr = await self.process.stderr.read()
-            error = stderr.decode().strip()
-            LOGGER.error(f"FFmpeg error: {error}")
-            return False, error
+        LOGGER.info(f"Running: {' '.join(full_cmd)}")
         
-        return True, "Success"
+        from bot.utils.jobs import track_output
+        track_output(self.output_file)
+        return await _run_watched(full_cmd, progress_callback, duration, owner=self)
     
     def cancel(self):
-        """Cancel the running process"""
+        """Cancel the running process (and anything it started)"""
         self.cancelled = True
         if self.process:
-            try:
-                self.process.terminate()
-            except Exception:
-                pass
+            from bot.utils.jobs import terminate_process_group
+            terminate_process_group(self.process)
 
 
 async def get_video_info(file_path: str) -> Dict[str, Any]:
@@ -230,49 +230,136 @@ async def run_ffmpeg_command(
 ) -> Tuple[bool, str]:
     """Run arbitrary FFmpeg command with progress"""
     
-    # Ensure command includes progress pipe if not present
-    if progress_callback and '-progress' not in cmd:
+    # Ensure command includes progress pipe if not present (the watchdog
+    # needs it too), unless the output itself goes to stdout
+    if '-progress' not in cmd and cmd[-1] not in STDOUT_OUTPUTS:
         # Insert after 'ffmpeg' (index 1) to be safe
         # Assuming cmd[0] is 'ffmpeg'
         insert_idx = 1
         cmd.insert(insert_idx, '-progress')
         cmd.insert(insert_idx+1, 'pipe:1')
     
+    from bot.ffmpeg.preview import preview_command
+    cmd = preview_command(cmd)
+    
     LOGGER.info(f"Running: {' '.join(cmd)}")
     
-    process = await asyncio.create_subprocess_exec(
+    from bot.utils.jobs import track_output
+    # FFmpeg commands end with the output file
+    track_output(cmd[-1])
+    return await _run_watched(cmd, progress_callback, duration)
+
+
+def safer_command(cmd: list) -> list:
+    """
+    Variant of an FFmpeg command for retrying a stalled run: software
+    decoding, and concealing decode errors instead of stopping on them.
+    """
+    safer = []
+    skip = False
+    for arg in cmd:
+        if skip:
+            skip = False
+        elif arg in HWACCEL_OPTIONS:
+            skip = True
+        else:
+            safer.append(arg)
+    if '-err_detect' not in safer and '-i' in safer:
+        first_input = safer.index('-i')
+        safer[first_input:first_input] = ['-err_detect', 'ignore_err']
+    return safer
+
+
+async def _drain(stream: asyncio.StreamReader, tail: bytearray):
+    """Read a stream to the end, keeping its last STDERR_TAIL_BYTES"""
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            return
+        tail.extend(chunk)
+        del tail[:-STDERR_TAIL_BYTES]
+
+
+def _error_text(tail: bytearray) -> str:
+    # Drop the periodic "frame= ... speed=" stats lines
+    lines = re.split(r'[\r\n]+', tail.decode(errors='ignore'))
+    return '\n'.join(line for line in lines if line and not line.startswith(('frame=', 'size='))).strip()
+
+
+async def _run_once(cmd: list, progress_callback: Callable, duration: float, heartbeat, owner: FFmpeg = None) -> Tuple[bool, str]:
+    """One FFmpeg run; every advance of out_time feeds the heartbeat"""
+    from bot.utils.jobs import spawn, kill_process_group
+    
+    process = await spawn(
         *cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE
     )
+    if owner is not None:
+        owner.process = process
     
-    # Parse progress output
-    while True:
-        line = await process.stdout.readline()
-        if not line:
-            break
+    # Read while it runs: a full stderr pipe blocks FFmpeg mid-encode
+    stderr_tail = bytearray()
+    stderr_task = asyncio.create_task(_drain(process.stderr, stderr_tail))
+    try:
+        # Parse progress output
+        while True:
+            if owner is not None and owner.cancelled:
+                await kill_process_group(process)
+                return False, "Cancelled"
             
-        line = line.decode().strip()
-        
-        # Parse out_time for progress
-        if line.startswith('out_time_ms='):
-            try:
-                time_ms = int(line.split('=')[1])
-                current_time = time_ms / 1_000_000
-                if progress_callback and duration:
+            line = await process.stdout.readline()
+            if not line:
+                break
+                
+            line = line.decode().strip()
+            
+            # Parse out_time for progress
+            if line.startswith('out_time_ms='):
+                try:
+                    current_time = int(line.split('=')[1]) / 1_000_000
+                except ValueError:
+                    continue
+                heartbeat.beat(current_time)
+                if progress_callback and (duration or 0) > 0:
                     try:
                         await progress_callback(current_time)
                     except Exception:
                         pass
-            except ValueError:
-                pass
-    
-    await process.wait()
+        
+        await process.wait()
+        await stderr_task
+    except asyncio.CancelledError:
+        await kill_process_group(process)
+        raise
+    finally:
+        stderr_task.cancel()
     
     if process.returncode != 0:
-        stderr = await process.stderr.read()
-        error = stderr.decode().strip()
+        error = _error_text(stderr_tail)
         LOGGER.error(f"FFmpeg error: {error}")
         return False, error
     
     return True, "Success"
+
+
+async def _run_watched(cmd: list, progress_callback: Callable, duration: float, owner: FFmpeg = None) -> Tuple[bool, str]:
+    """Run FFmpeg under the stall watchdog, retrying stalled runs (with a safer variant if enabled)"""
+    from bot import STALL_FALLBACK
+    from bot.utils.watchdog import get_watchdog, StallDetected
+    
+    async def attempt(heartbeat, number: int):
+        run_cmd = cmd
+        if number:
+            if STALL_FALLBACK:
+                run_cmd = safer_command(cmd)
+            LOGGER.info(f"Retrying stalled FFmpeg run: {' '.join(run_cmd)}")
+        return await _run_once(run_cmd, progress_callback, duration, heartbeat, owner)
+    
+    # Without a progress pipe there is nothing to watch
+    timeout = None if '-progress' in cmd else 0
+    try:
+        return await get_watchdog().run('ffmpeg', attempt, timeout)
+    except StallDetected as e:
+        LOGGER.error(f"{e}: {' '.join(cmd)}")
+        return False, str(e)
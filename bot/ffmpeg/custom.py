@@ -1,18 +1,622 @@
 #!/usr/bin/env python3
-"""Custom FFmpeg command execution"""
+"""Custom FFmpeg command execution, limited to allow-listed output options and filters"""
 
+import re
 import shlex
-from typing import Tuple
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
 from bot.ffmpeg.core import FFmpeg
+from bot.ffmpeg.settings import AUDIO_CODECS, PRESETS, VIDEO_CODECS, encoder_threads
+
+LOGGER = logging.getLogger(__name__)
+
+# Output options users may pass (with or without a stream specifier) and the check for their value
+FLAG = None
+OPTIONS = {
+    '-c': 'codec', '-codec': 'codec', '-vcodec': 'codec', '-acodec': 'codec', '-scodec': 'codec',
+    '-preset': 'preset', '-threads': 'int',
+    '-tune': 'name', '-profile': 'name', '-level': 'name', '-pix_fmt': 'name', '-strict': 'name',
+    '-movflags': 'name', '-disposition': 'name', '-f': 'format',
+    '-crf': 'number', '-qp': 'int', '-q': 'number', '-qscale': 'number', '-cq': 'int',
+    '-b': 'amount', '-ab': 'amount', '-maxrate': 'amount', '-minrate': 'amount', '-bufsize': 'amount', '-fs': 'amount',
+    '-r': 'rate', '-g': 'int', '-keyint_min': 'int', '-bf': 'int', '-refs': 'int', '-sc_threshold': 'int',
+    '-s': 'size', '-aspect': 'aspect', '-ar': 'int', '-ac': 'int',
+    '-vf': 'filter', '-af': 'filter', '-filter': 'filter', '-filter_complex': 'filter', '-lavfi': 'filter',
+    '-map': 'map', '-map_metadata': 'int', '-map_chapters': 'int', '-metadata': 'text',
+    '-ss': 'time', '-t': 'time', '-to': 'time', '-frames': 'int', '-vframes': 'int',
+    '-x264-params': 'params', '-x265-params': 'params',
+    '-cpu-used': 'int', '-deadline': 'deadline', '-row-mt': 'int',
+    '-an': FLAG, '-vn': FLAG, '-sn': FLAG, '-dn': FLAG, '-shortest': FLAG,
+}
+VALUE_PATTERNS = {
+    'int': r'-?\d+',
+    'number': r'-?\d+(\.\d+)?',
+    'amount': r'\d+(\.\d+)?[kKmMgG]?',
+    'rate': r'\d+(\.\d+)?(/\d+(\.\d+)?)?',
+    'size': r'\d+x\d+',
+    'aspect': r'\d+(\.\d+)?([:/]\d+(\.\d+)?)?',
+    'time': r'(\d+:){0,2}\d+(\.\d+)?',
+    'name': r'[A-Za-z0-9_.+-]+',
+    'map': r'-?0(:[vasdt])?(:\d+)?\??',
+    'text': r'[^\x00-\x1f]{0,256}',
+    'params': r'[A-Za-z0-9_.,=:+-]+',
+}
+SUBTITLE_CODECS = {'copy', 'mov_text', 'srt', 'subrip', 'ass', 'ssa', 'webvtt'}
+EXTRA_CODECS = {'libvorbis', 'mpeg4', 'pcm_s16le', 'gif'}
+FORMATS = {'mp4', 'matroska', 'mov', 'webm', 'avi', 'mpegts', 'ipod', 'mp3', 'adts', 'flac', 'ogg', 'opus', 'wav', 'gif'}
+
+# Encoder parameters that don't touch files or the thread budget
+ENCODER_PARAMS = {
+    'ref', 'bframes', 'b-adapt', 'b-pyramid', 'me', 'subme', 'merange', 'aq-mode', 'aq-strength', 'psy-rd',
+    'psy-rdoq', 'deblock', 'keyint', 'min-keyint', 'scenecut', 'rc-lookahead', 'sao', 'no-sao', 'cabac',
+    'weightp', 'weightb', 'qcomp', 'crf', 'log-level', 'profile', 'level', 'colorprim', 'transfer',
+    'colormatrix', 'range', 'repeat-headers', 'open-gop', 'no-open-gop', 'ctu', 'limit-sao', 'rd',
+    'strong-intra-smoothing', 'tu-intra-depth', 'tu-inter-depth', 'hdr-opt', 'hdr10-opt',
+    'master-display', 'max-cll', 'fast-pskip', '8x8dct', 'trellis', 'no-dct-decimate', 'nr',
+}
+# Parameters whose higher values cost CPU, lowered to about what -preset slow uses
+PARAM_LIMITS = {
+    'ref': 5, 'bframes': 8, 'b-adapt': 1, 'subme': 7, 'merange': 24, 'rc-lookahead': 60,
+    'trellis': 1, 'rd': 4, 'tu-intra-depth': 2, 'tu-inter-depth': 2,
+}
+OPTION_LIMITS = {'-refs': 'ref', '-bf': 'bframes'}
+ME_METHODS = {'dia', 'hex', 'umh', '0', '1', '2'}
+# Dropped with a note: the thread budget is set by -threads
+THREAD_PARAMS = {'threads', 'pools', 'frame-threads', 'lookahead-threads'}
+
+# -preset does nothing for these encoders, -cpu-used (higher is faster) is raised to at least this
+SPEED_FLOORS = {'libvpx-vp9': 4, 'libaom-av1': 6}
+DEADLINES = {'best', 'good', 'realtime', 'rt'}
+
+# Allowed filters and roughly how much they slow an encode down
+FILTERS = {
+    'scale': 1.0, 'crop': 1.0, 'pad': 1.0, 'fps': 1.0, 'setsar': 1.0, 'setdar': 1.0, 'format': 1.0,
+    'transpose': 1.0, 'hflip': 1.0, 'vflip': 1.0, 'rotate': 1.1, 'setpts': 1.0, 'trim': 1.0,
+    'select': 1.0, 'null': 1.0, 'split': 1.0, 'fade': 1.0, 'drawbox': 1.0, 'drawtext': 1.1,
+    'eq': 1.1, 'hue': 1.1, 'curves': 1.1, 'colorchannelmixer': 1.1, 'vignette': 1.2, 'noise': 1.2,
+    'overlay': 1.2, 'hstack': 1.1, 'vstack': 1.1, 'unsharp': 1.3, 'boxblur': 1.3, 'gblur': 1.3,
+    'yadif': 1.3, 'bwdif': 1.4, 'hqdn3d': 1.5, 'deband': 1.5, 'nlmeans': 8.0, 'minterpolate': 10.0,
+    'volume': 1.0, 'loudnorm': 1.0, 'aresample': 1.0, 'atempo': 1.0, 'afade': 1.0, 'pan': 1.0,
+    'atrim': 1.0, 'asetpts': 1.0, 'aformat': 1.0, 'highpass': 1.0, 'lowpass': 1.0, 'equalizer': 1.0,
+    'acompressor': 1.0, 'anull': 1.0, 'asplit': 1.0, 'amix': 1.0,
+}
+# Filter options that read files on the host
+FILE_OPTIONS = {'file', 'filename', 'f', 'textfile', 'fontfile', 'psfile'}
+# Filters whose first positional option is a file
+NAMED_ONLY = {'drawtext'}
+
+# Largest output frame (4K), and the fastest preset quota downgrades go to
+MAX_OUTPUT_PIXELS = 3840 * 2160
+FASTEST_DOWNGRADE = 'veryfast'
+# Highest output frame rate, and how far setpts may slow a video down
+MAX_OUTPUT_FPS = 120
+MAX_TIME_STRETCH = 4.0
+NAMED_RATES = {'ntsc': 30000 / 1001, 'pal': 25.0, 'film': 24.0, 'ntsc_film': 24000 / 1001}
+
+
+class InvalidCommand(ValueError):
+    pass
+
+
+@dataclass
+class CustomCommand:
+    """Parsed custom output arguments"""
+
+    options: List[List[str]] = field(default_factory=list)  # [option] or [option, value], in order
+    video_codec: Optional[str] = None
+    preset: Optional[str] = None
+    threads: Optional[int] = None
+    cpu_used: Optional[int] = None
+    deadline: Optional[str] = None
+    rate: Optional[float] = None  # -r
+    filter_fps: Optional[float] = None  # last fps / minterpolate rate in the filters
+    time_factor: float = 1.0  # output duration relative to the input, from setpts
+    frames: List[list] = field(default_factory=list)  # size-changing filter steps, per filter chain
+    filter_cost: float = 1.0
+    limit: Optional[float] = None  # seconds of output asked for with -t
+    notes: List[str] = field(default_factory=list)
+
+    @property
+    def encodes_video(self) -> bool:
+        return self.video_codec != 'copy' and not any(o[0] == '-vn' for o in self.options)
+
+    @property
+    def output_fps(self) -> Optional[float]:
+        # -r applies after the filters, so it wins
+        return self.rate or self.filter_fps
+
+    def frame_sizes(self, source: Tuple[int, int]) -> Optional[List[Tuple[int, int]]]:
+        """
+        Every frame size the command produces for a source size, in order;
+        None if it resizes but the source size is unknown.
+
+        Steps within a chain follow each other. A filtergraph chain may
+        start from any earlier chain's output, so it starts from the
+        largest frame seen so far.
+        """
+        if not self.frames:
+            return []
+        if not source or not source[0] or not source[1]:
+            return None
+        sizes = []
+        largest = source
+        for chain in self.frames:
+            frame = largest
+            for step in chain:
+                frame = _apply_step(step, frame)
+                sizes.append(frame)
+                if frame[0] * frame[1] > largest[0] * largest[1]:
+                    largest = frame
+        return sizes
+
+    def output_size(self, source: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        """Output frame size for a source size, None if it can't be told"""
+        sizes = self.frame_sizes(source)
+        if sizes is None:
+            return None
+        if sizes:
+            return sizes[-1]
+        return source if source and source[1] else None
+
+    def args(self) -> List[str]:
+        args = [arg for option in self.options for arg in option]
+        if self.preset:
+            args += ['-preset', self.preset]
+        if self.threads and self.encodes_video:
+            args += ['-threads', str(self.threads)]
+        if self.cpu_used is not None:
+            args += ['-cpu-used', str(self.cpu_used)]
+        if self.deadline:
+            args += ['-deadline', self.deadline]
+        return args
+
+
+def _dimension(value: str, frame: Tuple[int, int]) -> Optional[int]:
+    """A size: a number, or iw/ih with one number (iw*2, 4*ih, ih/2, ih+100); None for other expressions"""
+    value = value.strip().strip("'")
+    if re.fullmatch(r'-?\d+', value):
+        return int(value)
+    match = re.fullmatch(
+        r'(?:(\d+(?:\.\d+)?)\s*\*\s*)?(iw|ih|in_w|in_h)\s*(?:([-+*/])\s*(\d+(?:\.\d+)?))?', value
+    )
+    if not match:
+        return None
+    size = frame[0] if match.group(2) in ('iw', 'in_w') else frame[1]
+    if match.group(1):
+        size *= float(match.group(1))
+    number = float(match.group(4) or 0)
+    if match.group(3) == '*':
+        size *= number
+    elif match.group(3) == '/':
+        if not number:
+            return None
+        size /= number
+    elif match.group(3) == '+':
+        size += number
+    elif match.group(3) == '-':
+        size -= number
+    return int(size)
+
+
+def _apply_step(step: tuple, frame: Tuple[int, int]) -> Tuple[int, int]:
+    """Frame size after a step recorded by _size_step"""
+    kind = step[0]
+    if kind == 'transpose':
+        # With passthrough the frame may or may not turn, assume the larger
+        return (max(frame),) * 2 if step[1] else (frame[1], frame[0])
+    if kind == 'stack':
+        _, axis, inputs = step
+        return (frame[0] * inputs, frame[1]) if axis == 'h' else (frame[0], frame[1] * inputs)
+
+    width, height = (_dimension(value, frame) for value in step[1:3])
+    if kind == 'pad':
+        # 0 keeps the input size, and padding never shrinks the frame
+        return max(width, frame[0]), max(height, frame[1])
+
+    # 0 keeps the input size, -1 / -2 keep the input aspect ratio
+    width = width or frame[0]
+    height = height or frame[1]
+    if width < 0 and height < 0:
+        return frame
+    if width < 0:
+        width = round(height * frame[0] / frame[1])
+    elif height < 0:
+        height = round(width * frame[1] / frame[0])
+    if step[3] != 'disable':
+        # Fit the frame inside (decrease) or around (increase) the box
+        factor = (min if step[3] == 'decrease' else max)(width / frame[0], height / frame[1])
+        width, height = round(frame[0] * factor), round(frame[1] * factor)
+    return max(width, 1), max(height, 1)
+
+
+def _size_step(name: str, named: dict, positional: list) -> Optional[tuple]:
+    """The frame size change of a filter, None for filters that keep it"""
+    if name == 'scale':
+        size = named.get('s', named.get('size'))
+        if size is not None:
+            match = re.fullmatch(r"'?(\d+)x(\d+)'?", size.strip())
+            if not match:
+                raise InvalidCommand(f"Give scale sizes as WIDTHxHEIGHT, not {size}")
+            width, height = match.groups()
+        else:
+            width = named.get('w', named.get('width', positional[0] if positional else 'iw'))
+            height = named.get('h', named.get('height', positional[1] if len(positional) > 1 else 'ih'))
+        fit = named.get('force_original_aspect_ratio', 'disable').strip("'")
+        fit = {'0': 'disable', '1': 'decrease', '2': 'increase'}.get(fit, fit)
+        if fit not in ('disable', 'decrease', 'increase'):
+            raise InvalidCommand(f"Invalid force_original_aspect_ratio: {fit}")
+        step = ('scale', width, height, fit)
+    elif name == 'pad':
+        if 'aspect' in named:
+            raise InvalidCommand("pad aspect is not supported, give a width and height")
+        width = named.get('w', named.get('width', positional[0] if positional else '0'))
+        height = named.get('h', named.get('height', positional[1] if len(positional) > 1 else '0'))
+        step = ('pad', width, height)
+    elif name in ('hstack', 'vstack'):
+        inputs = named.get('inputs', positional[0] if positional else '2').strip("'")
+        if not re.fullmatch(r'\d{1,2}', inputs):
+            raise InvalidCommand(f"Invalid {name} inputs: {inputs}")
+        return 'stack', name[0], int(inputs)
+    elif name == 'transpose':
+        passthrough = named.get('passthrough', positional[1] if len(positional) > 1 else 'none').strip("'")
+        return 'transpose', passthrough not in ('none', '0')
+    elif name == 'rotate':
+        if len(positional) > 1 or {'out_w', 'ow', 'out_h', 'oh'} & set(named):
+            raise InvalidCommand("rotate can't change the frame size")
+        return None
+    else:
+        return None
+
+    # Refuse what the size check could not follow
+    for value in step[1:3]:
+        if _dimension(value, (1, 1)) is None:
+            raise InvalidCommand(
+                f"Can't tell the output size of {name} from {value.strip()}; "
+                f"use numbers or iw/ih with one number"
+            )
+    return step
+
+
+def _rate(value: str) -> Optional[float]:
+    """A frame rate: a number, a fraction or a named rate; None for anything else"""
+    value = value.strip().strip("'")
+    if value in NAMED_RATES:
+        return NAMED_RATES[value]
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)(?:/(\d+(?:\.\d+)?))?', value)
+    if not match or not float(match.group(2) or 1):
+        return None
+    return float(match.group(1)) / float(match.group(2) or 1)
+
+
+def _output_rate(value: str, where: str) -> float:
+    rate = _rate(value)
+    if not rate:
+        raise InvalidCommand(f"Invalid frame rate for {where}: {value}")
+    if rate > MAX_OUTPUT_FPS:
+        raise InvalidCommand(f"Frame rate {rate:g} for {where} is above the {MAX_OUTPUT_FPS} fps limit")
+    return rate
+
+
+def _stretch(expr: str) -> float:
+    """How much a setpts expression stretches time: K*PTS, PTS*K or PTS/K (minus STARTPTS)"""
+    expr = re.sub(r'\s+', '', expr.strip("'"))
+    if expr in ('N/FRAME_RATE/TB', 'N/(FRAME_RATE*TB)'):
+        return 1.0
+    match = re.fullmatch(r'(?:(\d+(?:\.\d+)?)\*)?\(?PTS(?:-STARTPTS)?\)?(?:([*/])(\d+(?:\.\d+)?))?', expr)
+    if not match:
+        raise InvalidCommand(f"Can't tell how setpts={expr} changes the duration; use K*PTS or PTS/K")
+    factor = float(match.group(1) or 1)
+    number = float(match.group(3) or 1)
+    if match.group(2) == '*':
+        factor *= number
+    elif match.group(2) == '/':
+        factor = factor / number if number else 0
+    if factor <= 0:
+        raise InvalidCommand(f"Invalid setpts: {expr}")
+    if factor > MAX_TIME_STRETCH:
+        raise InvalidCommand(f"setpts slows the video down {factor:g}x, at most {MAX_TIME_STRETCH:g}x is allowed")
+    return factor
+
 
-async def execute_custom_command(input_file: str, args: str, output_file: str) -> Tuple[bool, str]:
+def _capped(command: CustomCommand, label: str, value: str, limit: int) -> int:
+    """An integer setting lowered to limit, with a note when it was above"""
+    if not re.fullmatch(r'\d+', value):
+        raise InvalidCommand(f"Invalid value for {label}: {value}")
+    if int(value) > limit:
+        command.notes.append(f"{label} {value} lowered to {limit}")
+    return min(int(value), limit)
+
+
+def _seconds(value: str) -> float:
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def _split(text: str, separators: str) -> List[str]:
+    """Split filtergraph text on separators outside quotes, [labels] and escapes"""
+    parts, current = [], ''
+    quoted = escaped = False
+    depth = 0
+    for char in text:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == "'":
+            quoted = not quoted
+        elif not quoted and char == '[':
+            depth += 1
+        elif not quoted and char == ']':
+            depth -= 1
+        elif not quoted and not depth and char in separators:
+            parts.append(current)
+            current = ''
+            continue
+        current += char
+    if quoted or depth:
+        raise InvalidCommand("Unbalanced quotes or brackets in filter")
+    parts.append(current)
+    return parts
+
+
+def _check_filters(command: CustomCommand, graph: str):
+    for chain_text in _split(graph, ';'):
+        chain = []
+        for text in _split(chain_text, ','):
+            # Strip [in] / [out] link labels
+            text = re.sub(r'^\s*(\[[^\]]*\]\s*)*', '', text)
+            text = re.sub(r'(\s*\[[^\]]*\])*\s*$', '', text)
+            if not text:
+                continue
+            name, _, arguments = text.partition('=')
+            name = name.split('@')[0].strip()
+            if name not in FILTERS:
+                raise InvalidCommand(f"Filter not allowed: {name}")
+            command.filter_cost *= FILTERS[name]
+
+            positional, named = [], {}
+            for argument in _split(arguments, ':') if arguments else []:
+                key, has_value, value = argument.partition('=')
+                if not has_value:
+                    positional.append(argument)
+                elif key.strip() in FILE_OPTIONS:
+                    raise InvalidCommand(f"Filter option not allowed: {name} {key.strip()}")
+                else:
+                    named[key.strip()] = value
+            if positional and name in NAMED_ONLY:
+                raise InvalidCommand(f"Use named options (key=value) for {name}")
+
+            if name in ('fps', 'minterpolate'):
+                # fps defaults to 25, minterpolate to 60
+                default = '25' if name == 'fps' else '60'
+                command.filter_fps = _output_rate(named.get('fps', positional[0] if positional else default), name)
+            elif name == 'setpts':
+                command.time_factor *= _stretch(named.get('expr', positional[0] if positional else 'PTS'))
+
+            step = _size_step(name, named, positional)
+            if step:
+                chain.append(step)
+        if chain:
+            command.frames.append(chain)
+
+
+def _check_encoder_params(command: CustomCommand, option: str, value: str) -> str:
+    kept = []
+    for param in value.split(':'):
+        key, _, setting = param.partition('=')
+        if key in THREAD_PARAMS:
+            command.notes.append(f"{option} {key} dropped, threads follow the bot's budget")
+            continue
+        if key not in ENCODER_PARAMS:
+            raise InvalidCommand(f"Encoder parameter not allowed: {key}")
+        if key == 'me' and setting not in ME_METHODS:
+            raise InvalidCommand(f"{option} me={setting} not allowed, use dia, hex or umh")
+        if key in PARAM_LIMITS:
+            param = f"{key}={_capped(command, f'{option} {key}', setting, PARAM_LIMITS[key])}"
+        kept.append(param)
+    return ':'.join(kept)
+
+
+def parse_custom_command(text: str) -> CustomCommand:
+    """
+    Parse user FFmpeg arguments into a CustomCommand.
+
+    Only allow-listed output options with checked values are accepted; the
+    bot supplies the input and output, so anything positional (extra
+    inputs or outputs) is refused, as are filters that read files.
+    Raises InvalidCommand.
+    """
+    try:
+        tokens = shlex.split(text)
+    except ValueError as e:
+        raise InvalidCommand(f"Invalid arguments: {e}")
+    if not tokens:
+        raise InvalidCommand("No arguments given")
+
+    command = CustomCommand()
+    i = 0
+    while i < len(tokens):
+        option = tokens[i]
+        base, _, stream = option.partition(':')
+        if not option.startswith('-') or base not in OPTIONS:
+            raise InvalidCommand(f"Option not allowed: {option}")
+        kind = OPTIONS[base]
+        if kind is FLAG:
+            command.options.append([option])
+            i += 1
+            continue
+        if i + 1 >= len(tokens):
+            raise InvalidCommand(f"Missing value for {option}")
+        value = tokens[i + 1]
+        i += 2
+
+        if kind in VALUE_PATTERNS:
+            if not re.fullmatch(VALUE_PATTERNS[kind], value):
+                raise InvalidCommand(f"Invalid value for {option}: {value}")
+        elif kind == 'codec':
+            kind_of_stream = {'-vcodec': 'v', '-acodec': 'a', '-scodec': 's'}.get(base, stream[:1])
+            allowed = {
+                'v': set(VIDEO_CODECS) | EXTRA_CODECS,
+                'a': set(AUDIO_CODECS) | EXTRA_CODECS,
+                's': SUBTITLE_CODECS,
+            }.get(kind_of_stream, set(VIDEO_CODECS) | set(AUDIO_CODECS) | SUBTITLE_CODECS | EXTRA_CODECS)
+            if value not in allowed:
+                raise InvalidCommand(f"Codec not allowed: {value}")
+            if kind_of_stream == 'v' or (not kind_of_stream and value in VIDEO_CODECS):
+                command.video_codec = VIDEO_CODECS.get(value, value)
+        elif kind == 'format' and value not in FORMATS:
+            raise InvalidCommand(f"Format not allowed: {value}")
+        elif kind == 'deadline':
+            if value not in DEADLINES:
+                raise InvalidCommand(f"Unknown deadline: {value}")
+            command.deadline = value
+            continue
+        elif kind == 'preset':
+            if value not in PRESETS:
+                raise InvalidCommand(f"Unknown preset: {value}")
+            command.preset = value
+            continue
+        elif kind == 'filter':
+            _check_filters(command, value)
+
+        if base == '-threads':
+            command.threads = max(int(value), 1)
+            continue
+        if base == '-cpu-used':
+            command.cpu_used = int(value)
+            continue
+        if base in OPTION_LIMITS:
+            value = str(_capped(command, option, value, PARAM_LIMITS[OPTION_LIMITS[base]]))
+        if base == '-r':
+            command.rate = _output_rate(value, option)
+        if base in ('-x264-params', '-x265-params'):
+            value = _check_encoder_params(command, option, value)
+            if not value:
+                continue
+        if base == '-s':
+            # Scales the filtered frame to an absolute size
+            command.frames.append([('scale', *value.split('x'), 'disable')])
+        if base == '-t':
+            command.limit = _seconds(value)
+        command.options.append([option, value])
+    return command
+
+
+def estimate_cpu_seconds(command: CustomCommand, duration: float, height: int = None, source_fps: float = None) -> float:
+    """
+    CPU-seconds a command is expected to take, from the throughput model.
+
+    The model is per second of source; setpts stretches the output and a
+    higher output frame rate adds frames to encode.
+    """
+    from bot.utils.eta import get_eta_model
+
+    seconds = (duration or 0) * command.time_factor
+    if command.limit:
+        seconds = min(seconds, command.limit)
+    if command.encodes_video:
+        options = {
+            'video_codec': command.video_codec or 'libx264',
+            'preset': command.preset or 'medium',
+            'resolution': f"{height}p" if height else None,
+        }
+        frame_factor = command.output_fps / source_fps if command.output_fps and source_fps else 1.0
+        wall = get_eta_model().predict('encode', options, seconds) * command.filter_cost * frame_factor
+    else:
+        wall = get_eta_model().predict('ffmpeg_cmd', None, seconds)
+    return wall * (command.threads or encoder_threads())
+
+
+async def plan_custom_command(command: CustomCommand, input_file: str, user_id: int = None, chat_id: int = None) -> CustomCommand:
+    """
+    Fit a parsed command to the host before it runs: output size capped,
+    threads and preset clamped to the scheduler's budget, VP9/AV1 held to
+    a speed floor, and the preset stepped down (or the job refused) when
+    its estimated CPU-seconds would overrun the user's or group's quota.
+    """
+    from bot import CUSTOM_MAX_PRESET
+    from bot.utils.scheduler import get_scheduler
+
+    ffmpeg = FFmpeg(input_file)
+    duration = await ffmpeg.get_duration()
+    streams = await ffmpeg.get_streams()
+    video = streams['video'][0] if streams['video'] else {}
+    source = (video.get('width') or 0, video.get('height') or 0)
+    sizes = command.frame_sizes(source)
+    if sizes is None:
+        raise InvalidCommand("Can't tell the output size: the input has no video size to scale from")
+    for width, height in sizes:
+        if width * height > MAX_OUTPUT_PIXELS:
+            raise InvalidCommand(f"Frame size {width}x{height} is above the 4K limit")
+    size = command.output_size(source)
+    height = size[1] if size else None
+    source_fps = _rate(video.get('avg_frame_rate') or video.get('r_frame_rate') or '')
+
+    budget = encoder_threads()
+    if command.threads and command.threads > budget:
+        command.notes.append(f"-threads {command.threads} lowered to {budget}")
+    command.threads = min(command.threads or budget, budget)
+
+    if command.encodes_video and command.preset and CUSTOM_MAX_PRESET in PRESETS:
+        if PRESETS.index(command.preset) > PRESETS.index(CUSTOM_MAX_PRESET):
+            command.notes.append(f"-preset {command.preset} lowered to {CUSTOM_MAX_PRESET}")
+            command.preset = CUSTOM_MAX_PRESET
+
+    floor = SPEED_FLOORS.get(command.video_codec)
+    if floor is not None and command.encodes_video:
+        if command.cpu_used is not None and abs(command.cpu_used) < floor:
+            command.notes.append(f"-cpu-used {command.cpu_used} raised to {floor}")
+        if command.cpu_used is None or abs(command.cpu_used) < floor:
+            command.cpu_used = floor
+        if command.deadline == 'best':
+            command.notes.append("-deadline best lowered to good")
+            command.deadline = 'good'
+
+    if user_id is None:
+        return command
+    fairshare = get_scheduler().ffmpeg
+    cost = estimate_cpu_seconds(command, duration, height, source_fps)
+    for tenant in fairshare.tenants_of(user_id, chat_id):
+        quota = fairshare.quota(tenant)
+        if not quota:
+            continue
+        left = max(quota - fairshare.used(tenant), 0)
+        requested = command.preset or 'medium'
+        while cost > left and command.encodes_video and PRESETS.index(command.preset or 'medium') > PRESETS.index(FASTEST_DOWNGRADE):
+            command.preset = PRESETS[PRESETS.index(command.preset or 'medium') - 1]
+            cost = estimate_cpu_seconds(command, duration, height, source_fps)
+        if cost <= left and command.preset and command.preset != requested:
+            command.notes.append(f"-preset {requested} lowered to {command.preset} to fit the CPU quota")
+        if cost > left:
+            who = "this group's" if tenant[0] == 'group' else "your"
+            raise InvalidCommand(
+                f"This command needs about {cost:.0f} CPU-seconds but only {left:.0f} of {who} "
+                f"{quota:.0f} are left in this period"
+            )
+    return command
+
+
+async def execute_custom_command(
+    input_file: str,
+    args: str,
+    output_file: str,
+    progress_callback: Callable = None,
+    duration: float = None,
+    user_id: int = None,
+    chat_id: int = None
+) -> Tuple[bool, str]:
     """Execute custom FFmpeg arguments"""
     ffmpeg = FFmpeg(input_file, output_file)
-    
-    # Split arguments
+
     try:
-        cmd_args = shlex.split(args)
-    except Exception as e:
-        return False, f"Invalid arguments: {e}"
-    
-    return await ffmpeg.run_ffmpeg(cmd_args)
+        command = await plan_custom_command(parse_custom_command(args), input_file, user_id, chat_id)
+    except InvalidCommand as e:
+        return False, str(e)
+    for note in command.notes:
+        LOGGER.info(f"Custom command of {user_id}: {note}")
+
+    return await ffmpeg.run_ffmpeg(command.args(), progress_callback, duration)
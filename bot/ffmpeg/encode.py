@@ -2,11 +2,14 @@
 """Video encoding and conversion operations"""
 
 import os
+import glob
 import asyncio
 import logging
 from typing import Callable, Tuple, Optional
 
 from bot.ffmpeg.core import FFmpeg, run_ffmpeg_command
+from bot.ffmpeg.quality import CRF_RANGES, find_crf_for_quality
+from bot.ffmpeg.settings import EncodeSettings, InvalidSettings, compile_encode_args, encoder_threads
 
 LOGGER = logging.getLogger(__name__)
 
@@ -14,44 +17,31 @@ LOGGER = logging.getLogger(__name__)
 async def encode_video(
     input_file: str,
     output: str,
-    video_codec: str = 'libx264',
-    audio_codec: str = 'aac',
-    crf: int = 23,
-    preset: str = 'medium',
-    resolution: str = None,
-    fps: int = None,
-    audio_bitrate: str = '192k',
-    progress_callback: Callable = None
+    settings: EncodeSettings | dict = None,
+    progress_callback: Callable = None,
+    status_callback: Callable = None
 ) -> Tuple[bool, str]:
-    """Encode video with custom settings"""
-    
-    ffmpeg = FFmpeg(input_file, output)
-    
-    cmd = ['-c:v', video_codec]
-    
-    # CRF quality (for x264/x265)
-    if video_codec in ['libx264', 'libx265']:
-        cmd.extend(['-crf', str(crf)])
-        cmd.extend(['-preset', preset])
-    elif video_codec == 'libvpx-vp9':
-        cmd.extend(['-crf', str(crf), '-b:v', '0'])
+    """Encode video with the user's settings (target_quality picks the CRF from sample probes)"""
     
-    # Resolution
-    if resolution and resolution != 'original':
-        cmd.extend(['-vf', f'scale={resolution}'])
+    if not isinstance(settings, EncodeSettings):
+        try:
+            settings = EncodeSettings.from_dict(settings)
+        except InvalidSettings as e:
+            return False, f"Invalid encode settings: {e}"
     
-    # FPS
-    if fps:
-        cmd.extend(['-r', str(fps)])
-    
-    # Audio
-    cmd.extend(['-c:a', audio_codec])
-    if audio_bitrate:
-        cmd.extend(['-b:a', audio_bitrate])
-    
-    # Copy subtitles if present
-    cmd.extend(['-c:s', 'copy'])
+    ffmpeg = FFmpeg(input_file, output)
     
+    if settings.target_quality and settings.video_codec in CRF_RANGES:
+        success, result = await find_crf_for_quality(
+            input_file, settings.target_quality, settings.video_codec, settings.preset,
+            settings.scale, status_callback
+        )
+        if not success:
+            return False, result
+        LOGGER.info(f"Target quality {settings.target_quality} -> CRF {result}")
+        settings = settings.replace(crf=result)
+    
+    cmd = list(compile_encode_args(settings, encoder_threads()))
     success, error = await ffmpeg.run_ffmpeg(cmd, progress_callback)
     
     if not success:
@@ -60,6 +50,110 @@ async def encode_video(
     return True, output
 
 
+# Codecs each container accepts as-is (None = anything goes)
+CONTAINER_CODECS = {
+    'mp4': {
+        'video': {'h264', 'hevc', 'av1', 'mpeg4', 'vp9', 'mpeg2video', 'mjpeg'},
+        'audio': {'aac', 'mp3', 'ac3', 'eac3', 'opus', 'flac', 'alac'},
+        'subtitle': {'mov_text'},
+    },
+    'mov': {
+        'video': {'h264', 'hevc', 'mpeg4', 'prores', 'mjpeg', 'png'},
+        'audio': {'aac', 'mp3', 'alac', 'ac3', 'pcm_s16le', 'pcm_s24le'},
+        'subtitle': {'mov_text'},
+    },
+    'mkv': None,
+    'webm': {
+        'video': {'vp8', 'vp9', 'av1'},
+        'audio': {'opus', 'vorbis'},
+        'subtitle': {'webvtt'},
+    },
+    'avi': {
+        'video': {'h264', 'mpeg4', 'mjpeg', 'msmpeg4v3'},
+        'audio': {'mp3', 'ac3', 'aac', 'pcm_s16le'},
+        'subtitle': set(),
+    },
+    'flv': {
+        'video': {'h264', 'flv1'},
+        'audio': {'aac', 'mp3'},
+        'subtitle': set(),
+    },
+    'ts': {
+        'video': {'h264', 'hevc', 'mpeg2video'},
+        'audio': {'aac', 'mp3', 'mp2', 'ac3', 'eac3', 'opus'},
+        'subtitle': {'dvb_subtitle'},
+    },
+}
+
+# Encoders used for streams the target container can't hold as-is
+CONTAINER_ENCODERS = {
+    'mp4': {'video': 'libx264', 'audio': 'aac', 'subtitle': 'mov_text'},
+    'mov': {'video': 'libx264', 'audio': 'aac', 'subtitle': 'mov_text'},
+    'webm': {'video': 'libvpx-vp9', 'audio': 'libopus', 'subtitle': 'webvtt'},
+    'avi': {'video': 'libx264', 'audio': 'libmp3lame', 'subtitle': None},
+    'flv': {'video': 'libx264', 'audio': 'aac', 'subtitle': None},
+    'ts': {'video': 'libx264', 'audio': 'aac', 'subtitle': None},
+}
+
+# Only text subtitles can be converted between subtitle codecs
+TEXT_SUBTITLE_CODECS = {'subrip', 'srt', 'ass', 'ssa', 'webvtt', 'mov_text', 'text'}
+
+
+def build_stream_args(streams: list, output_format: str) -> Tuple[list, int, int]:
+    """
+    Build -map/-c arguments that copy every stream the container accepts
+    and transcode (or drop) the rest.
+
+    Returns:
+        (args, copied count, transcoded count)
+    """
+    accepted = CONTAINER_CODECS.get(output_format)
+    encoders = CONTAINER_ENCODERS.get(output_format, {})
+    args = []
+    out_index = 0
+    copied = transcoded = 0
+
+    for stream in streams:
+        codec_type = stream.get('codec_type')
+        codec = stream.get('codec_name')
+        is_cover = stream.get('disposition', {}).get('attached_pic') == 1
+
+        if codec_type not in ('video', 'audio', 'subtitle'):
+            # Fonts and other attachments only survive in Matroska
+            if accepted is None and codec_type == 'attachment':
+                args.extend(['-map', f"0:{stream['index']}", f'-c:{out_index}', 'copy'])
+                out_index += 1
+            continue
+
+        if accepted is None or codec in accepted[codec_type]:
+            args.extend(['-map', f"0:{stream['index']}", f'-c:{out_index}', 'copy'])
+            if codec == 'hevc' and output_format in ('mp4', 'mov'):
+                # Tag HEVC so Apple players/Telegram recognise it
+                args.extend([f'-tag:{out_index}', 'hvc1'])
+            copied += 1
+            out_index += 1
+            continue
+
+        encoder = encoders.get(codec_type)
+        if not encoder or is_cover:
+            continue
+        if codec_type == 'subtitle' and codec not in TEXT_SUBTITLE_CODECS:
+            # Image subtitles (PGS/VobSub) can't become text subtitles
+            continue
+
+        args.extend(['-map', f"0:{stream['index']}", f'-c:{out_index}', encoder])
+        if encoder == 'libx264':
+            args.extend([f'-crf:{out_index}', '23', f'-preset:{out_index}', 'medium'])
+        elif encoder == 'libvpx-vp9':
+            args.extend([f'-crf:{out_index}', '32', f'-b:{out_index}', '0'])
+        elif codec_type == 'audio':
+            args.extend([f'-b:{out_index}', '192k'])
+        transcoded += 1
+        out_index += 1
+
+    return args, copied, transcoded
+
+
 async def convert_format(
     input_file: str,
     output_format: str,
@@ -67,39 +161,31 @@ async def convert_format(
     progress_callback: Callable = None,
     duration: float = None
 ) -> Tuple[bool, str]:
-    """Convert video to different container format"""
+    """Convert video to different container format, copying streams where possible"""
     
     if output is None:
         base = os.path.splitext(input_file)[0]
         output = f"{base}.{output_format}"
     
-    # Map format to codec settings
-    format_settings = {
-        'mp4': {'v': 'copy', 'a': 'aac'},
-        'mkv': {'v': 'copy', 'a': 'copy'},
-        'avi': {'v': 'copy', 'a': 'copy'},
-        'webm': {'v': 'libvpx-vp9', 'a': 'libopus'},
-        'mov': {'v': 'copy', 'a': 'aac'},
-        'flv': {'v': 'copy', 'a': 'aac'},
-        'ts': {'v': 'copy', 'a': 'copy'},
-        'gif': {'v': 'gif', 'a': None},
-    }
-    
-    settings = format_settings.get(output_format, {'v': 'copy', 'a': 'copy'})
-    
     cmd = [
         'ffmpeg', '-y', '-hide_banner',
-        '-i', input_file,
-        '-c:v', settings['v']
+        '-i', input_file
     ]
     
-    if settings['a']:
-        cmd.extend(['-c:a', settings['a']])
-    else:
-        cmd.append('-an')
-    
     if output_format == 'gif':
-        cmd.extend(['-vf', 'fps=10,scale=480:-1:flags=lanczos'])
+        cmd.extend(['-c:v', 'gif', '-an', '-vf', 'fps=10,scale=480:-1:flags=lanczos'])
+    else:
+        info = await FFmpeg(input_file).get_media_info()
+        streams = info.get('streams', [])
+        if not streams:
+            return False, "Could not read media streams"
+        
+        stream_args, copied, transcoded = build_stream_args(streams, output_format)
+        if not copied and not transcoded:
+            return False, f"No streams can be stored in .{output_format}"
+        
+        LOGGER.info(f"Convert to {output_format}: {copied} stream(s) copied, {transcoded} transcoded")
+        cmd.extend(stream_args)
     
     cmd.append(output)
     
@@ -108,54 +194,115 @@ async def convert_format(
     return success, result if not success else output
 
 
+def _parse_bitrate(bitrate: str) -> int:
+    """Convert a bitrate string like '128k' or '2M' to bits per second"""
+    bitrate = str(bitrate).strip().lower()
+    multipliers = {'k': 1000, 'm': 1000 ** 2}
+    if bitrate and bitrate[-1] in multipliers:
+        return int(float(bitrate[:-1]) * multipliers[bitrate[-1]])
+    return int(float(bitrate))
+
+
 async def compress_video(
     input_file: str,
     output: str,
     target_size_mb: float = None,
     crf: int = 28,
-    progress_callback: Callable = None
+    progress_callback: Callable = None,
+    audio_bitrate: str = '128k',
+    preset: str = 'medium',
+    max_retries: int = 2
 ) -> Tuple[bool, str]:
-    """Compress video to reduce file size"""
+    """Compress video to reduce file size (two-pass when a target size is given)"""
     
     ffmpeg = FFmpeg(input_file, output)
     
-    if target_size_mb:
-        # Calculate bitrate based on target size
-        duration = await ffmpeg.get_duration()
-        if duration > 0:
-            target_bits = target_size_mb * 8 * 1024 * 1024
-            target_bitrate = int(target_bits / duration)
-            cmd = [
-                '-c:v', 'libx264',
-                '-b:v', f'{target_bitrate}',
-                '-pass', '1',
-                '-f', 'null', '/dev/null'
-            ]
-            # Two-pass encoding for target size
-            # Simplified to single pass for now
-            cmd = [
-                '-c:v', 'libx264',
-                '-b:v', f'{target_bitrate}',
-                '-c:a', 'aac',
-                '-b:a', '128k'
-            ]
-        else:
-            cmd = ['-c:v', 'libx264', '-crf', str(crf), '-c:a', 'aac']
-    else:
+    duration = await ffmpeg.get_duration() if target_size_mb else 0
+    if not target_size_mb or duration <= 0:
         cmd = [
             '-c:v', 'libx264',
             '-crf', str(crf),
-            '-preset', 'medium',
+            '-preset', preset,
             '-c:a', 'aac',
-            '-b:a', '128k'
+            '-b:a', audio_bitrate
         ]
-    
-    success, error = await ffmpeg.run_ffmpeg(cmd, progress_callback)
-    
-    if not success:
-        return False, error
-    
-    return True, output
+        success, error = await ffmpeg.run_ffmpeg(cmd, progress_callback, duration or None)
+        if not success:
+            return False, error
+        return True, output
+    
+    target_bytes = int(target_size_mb * 1024 * 1024)
+    streams = await ffmpeg.get_streams()
+    audio_bps = _parse_bitrate(audio_bitrate) * len(streams['audio'][:1])
+    
+    # Leave ~2% of the budget for container overhead
+    budget_bits = target_bytes * 8 * 0.98
+    video_bps = int(budget_bits / duration - audio_bps)
+    if video_bps < 50_000:
+        return False, f"Target size {target_size_mb} MB is too small for a {int(duration)}s video"
+    
+    # Per-job stats file so concurrent jobs don't clobber each other
+    passlog = f"{os.path.splitext(output)[0]}_2pass"
+    
+    def scaled(pass_index: int) -> Callable:
+        # Map each pass onto its half of the overall progress
+        async def callback(current_time: float):
+            if progress_callback:
+                await progress_callback((pass_index + current_time / duration) / 2 * duration)
+        return callback
+    
+    try:
+        # Pass 1: analysis only, stats go to the passlog
+        first = FFmpeg(input_file, os.devnull)
+        success, error = await first.run_ffmpeg([
+            '-c:v', 'libx264',
+            '-preset', preset,
+            '-b:v', str(video_bps),
+            '-pass', '1',
+            '-passlogfile', passlog,
+            '-an',
+            '-f', 'null'
+        ], scaled(0), duration)
+        if not success:
+            return False, error
+        
+        size = 0
+        for attempt in range(max_retries + 1):
+            success, error = await ffmpeg.run_ffmpeg([
+                '-c:v', 'libx264',
+                '-preset', preset,
+                '-b:v', str(video_bps),
+                '-pass', '2',
+                '-passlogfile', passlog,
+                '-c:a', 'aac',
+                '-b:a', audio_bitrate
+            ], scaled(1), duration)
+            if not success:
+                return False, error
+            
+            size = os.path.getsize(output)
+            if size <= target_bytes:
+                return True, output
+            
+            # Scale the video share of the file down by the overshoot
+            audio_bytes = audio_bps * duration / 8
+            actual_video = max(1, size - audio_bytes)
+            wanted_video = target_bytes * 0.98 - audio_bytes
+            video_bps = int(video_bps * wanted_video / actual_video * 0.98)
+            LOGGER.info(
+                f"Two-pass output {size} bytes exceeds {target_bytes}, "
+                f"retrying at {video_bps} bps (attempt {attempt + 2})"
+            )
+        
+        os.remove(output)
+        return False, f"Could not fit under {target_size_mb} MB (got {size / (1024 * 1024):.1f} MB)"
+    
+    finally:
+        for log in glob.glob(f"{glob.escape(passlog)}*"):
+            try:
+                os.remove(log)
+            except OSError:
+                pass
 
 
 async def change_speed(
@@ -251,7 +398,8 @@ async def change_resolution(
         output
     ]
     
-    process = await asyncio.create_subprocess_exec(
+    from bot.utils.jobs import spawn
+    process = await spawn(
         *cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE
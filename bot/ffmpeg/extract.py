@@ -6,10 +6,23 @@ import asyncio
 import logging
 from typing import Callable, Tuple, List
 
-from bot.ffmpeg.core import run_ffmpeg_command
+from bot.ffmpeg.core import FFmpeg, run_ffmpeg_command
+from bot.ffmpeg.index import cached_packet_index, get_frame_scores
 
 LOGGER = logging.getLogger(__name__)
 
+# Container for a stream-copied track, by codec (anything else goes to Matroska)
+VIDEO_COPY_EXTENSIONS = {'h264': 'mp4', 'hevc': 'mp4', 'av1': 'mp4', 'vp8': 'webm', 'vp9': 'webm'}
+AUDIO_COPY_EXTENSIONS = {
+    'aac': 'm4a', 'alac': 'm4a', 'mp3': 'mp3', 'ac3': 'ac3', 'eac3': 'eac3',
+    'dts': 'dts', 'flac': 'flac', 'opus': 'opus', 'vorbis': 'ogg', 'pcm_s16le': 'wav',
+}
+SUBTITLE_COPY_EXTENSIONS = {
+    'subrip': 'srt', 'ass': 'ass', 'ssa': 'ass', 'webvtt': 'vtt',
+    'mov_text': 'srt', 'hdmv_pgs_subtitle': 'sup',
+}
+FALLBACK_EXTENSIONS = {'video': 'mkv', 'audio': 'mka', 'subtitle': 'mks'}
+
 
 async def extract_video(
     input_file: str,
@@ -97,37 +110,118 @@ async def extract_subtitles(
     return success, result if not success else output
 
 
+async def extract_streams(
+    input_file: str,
+    output_dir: str,
+    stream_indexes: List[int] = None,
+    progress_callback: Callable = None,
+    duration: float = None
+) -> Tuple[bool, List[str] | str]:
+    """
+    Extract several streams to separate files in a single pass.
+
+    Every selected stream gets its own -map output, so the input is read
+    once no matter how many tracks are pulled out.
+
+    Args:
+        stream_indexes: Absolute stream indexes (default: every video,
+            audio and subtitle stream)
+
+    Returns:
+        (True, [output files]) or (False, error)
+    """
+    info = await FFmpeg(input_file).get_media_info()
+    streams = [
+        s for s in info.get('streams', [])
+        if s.get('codec_type') in FALLBACK_EXTENSIONS
+        and not s.get('disposition', {}).get('attached_pic')
+    ]
+    if stream_indexes is not None:
+        wanted = set(stream_indexes)
+        streams = [s for s in streams if s.get('index') in wanted]
+    if not streams:
+        return False, "No streams selected"
+
+    os.makedirs(output_dir, exist_ok=True)
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+
+    cmd = ['ffmpeg', '-y', '-hide_banner', '-i', input_file]
+    outputs = []
+    counters = {}
+
+    for stream in streams:
+        codec_type = stream['codec_type']
+        codec = stream.get('codec_name', '')
+        counters[codec_type] = counters.get(codec_type, 0) + 1
+        lang = stream.get('tags', {}).get('language', 'und')
+
+        extensions = {
+            'video': VIDEO_COPY_EXTENSIONS,
+            'audio': AUDIO_COPY_EXTENSIONS,
+            'subtitle': SUBTITLE_COPY_EXTENSIONS,
+        }[codec_type]
+        ext = extensions.get(codec, FALLBACK_EXTENSIONS[codec_type])
+        output = os.path.join(output_dir, f"{base_name}_{codec_type}{counters[codec_type]}_{lang}.{ext}")
+
+        cmd.extend(['-map', f"0:{stream['index']}"])
+        if codec == 'mov_text':
+            # MP4 timed text has no standalone container, convert it to SRT
+            cmd.extend(['-c:s', 'srt'])
+        else:
+            cmd.extend(['-c', 'copy'])
+        if codec == 'hevc' and ext == 'mp4':
+            cmd.extend(['-tag:v', 'hvc1'])
+        cmd.append(output)
+        outputs.append(output)
+
+    success, result = await run_ffmpeg_command(cmd, progress_callback, duration)
+    if not success:
+        return False, result
+
+    outputs = [o for o in outputs if os.path.exists(o) and os.path.getsize(o) > 0]
+    return (True, outputs) if outputs else (False, "No streams were written")
+
+
+def _representative_frame_args(scene: bool) -> List[str]:
+    """Output args for a single frame; scene picks take the most representative of the next few"""
+    if scene:
+        # A scene-change frame can still be mid-transition
+        return ['-vf', 'thumbnail=8', '-frames:v', '1']
+    return ['-vframes', '1']
+
+
 async def extract_thumbnail(
     input_file: str,
     output: str,
-    timestamp: float = None
+    timestamp: float = None,
+    scene: bool = False
 ) -> Tuple[bool, str]:
-    """Extract thumbnail from video"""
+    """Extract thumbnail from video (scene=True picks the best scored frame)"""
+    
+    if timestamp is None and scene:
+        scores = await get_frame_scores(input_file)
+        picks = scores.best(1) if scores else []
+        if picks:
+            timestamp = picks[0]
+        else:
+            scene = False
     
     if timestamp is None:
-        # Get duration and extract from 10%
-        cmd_probe = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-                     '-of', 'default=noprint_wrappers=1:nokey=1', input_file]
-        proc = await asyncio.create_subprocess_exec(
-            *cmd_probe, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        stdout, _ = await proc.communicate()
-        try:
-            duration = float(stdout.decode().strip())
-            timestamp = duration * 0.1
-        except:
-            timestamp = 1.0
+        # Extract from 10%
+        duration = await FFmpeg(input_file).get_duration()
+        timestamp = duration * 0.1 if duration > 0 else 1.0
     
     cmd = [
         'ffmpeg', '-y', '-hide_banner',
         '-ss', str(timestamp),
         '-i', input_file,
-        '-vframes', '1',
+        *_representative_frame_args(scene),
         '-q:v', '2',
         output
     ]
     
-    process = await asyncio.create_subprocess_exec(
+    from bot.utils.jobs import spawn
+    process = await spawn(
         *cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE
@@ -144,42 +238,51 @@ async def extract_thumbnail(
 async def extract_screenshots(
     input_file: str,
     output_dir: str,
-    count: int = 10
+    count: int = 10,
+    scene: bool = False
 ) -> Tuple[bool, List[str]]:
-    """Extract multiple screenshots from video"""
+    """Extract multiple screenshots from video (scene=True picks the best scored frames)"""
     
     os.makedirs(output_dir, exist_ok=True)
     
-    # Get duration
-    cmd_probe = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-                 '-of', 'default=noprint_wrappers=1:nokey=1', input_file]
-    proc = await asyncio.create_subprocess_exec(
-        *cmd_probe, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    stdout, _ = await proc.communicate()
-    
-    try:
-        duration = float(stdout.decode().strip())
-    except:
+    duration = await FFmpeg(input_file).get_duration()
+    if duration <= 0:
         return False, []
     
-    interval = duration / (count + 1)
+    # Seeking straight onto keyframes decodes a single frame per screenshot
+    index = cached_packet_index(input_file)
+    timestamps = index.spread_keyframes(count, 0, duration) if index else []
+    if len(timestamps) < count:
+        interval = duration / (count + 1)
+        timestamps = [interval * i for i in range(1, count + 1)]
+    
+    picks = []
+    if scene:
+        scores = await get_frame_scores(input_file)
+        # Keep picks apart so they do not all come from the same scene
+        min_gap = duration / (count * 2)
+        picks = scores.best(count, min_gap) if scores else []
+        if picks:
+            # Top up from the even spread when there are too few good frames
+            spread = [t for t in timestamps if all(abs(t - p) >= min_gap for p in picks)]
+            timestamps = sorted(picks + spread[:count - len(picks)])
+    
+    from bot.utils.jobs import spawn
     screenshots = []
     
-    for i in range(1, count + 1):
-        timestamp = interval * i
+    for i, timestamp in enumerate(timestamps, 1):
         output_file = os.path.join(output_dir, f"screenshot_{i:02d}.jpg")
         
         cmd = [
             'ffmpeg', '-y', '-hide_banner',
             '-ss', str(timestamp),
             '-i', input_file,
-            '-vframes', '1',
+            *_representative_frame_args(timestamp in picks),
             '-q:v', '2',
             output_file
         ]
         
-        process = await asyncio.create_subprocess_exec(
+        process = await spawn(
             *cmd,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""Per-file keyframe/packet index and thumbnail frame scores, each built in one pass"""
+
+import asyncio
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from bot.ffmpeg.core import FFmpeg, _probe_key
+
+LOGGER = logging.getLogger(__name__)
+
+# Indexes are larger than probe results, keep fewer of them
+INDEX_CACHE_SIZE = 16
+_index_cache: "OrderedDict[tuple, PacketIndex]" = OrderedDict()
+_index_building: Dict[tuple, asyncio.Future] = {}
+_scores_cache: "OrderedDict[tuple, FrameScores]" = OrderedDict()
+_scores_building: Dict[tuple, asyncio.Future] = {}
+
+# Scene-change threshold for thumbnail candidates, the longest gap between
+# candidates, and the duration above which only keyframes are decoded
+SCENE_THRESHOLD = 0.3
+SCENE_MAX_GAP = 30.0
+SCENE_FULL_DECODE_MAX = 600
+
+
+class PacketIndex:
+    """
+    Packet sizes and keyframe positions of one file, in compact arrays.
+
+    Keyframes are those of the first video stream (or audio for audio-only
+    files), in stream order. bytes_before[i] is the total size of every
+    packet (all streams) demuxed before keyframe i.
+    """
+
+    def __init__(self, key_type: str):
+        self.key_type = key_type
+        self.packet_sizes = array('L')
+        self.key_times = array('d')
+        self.key_offsets = array('q')  # byte position in the file, -1 if unknown
+        self.bytes_before = array('Q')
+        self.total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.key_times)
+
+    def add_packet(self, size: int, is_key: bool, pts_time: float = None, pos: int = -1):
+        # Only keyframes moving forward in time are usable as seek/cut points
+        if is_key and pts_time is not None and (not self.key_times or pts_time > self.key_times[-1]):
+            self.key_times.append(pts_time)
+            self.key_offsets.append(pos)
+            self.bytes_before.append(self.total_bytes)
+        self.packet_sizes.append(size)
+        self.total_bytes += size
+
+    def keyframe_before(self, t: float) -> float:
+        """Latest keyframe at or before t (0 if none)"""
+        i = bisect_right(self.key_times, t + 1e-6) - 1
+        return self.key_times[i] if i >= 0 else 0.0
+
+    def keyframe_after(self, t: float) -> Optional[float]:
+        """Earliest keyframe at or after t"""
+        i = bisect_left(self.key_times, t - 1e-6)
+        return self.key_times[i] if i < len(self.key_times) else None
+
+    def nearest_keyframe(self, t: float) -> float:
+        """Keyframe closest to t"""
+        before = self.keyframe_before(t)
+        after = self.keyframe_after(t)
+        if after is None or (t - before) <= (after - t):
+            return before
+        return after
+
+    def spread_keyframes(self, count: int, start: float, end: float) -> List[float]:
+        """Up to count distinct keyframes near evenly spaced points in (start, end)"""
+        interval = (end - start) / (count + 1)
+        picks = []
+        for i in range(1, count + 1):
+            t = self.nearest_keyframe(start + interval * i)
+            if start <= t <= end and t not in picks:
+                picks.append(t)
+        return picks
+
+    def size_cut_points(self, max_part_bytes: int) -> List[float]:
+        """Keyframe times that split the file into parts under max_part_bytes"""
+        cut_points = []
+        part_start = 0
+        candidate = None  # last keyframe inside the current part
+
+        for i in range(len(self.key_times)):
+            if self.bytes_before[i] - part_start > max_part_bytes and candidate is not None:
+                cut_points.append(self.key_times[candidate])
+                part_start = self.bytes_before[candidate]
+                candidate = None
+            if self.bytes_before[i] > part_start:
+                candidate = i
+
+        if self.total_bytes - part_start > max_part_bytes and candidate is not None:
+            cut_points.append(self.key_times[candidate])
+
+        return cut_points
+
+
+async def build_packet_index(input_file: str) -> Optional[PacketIndex]:
+    """Scan every packet once with ffprobe, streaming its output into a PacketIndex"""
+    streams = await FFmpeg(input_file).get_streams()
+    if streams['video']:
+        key_type, key_stream = 'video', streams['video'][0].get('index')
+    elif streams['audio']:
+        key_type, key_stream = 'audio', streams['audio'][0].get('index')
+    else:
+        return None
+
+    from bot.utils.jobs import spawn
+    process = await spawn(
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'packet=stream_index,pts_time,pos,size,flags',
+        '-of', 'compact=p=0',
+        input_file,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        limit=1 << 20
+    )
+
+    index = PacketIndex(key_type)
+    key_stream = str(key_stream)
+
+    try:
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+
+            fields = dict(f.split('=', 1) for f in line.decode(errors='ignore').strip().split('|') if '=' in f)
+            try:
+                size = int(fields.get('size', 0))
+            except ValueError:
+                continue
+
+            pts_time = None
+            pos = -1
+            is_key = fields.get('stream_index') == key_stream and 'K' in fields.get('flags', '')
+            if is_key:
+                try:
+                    pts_time = float(fields.get('pts_time', ''))
+                    pos = int(fields.get('pos', -1))
+                except ValueError:
+                    pass
+
+            index.add_packet(size, is_key, pts_time, pos)
+
+        await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+        raise
+
+    if process.returncode != 0 or not len(index):
+        return None
+
+    LOGGER.info(f"Indexed {len(index.packet_sizes)} packets, {len(index)} keyframes: {input_file}")
+    return index
+
+
+async def _get_or_build(cache: OrderedDict, building: Dict[tuple, asyncio.Future], key: tuple, build):
+    """Return cache[key], running build() once even when several callers ask at the same time"""
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    # Callers asking while a scan runs wait for it instead of scanning again
+    if key in building:
+        return await asyncio.shield(building[key])
+
+    future = asyncio.get_running_loop().create_future()
+    building[key] = future
+    try:
+        result = await build()
+    except BaseException:
+        # Waiters fall back to working without the result
+        future.set_result(None)
+        raise
+    else:
+        future.set_result(result)
+    finally:
+        del building[key]
+
+    if result is not None:
+        cache[key] = result
+        if len(cache) > INDEX_CACHE_SIZE:
+            cache.popitem(last=False)
+    return result
+
+
+def _peek(cache: OrderedDict, input_file: str):
+    key = _probe_key(input_file)
+    if key is None or key not in cache:
+        return None
+    cache.move_to_end(key)
+    return cache[key]
+
+
+def cached_packet_index(input_file: str) -> Optional[PacketIndex]:
+    """Packet index of a file if one was already built (never scans)"""
+    return _peek(_index_cache, input_file)
+
+
+async def get_packet_index(input_file: str) -> Optional[PacketIndex]:
+    """Get the packet index of a file, building it once per file version"""
+    key = _probe_key(input_file)
+    if key is None:
+        return await build_packet_index(input_file)
+    return await _get_or_build(_index_cache, _index_building, key, lambda: build_packet_index(input_file))
+
+
+def score_frame(entropy: float, brightness: float) -> float:
+    """
+    Rate a frame for use as a thumbnail.
+
+    entropy is the normalized luma entropy (detail), brightness the mean
+    luma in 0-1. Black, washed out and flat frames score 0.
+    """
+    if brightness < 0.06 or brightness > 0.94 or entropy < 0.2:
+        return 0.0
+    return entropy * (1.0 - abs(brightness - 0.5))
+
+
+class FrameScores:
+    """Scene-change candidate frames of one file with a thumbnail score each"""
+
+    def __init__(self):
+        self.times = array('d')
+        self.scores = array('d')
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def add(self, pts_time: float, score: float):
+        self.times.append(pts_time)
+        self.scores.append(score)
+
+    def best(self, count: int, min_gap: float = 0.0) -> List[float]:
+        """Times of up to count best frames at least min_gap apart, in time order"""
+        order = sorted(range(len(self.times)), key=self.scores.__getitem__, reverse=True)
+        picks = []
+        for i in order:
+            if len(picks) >= count or self.scores[i] <= 0:
+                break
+            t = self.times[i]
+            if all(abs(t - p) >= min_gap for p in picks):
+                picks.append(t)
+        return sorted(picks)
+
+
+async def build_frame_scores(input_file: str) -> Optional[FrameScores]:
+    """Score scene-change frames in one low resolution decode pass"""
+    ffmpeg = FFmpeg(input_file)
+    streams = await ffmpeg.get_streams()
+    if not streams['video']:
+        return None
+
+    duration = await ffmpeg.get_duration()
+    # Static videos have few scene changes, so also take a frame every max_gap seconds
+    max_gap = min(SCENE_MAX_GAP, max(duration / 50, 1.0))
+    vf = (
+        "scale=160:-2,format=yuv420p,"
+        f"select='isnan(prev_selected_t)+gt(scene,{SCENE_THRESHOLD})+gte(t-prev_selected_t,{max_gap})',"
+        "signalstats,entropy,metadata=print:file=-"
+    )
+
+    cmd = ['ffmpeg', '-hide_banner', '-nostats', '-v', 'error']
+    if duration > SCENE_FULL_DECODE_MAX:
+        # Long files: decode keyframes only, which encoders also place on scene cuts
+        cmd += ['-skip_frame', 'nokey']
+    cmd += ['-i', input_file, '-map', '0:v:0', '-an', '-sn', '-dn', '-vf', vf, '-f', 'null', '-']
+
+    from bot.utils.jobs import spawn
+    process = await spawn(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+
+    scores = FrameScores()
+    frame = None
+
+    def flush():
+        if frame and 'pts_time' in frame:
+            brightness = (frame.get('YAVG', 16.0) - 16.0) / 219.0
+            scores.add(frame['pts_time'], score_frame(frame.get('entropy', 0.0), brightness))
+
+    try:
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            line = line.decode(errors='ignore').strip()
+            try:
+                if line.startswith('frame:'):
+                    flush()
+                    frame = {}
+                    for field in line.split():
+                        if field.startswith('pts_time:'):
+                            frame['pts_time'] = float(field.split(':', 1)[1])
+                elif frame is not None and line.startswith('lavfi.signalstats.YAVG='):
+                    frame['YAVG'] = float(line.split('=', 1)[1])
+                elif frame is not None and line.startswith('lavfi.entropy.normalized_entropy.normal.Y='):
+                    frame['entropy'] = float(line.split('=', 1)[1])
+            except ValueError:
+                continue
+        flush()
+
+        await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+        raise
+
+    if process.returncode != 0 or not len(scores):
+        return None
+
+    LOGGER.info(f"Scored {len(scores)} candidate frames: {input_file}")
+    return scores
+
+
+def cached_frame_scores(input_file: str) -> Optional["FrameScores"]:
+    """Frame scores of a file if they were already computed (never decodes)"""
+    return _peek(_scores_cache, input_file)
+
+
+async def get_frame_scores(input_file: str) -> Optional[FrameScores]:
+    """Get the thumbnail candidate scores of a file, decoding it once per file version"""
+    key = _probe_key(input_file)
+    if key is None:
+        return await build_frame_scores(input_file)
+    return await _get_or_build(_scores_cache, _scores_building, key, lambda: build_frame_scores(input_file))
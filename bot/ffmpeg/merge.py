@@ -19,12 +19,23 @@ async def merge_videos(
     duration: float = None
 ) -> Tuple[bool, str]:
     """Merge two videos (concatenate)"""
+    return await concat_videos([video1, video2], output, progress_callback, duration)
+
+
+async def concat_videos(
+    videos: list,
+    output: str,
+    progress_callback: Callable = None,
+    duration: float = None
+) -> Tuple[bool, str]:
+    """Concatenate any number of videos in one pass"""
     
     # Create concat file
     concat_file = output + ".concat.txt"
     with open(concat_file, 'w') as f:
-        f.write(f"file '{video1}'\n")
-        f.write(f"file '{video2}'\n")
+        for video in videos:
+            escaped = video.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
     
     cmd = [
         'ffmpeg', '-y', '-hide_banner',
@@ -50,11 +61,12 @@ async def merge_videos(
     # Note: parsing streams is complex, assuming 1 video 1 audio for now
     # Ideally should probe files to see if audio exists
     
-    cmd = [
-        'ffmpeg', '-y', '-hide_banner',
-        '-i', video1,
-        '-i', video2,
-        '-filter_complex', '[0:v][0:a][1:v][1:a]concat=n=2:v=1:a=1[v][a]',
+    cmd = ['ffmpeg', '-y', '-hide_banner']
+    for video in videos:
+        cmd += ['-i', video]
+    inputs = ''.join(f'[{i}:v][{i}:a]' for i in range(len(videos)))
+    cmd += [
+        '-filter_complex', f'{inputs}concat=n={len(videos)}:v=1:a=1[v][a]',
         '-map', '[v]', '-map', '[a]',
         '-c:v', 'libx264', '-preset', 'fast', '-crf', '23',
         '-c:a', 'aac', '-b:a', '192k',
@@ -32,7 +32,8 @@ async def edit_metadata(
     
     cmd.extend(['-c', 'copy', output])
     
-    process = await asyncio.create_subprocess_exec(
+    from bot.utils.jobs import spawn
+    process = await spawn(
         *cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE
@@ -66,7 +67,8 @@ async def edit_stream_metadata(
     
     cmd.extend(['-c', 'copy', output])
     
-    process = await asyncio.create_subprocess_exec(
+    from bot.utils.jobs import spawn
+    process = await spawn(
         *cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE
@@ -91,7 +93,8 @@ async def clear_metadata(input_file: str, output: str) -> Tuple[bool, str]:
         output
     ]
     
-    process = await asyncio.create_subprocess_exec(
+    from bot.utils.jobs import spawn
+    process = await spawn(
         *cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE
@@ -151,7 +154,8 @@ async def add_cover_image(
         output
     ]
     
-    process = await asyncio.create_subprocess_exec(
+    from bot.utils.jobs import spawn
+    process = await spawn(
         *cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE
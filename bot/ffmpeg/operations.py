@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""Single-input operations shared by interactive and batch processing"""
+
+import os
+import random
+import logging
+from time import time
+from typing import Callable, Tuple
+
+from bot.ffmpeg.core import FFmpeg
+from bot.ffmpeg.encode import encode_video, convert_format, compress_video, change_speed, rotate_video
+from bot.ffmpeg.extract import (
+    extract_video, extract_audio, extract_subtitles, extract_streams,
+    extract_thumbnail, extract_screenshots, remove_audio
+)
+from bot.ffmpeg.merge import swap_streams
+from bot.ffmpeg.effects import add_text_watermark, add_subtitle_intro
+from bot.ffmpeg.trim import trim_video
+from bot.ffmpeg.index import cached_packet_index
+from bot.ffmpeg.metadata import edit_metadata
+from bot.ffmpeg.custom import execute_custom_command
+from bot.ffmpeg.preview import in_preview
+
+LOGGER = logging.getLogger(__name__)
+
+# Operations that need nothing but the input file and options
+SINGLE_INPUT_OPERATIONS = {
+    'convert', 'extract_audio', 'remove_audio', 'extract_video', 'extract_subs', 'extract_streams',
+    'extract_thumb', 'extract_screenshots', 'generate_sample', 'metadata',
+    'ffmpeg_cmd', 'trim', 'sub_intro', 'streamswap', 'speed', 'rotate',
+    'encode', 'compress', 'text_watermark',
+}
+
+
+async def run_operation(
+    operation: str,
+    input_path: str,
+    output_dir: str,
+    options: dict = None,
+    progress_callback: Callable = None,
+    duration: float = None,
+    status_callback: Callable = None
+) -> Tuple[bool, str | list]:
+    """
+    Run a single-input operation, writing its result into output_dir.
+    Successful full runs are timed for the throughput model.
+
+    Returns:
+        (True, output path or list of paths) or (False, error)
+    """
+    from bot.utils.eta import get_eta_model
+
+    if duration is None:
+        duration = await FFmpeg(input_path).get_duration()
+
+    started = time()
+    success, result = await _run_operation(
+        operation, input_path, output_dir, options, progress_callback, duration, status_callback
+    )
+    if success and not in_preview():
+        await get_eta_model().record(operation, options, duration, time() - started)
+    return success, result
+
+
+async def _run_operation(
+    operation: str,
+    input_path: str,
+    output_dir: str,
+    options: dict,
+    progress_callback: Callable,
+    duration: float,
+    status_callback: Callable
+) -> Tuple[bool, str | list]:
+    options = dict(options or {})
+    base_name, ext = os.path.splitext(os.path.basename(input_path))
+    output_path = os.path.join(output_dir, f"{base_name}_processed{ext}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    if operation == 'convert':
+        fmt = options.get('format', 'mp4')
+        output_path = os.path.join(output_dir, f"{base_name}.{fmt}")
+        return await convert_format(input_path, fmt, output_path, progress_callback=progress_callback, duration=duration)
+
+    if operation == 'extract_audio':
+        fmt = options.get('format', 'mp3')
+        idx = int(options.get('stream_index', 0))
+        output_path = os.path.join(output_dir, f"{base_name}_track{idx}.{fmt}")
+        return await extract_audio(input_path, output_path, stream_index=idx, codec=fmt, progress_callback=progress_callback, duration=duration)
+
+    if operation == 'remove_audio':
+        return await remove_audio(input_path, output_path, progress_callback=progress_callback, duration=duration)
+
+    if operation == 'extract_video':
+        idx = int(options.get('stream_index', 0))
+        output_path = os.path.join(output_dir, f"{base_name}_video{idx}{ext}")
+        return await extract_video(input_path, output_path, stream_index=idx, progress_callback=progress_callback, duration=duration)
+
+    if operation == 'extract_subs':
+        idx = int(options.get('stream_index', 0))
+        output_path = os.path.join(output_dir, f"{base_name}_track{idx}.srt")
+        return await extract_subtitles(input_path, output_path, stream_index=idx, progress_callback=progress_callback, duration=duration)
+
+    if operation == 'extract_streams':
+        # One demux pass for every selected track (None = all of them)
+        streams_dir = os.path.join(output_dir, f"{base_name}_streams")
+        return await extract_streams(input_path, streams_dir, options.get('streams'), progress_callback=progress_callback, duration=duration)
+
+    if operation == 'extract_thumb':
+        output_path = os.path.join(output_dir, f"{base_name}_thumb.jpg")
+        return await extract_thumbnail(input_path, output_path, scene=options.get('scene', True))
+
+    if operation == 'extract_screenshots':
+        count = int(options.get('count', 5))
+        # Use specific dir to avoid clutter
+        ss_dir = os.path.join(output_dir, f"{base_name}_screenshots")
+        success, result = await extract_screenshots(input_path, ss_dir, count=count, scene=options.get('scene', True))
+        return (True, result) if success else (False, "Failed to extract screenshots")
+
+    if operation == 'generate_sample':
+        sample_duration = int(options.get('duration', 30))
+        start_opt = options.get('start', 'random')
+
+        start = "0"
+        if start_opt == 'random':
+            if duration > sample_duration:
+                start = random.randint(0, int(duration - sample_duration))
+                # Start on a keyframe so the copied sample opens on a clean frame
+                index = cached_packet_index(input_path)
+                start = str(index.keyframe_before(start) if index else start)
+        else:
+            start = str(start_opt)
+
+        output_path = os.path.join(output_dir, f"{base_name}_sample_{sample_duration}s{ext}")
+        return await trim_video(input_path, output_path, start_time=start, duration=str(sample_duration))
+
+    if operation == 'metadata':
+        return await edit_metadata(input_path, output_path, options.get('metadata', {}))
+
+    if operation == 'ffmpeg_cmd':
+        success, result = await execute_custom_command(
+            input_path, options.get('args', ''), output_path,
+            progress_callback=progress_callback, duration=duration,
+            user_id=options.get('user_id'), chat_id=options.get('chat_id')
+        )
+        return (True, output_path) if success else (False, result)
+
+    if operation == 'trim':
+        return await trim_video(input_path, output_path, options.get('start'), options.get('end'))
+
+    if operation == 'sub_intro':
+        return await add_subtitle_intro(input_path, options.get('text', ''), output_path, duration=5)
+
+    if operation == 'streamswap':
+        return await swap_streams(input_path, output_path, progress_callback=progress_callback, duration=duration)
+
+    if operation == 'speed':
+        return await change_speed(input_path, output_path, options.get('speed', 1.0), progress_callback=progress_callback, duration=duration)
+
+    if operation == 'rotate':
+        return await rotate_video(input_path, output_path, options.get('rotation', 'right'), progress_callback=progress_callback, duration=duration)
+
+    if operation == 'text_watermark':
+        text = options.pop('text', '')
+        return await add_text_watermark(input_path, text, output_path, progress_callback=progress_callback, duration=duration, **options)
+
+    if operation == 'encode':
+        return await encode_video(
+            input_path,
+            output_path,
+            options,
+            progress_callback=progress_callback,
+            status_callback=status_callback
+        )
+
+    if operation == 'compress':
+        # Two-pass encode to a target size (defaults to the Telegram limit)
+        from bot import TG_MAX_FILE_SIZE, DEFAULT_AUDIO_BITRATE
+        output_path = os.path.join(output_dir, f"{base_name}_processed.mp4")
+        return await compress_video(
+            input_path,
+            output_path,
+            target_size_mb=options.get('target_size_mb', TG_MAX_FILE_SIZE),
+            audio_bitrate=DEFAULT_AUDIO_BITRATE,
+            progress_callback=progress_callback
+        )
+
+    return False, f"Unknown operation: {operation}"
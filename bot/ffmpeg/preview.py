@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Short low resolution preview clips rendered with an operation's own command"""
+
+import logging
+from contextvars import ContextVar
+from bot.ffmpeg.index import cached_packet_index, cached_frame_scores
+
+LOGGER = logging.getLogger(__name__)
+
+PREVIEW_SECONDS = 10
+PREVIEW_HEIGHT = 360
+
+# Operations that re-encode the whole video, worth checking on a clip first
+PREVIEW_OPERATIONS = {'encode', 'compress', 'watermark', 'text_watermark', 'hardsub', 'speed', 'rotate'}
+
+# (start, length) of the clip rendered in the current task context, None = full job
+_preview_clip: ContextVar = ContextVar('preview_clip', default=None)
+
+VIDEO_CODEC_FLAGS = ('-c:v', '-vcodec', '-codec:v')
+VIDEO_FILTER_FLAGS = ('-vf', '-filter:v', '-filter:v:0')
+FILTER_FLAGS = VIDEO_FILTER_FLAGS + ('-af', '-filter:a', '-filter:a:0', '-filter_complex', '-lavfi')
+# Filters that rewrite timestamps, so the clip can't keep the source's
+RETIMING_FILTERS = ('setpts', 'asetpts', 'atempo')
+
+
+def preview_start(input_file: str, duration: float) -> float:
+    """Representative clip start: the best scored frame, else a keyframe a third of the way in"""
+    latest = duration - PREVIEW_SECONDS
+    if latest <= 0:
+        return 0.0
+
+    scores = cached_frame_scores(input_file)
+    picks = [t for t in scores.best(3) if t <= latest] if scores else []
+    if picks:
+        return picks[0]
+
+    start = duration / 3
+    index = cached_packet_index(input_file)
+    return index.keyframe_before(start) if index else start
+
+
+def begin_preview(start: float, length: float = PREVIEW_SECONDS):
+    """Render every following FFmpeg run of this task as a short preview clip"""
+    return _preview_clip.set((start, length))
+
+
+def end_preview(token):
+    if token is not None:
+        _preview_clip.reset(token)
+
+
+def in_preview() -> bool:
+    """Whether FFmpeg runs in this task context are preview clips"""
+    return _preview_clip.get() is not None
+
+
+def _copies_video(cmd: list) -> bool:
+    for i, arg in enumerate(cmd[:-1]):
+        if arg in VIDEO_CODEC_FLAGS + ('-c', '-codec') and cmd[i + 1] == 'copy':
+            return True
+    return False
+
+
+def _retimes(cmd: list) -> bool:
+    return any(
+        arg in FILTER_FLAGS and any(name in cmd[i + 1] for name in RETIMING_FILTERS)
+        for i, arg in enumerate(cmd[:-1])
+    )
+
+
+def preview_command(cmd: list) -> list:
+    """
+    Cut a full FFmpeg command down to the preview clip.
+
+    The filter graph is left exactly as it is: the first input is seeked and
+    limited to the clip, timestamps are kept so time-based filters (subtitles,
+    enable=) see the same t as in the full run, and the output is shifted back
+    to zero, scaled down after the graph and encoded with the ultrafast preset.
+    Graphs that rewrite timestamps themselves (setpts, atempo) get a plain
+    input seek instead, their output already starts near zero.
+    Outside preview mode the command is returned unchanged.
+    """
+    clip = _preview_clip.get()
+    if clip is None or '-i' not in cmd:
+        return cmd
+    start, length = clip
+
+    cmd = list(cmd)
+    output = cmd.pop()
+    first_input = cmd.index('-i')
+    retimes = _retimes(cmd)
+    seek = ['-ss', f"{start:.3f}", '-t', str(length)]
+    cmd[first_input:first_input] = seek if retimes else ['-copyts'] + seek
+
+    if not _copies_video(cmd):
+        scale = f"scale=-2:'min({PREVIEW_HEIGHT},ih)'"
+        video_filters = [i for i, arg in enumerate(cmd[:-1]) if arg in VIDEO_FILTER_FLAGS]
+        if video_filters:
+            # FFmpeg only keeps the last video filter option
+            i = video_filters[-1] + 1
+            cmd[i] = f"{cmd[i]},{scale}"
+        elif '-filter_complex' in cmd:
+            i = cmd.index('-filter_complex') + 1
+            # Labelled graph outputs are mapped elsewhere, only scale a plain final chain
+            if not cmd[i].rstrip().endswith(']'):
+                cmd[i] = f"{cmd[i]},{scale}"
+        else:
+            cmd.extend(['-vf', scale])
+
+        presets = [i + 1 for i, arg in enumerate(cmd[:-1]) if arg == '-preset' or arg.startswith('-preset:')]
+        for i in presets:
+            cmd[i] = 'ultrafast'
+        if not presets:
+            cmd.extend(['-preset', 'ultrafast'])
+
+    if not retimes:
+        cmd.extend(['-output_ts_offset', f"-{start:.3f}"])
+    cmd.append(output)
+    return cmd
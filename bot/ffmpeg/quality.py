@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Quality-targeted CRF search using sample clips"""
+
+import os
+import re
+import shutil
+import asyncio
+import logging
+import tempfile
+from typing import Callable, Tuple, Optional
+
+from bot.ffmpeg.core import FFmpeg
+
+LOGGER = logging.getLogger(__name__)
+
+# Searchable CRF range per codec (quality drops as CRF rises)
+CRF_RANGES = {
+    'libx264': (16, 35),
+    'libx265': (18, 38),
+    'libvpx-vp9': (20, 50),
+}
+
+SAMPLE_COUNT = 3
+SAMPLE_LENGTH = 4  # seconds
+PARALLEL_CANDIDATES = 3
+
+_vmaf_available: Optional[bool] = None
+
+
+async def has_libvmaf() -> bool:
+    """Check whether the ffmpeg build ships the libvmaf filter"""
+    global _vmaf_available
+    if _vmaf_available is None:
+        process = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-hide_banner', '-filters',
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await process.communicate()
+        _vmaf_available = ' libvmaf ' in stdout.decode()
+    return _vmaf_available
+
+
+async def parse_quality_target(target: str | float) -> Tuple[str, float]:
+    """
+    Parse a quality target into (metric, value).
+
+    Accepts "ssim 0.98", "psnr 42", "vmaf 93" or a bare number:
+    values <= 1 are SSIM, larger ones VMAF.
+    """
+    text = str(target).strip().lower()
+    match = re.match(r'^(ssim|psnr|vmaf)?\s*[:=]?\s*([\d.]+)\s*(db)?$', text)
+    if not match:
+        raise ValueError(f"Invalid quality target: {target}")
+
+    metric, value = match.group(1), float(match.group(2))
+    if not metric:
+        metric = 'psnr' if match.group(3) else ('ssim' if value <= 1 else 'vmaf')
+
+    if metric == 'vmaf' and not await has_libvmaf():
+        raise ValueError("VMAF needs an ffmpeg build with libvmaf, use an SSIM target like 0.98")
+    if metric == 'ssim' and not 0 < value <= 1:
+        raise ValueError("SSIM target must be between 0 and 1")
+
+    return metric, value
+
+
+async def _run(cmd: list) -> Tuple[int, str]:
+    """Run ffmpeg quietly and return (returncode, stderr)"""
+    from bot.utils.jobs import spawn
+    process = await spawn(
+        *cmd,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    return process.returncode, stderr.decode(errors='ignore')
+
+
+async def extract_samples(input_file: str, work_dir: str, duration: float) -> list:
+    """Cut short stream-copied samples spread across the video"""
+    length = min(SAMPLE_LENGTH, duration)
+    count = 1 if duration <= SAMPLE_LENGTH * SAMPLE_COUNT else SAMPLE_COUNT
+    samples = []
+
+    for i in range(count):
+        # Spread over the middle of the video, skipping intro/credits
+        start = max(0.0, duration * (i + 1) / (count + 1) - length / 2)
+        sample = os.path.join(work_dir, f"sample_{i}.mkv")
+        code, _ = await _run([
+            'ffmpeg', '-y', '-hide_banner', '-v', 'error',
+            '-ss', str(start), '-i', input_file,
+            '-t', str(length),
+            '-map', '0:v:0', '-c', 'copy',
+            sample
+        ])
+        if code == 0 and os.path.exists(sample):
+            samples.append(sample)
+
+    return samples
+
+
+async def measure_quality(distorted: str, reference: str, metric: str) -> float:
+    """Compare an encoded sample against its reference"""
+    # Bring both to the same size and timeline before comparing
+    prep = (
+        "[0:v]setpts=PTS-STARTPTS[d0];[1:v]setpts=PTS-STARTPTS[r0];"
+        "[r0][d0]scale2ref=flags=bicubic[ref][dist];"
+    )
+    if metric == 'vmaf':
+        graph = prep + "[dist][ref]libvmaf"
+        pattern = r'VMAF score[:=]\s*([\d.]+)'
+    elif metric == 'psnr':
+        graph = prep + "[dist][ref]psnr"
+        pattern = r'average:([\d.]+|inf)'
+    else:
+        graph = prep + "[dist][ref]ssim"
+        pattern = r'All:([\d.]+)'
+
+    code, stderr = await _run([
+        'ffmpeg', '-hide_banner',
+        '-i', distorted, '-i', reference,
+        '-lavfi', graph,
+        '-f', 'null', '-'
+    ])
+
+    match = re.findall(pattern, stderr)
+    if code != 0 or not match:
+        raise RuntimeError(f"Quality measurement failed: {stderr[-300:]}")
+
+    value = match[-1]
+    return 100.0 if value == 'inf' else float(value)
+
+
+async def _score_crf(
+    crf: int,
+    samples: list,
+    metric: str,
+    video_codec: str,
+    preset: str,
+    resolution: str = None
+) -> float:
+    """Encode every sample at a CRF and return the mean score"""
+    scores = []
+    for sample in samples:
+        encoded = f"{os.path.splitext(sample)[0]}_crf{crf}.mkv"
+        cmd = [
+            'ffmpeg', '-y', '-hide_banner', '-v', 'error',
+            '-i', sample,
+            '-c:v', video_codec, '-crf', str(crf)
+        ]
+        if video_codec == 'libvpx-vp9':
+            cmd.extend(['-b:v', '0', '-deadline', 'good', '-cpu-used', '4'])
+        else:
+            cmd.extend(['-preset', preset])
+        if resolution and resolution != 'original':
+            cmd.extend(['-vf', f'scale={resolution}'])
+        cmd.extend(['-an', encoded])
+
+        code, stderr = await _run(cmd)
+        if code != 0:
+            raise RuntimeError(f"Sample encode failed: {stderr[-300:]}")
+
+        scores.append(await measure_quality(encoded, sample, metric))
+        os.remove(encoded)
+
+    return sum(scores) / len(scores)
+
+
+async def find_crf_for_quality(
+    input_file: str,
+    target: str | float,
+    video_codec: str = 'libx264',
+    preset: str = 'medium',
+    resolution: str = None,
+    status_callback: Callable = None
+) -> Tuple[bool, int | str]:
+    """
+    Find the highest CRF whose sample encodes still meet the quality target.
+
+    Candidates are probed in parallel batches, narrowing the CRF range each
+    round (a k-ary binary search), so only a few rounds are needed.
+
+    Returns:
+        (True, crf) or (False, error)
+    """
+    if video_codec not in CRF_RANGES:
+        return False, f"Target quality is not supported for {video_codec}"
+
+    try:
+        metric, goal = await parse_quality_target(target)
+    except ValueError as e:
+        return False, str(e)
+
+    duration = await FFmpeg(input_file).get_duration()
+    if duration <= 0:
+        return False, "Could not read video duration"
+
+    work_dir = tempfile.mkdtemp(prefix="crfsearch_", dir=os.path.dirname(os.path.abspath(input_file)))
+
+    try:
+        samples = await extract_samples(input_file, work_dir, duration)
+        if not samples:
+            return False, "Could not extract sample clips"
+
+        lo, hi = CRF_RANGES[video_codec]
+        scores = {}
+        best = None  # highest CRF known to pass
+
+        while lo <= hi:
+            # Evenly spaced candidates inside [lo, hi]
+            step = (hi - lo) / (PARALLEL_CANDIDATES + 1)
+            candidates = sorted(set(
+                min(hi, max(lo, round(lo + step * (i + 1)))) for i in range(PARALLEL_CANDIDATES)
+            ) - set(scores)) or [lo]
+
+            if status_callback:
+                await status_callback(f"Probing CRF {', '.join(map(str, candidates))} ({metric.upper()} ≥ {goal})")
+
+            results = await asyncio.gather(*(
+                _score_crf(crf, samples, metric, video_codec, preset, resolution)
+                for crf in candidates
+            ))
+            scores.update(zip(candidates, results))
+            LOGGER.info(f"CRF search {metric}: {dict(sorted(scores.items()))}")
+
+            passing = [c for c in candidates if scores[c] >= goal]
+            failing = [c for c in candidates if scores[c] < goal]
+
+            if passing:
+                best = max(passing + ([best] if best is not None else []))
+                lo = max(passing) + 1
+            if failing:
+                hi = min(failing) - 1
+
+        if best is None:
+            # Even the lowest CRF misses the target, use the best we can do
+            best = CRF_RANGES[video_codec][0]
+
+        return True, best
+
+    except Exception as e:
+        LOGGER.error(f"CRF search error: {e}")
+        return False, str(e)
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
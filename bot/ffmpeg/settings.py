@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Typed encode settings compiled from stored user settings to FFmpeg arguments"""
+
+import os
+import re
+import logging
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# Accepted spellings -> FFmpeg encoder
+VIDEO_CODECS = {
+    'libx264': 'libx264', 'x264': 'libx264', 'h264': 'libx264', 'avc': 'libx264',
+    'libx265': 'libx265', 'x265': 'libx265', 'h265': 'libx265', 'hevc': 'libx265',
+    'libvpx-vp9': 'libvpx-vp9', 'vp9': 'libvpx-vp9',
+    'libaom-av1': 'libaom-av1', 'av1': 'libaom-av1',
+    'copy': 'copy',
+}
+AUDIO_CODECS = {
+    'aac': 'aac',
+    'libopus': 'libopus', 'opus': 'libopus',
+    'libmp3lame': 'libmp3lame', 'mp3': 'libmp3lame',
+    'ac3': 'ac3', 'dd': 'ac3',
+    'eac3': 'eac3', 'ddp': 'eac3',
+    'flac': 'flac',
+    'copy': 'copy',
+}
+
+PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow', 'placebo')
+TUNES = {
+    'libx264': ('film', 'animation', 'grain', 'stillimage', 'fastdecode', 'zerolatency', 'psnr', 'ssim'),
+    'libx265': ('animation', 'grain', 'fastdecode', 'zerolatency', 'psnr', 'ssim'),
+}
+CRF_LIMITS = {'libx264': (0, 51), 'libx265': (0, 51), 'libvpx-vp9': (0, 63), 'libaom-av1': (0, 63)}
+
+# Resolution names used by the menus
+RESOLUTIONS = {'480p': (854, 480), '720p': (1280, 720), '1080p': (1920, 1080), '1440p': (2560, 1440), '4k': (3840, 2160)}
+SOURCE_VALUES = {'', 'og', 'original', 'source', 'none', 'off', 'pass'}
+CHANNEL_LAYOUTS = {'mono': 1, '1.0': 1, 'stereo': 2, '2.0': 2, '2.1': 3, '4.0': 4, '5.0': 5, '5.1': 6, '7.1': 8}
+
+
+class InvalidSettings(ValueError):
+    pass
+
+
+def _is_source(value) -> bool:
+    return value is None or str(value).strip().lower() in SOURCE_VALUES
+
+
+def _number(value, name: str, cast=int, low=None, high=None):
+    try:
+        number = cast(str(value).strip())
+    except ValueError:
+        raise InvalidSettings(f"{name} must be a number, got {value!r}")
+    if (low is not None and number < low) or (high is not None and number > high):
+        raise InvalidSettings(f"{name} must be between {low} and {high}, got {value!r}")
+    return number
+
+
+def _resolution(value) -> Optional[Tuple[int, int]]:
+    if _is_source(value):
+        return None
+    text = str(value).strip().lower()
+    if text in RESOLUTIONS:
+        return RESOLUTIONS[text]
+    match = re.match(r'^(\d+)\s*[x:*]\s*(\d+)$', text) or re.match(r'^()(\d+)p$', text)
+    if not match:
+        raise InvalidSettings(f"Invalid resolution: {value!r}")
+    width = int(match.group(1)) if match.group(1) else -2  # "540p" keeps the aspect ratio
+    return width, int(match.group(2))
+
+
+def _bitrate(value) -> Optional[str]:
+    if _is_source(value):
+        return None
+    match = re.match(r'^(\d+)\s*(k|kbps|m|mbps)?$', str(value).strip().lower())
+    if not match:
+        raise InvalidSettings(f"Invalid audio bitrate: {value!r}")
+    kbps = int(match.group(1)) * (1000 if (match.group(2) or 'k').startswith('m') else 1)
+    return f"{kbps}k"
+
+
+def _sample_rate(value) -> Optional[int]:
+    if _is_source(value):
+        return None
+    text = str(value).strip().lower().replace('hz', '')
+    rate = _number(text.rstrip('k'), "Sample rate", float)
+    # "48k" / "44.1" mean kHz, "48000" means Hz
+    if text.endswith('k') or rate < 1000:
+        rate *= 1000
+    return _number(int(rate), "Sample rate", int, 8000, 192000)
+
+
+def _channels(value) -> Optional[int]:
+    if _is_source(value):
+        return None
+    text = str(value).strip().lower()
+    if text in CHANNEL_LAYOUTS:
+        return CHANNEL_LAYOUTS[text]
+    return _number(text, "Channels", int, 1, 8)
+
+
+def _aspect(value) -> Optional[str]:
+    if _is_source(value):
+        return None
+    text = str(value).strip()
+    if not re.match(r'^\d+(\.\d+)?([:/]\d+(\.\d+)?)?$', text):
+        raise InvalidSettings(f"Invalid aspect ratio: {value!r}")
+    return text.replace('/', ':')
+
+
+@dataclass(frozen=True)
+class EncodeSettings:
+    """Validated encode settings; hashable, so compiled arguments can be cached"""
+
+    video_codec: str = 'libx264'
+    audio_codec: str = 'aac'
+    crf: int = 23
+    preset: str = 'medium'
+    resolution: Optional[Tuple[int, int]] = None
+    fps: Optional[float] = None
+    tune: Optional[str] = None
+    reframe: Optional[int] = None
+    cabac: bool = True
+    bits: int = 8
+    aspect: Optional[str] = None
+    audio_bitrate: Optional[str] = '192k'
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+    target_quality: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, settings: dict = None) -> "EncodeSettings":
+        """
+        Build from stored settings (DB defaults, menu and text input values).
+
+        Unknown keys are ignored; invalid values raise InvalidSettings.
+        """
+        s = settings or {}
+
+        codec = str(s.get('video_codec') or 'libx264').strip().lower()
+        if codec not in VIDEO_CODECS:
+            raise InvalidSettings(f"Unsupported video codec: {s.get('video_codec')!r}")
+        video_codec = VIDEO_CODECS[codec]
+        if s.get('hevc') and video_codec == 'libx264':
+            video_codec = 'libx265'
+
+        acodec = str(s.get('audio_codec') or 'aac').strip().lower()
+        if acodec not in AUDIO_CODECS:
+            raise InvalidSettings(f"Unsupported audio codec: {s.get('audio_codec')!r}")
+
+        low, high = CRF_LIMITS.get(video_codec, (0, 63))
+        crf = _number(s.get('crf') if s.get('crf') is not None else 23, "CRF", int, low, high)
+
+        preset = str(s.get('preset') or 'medium').strip().lower()
+        if preset not in PRESETS:
+            raise InvalidSettings(f"Unknown preset: {s.get('preset')!r}")
+
+        tune = s.get('tune')
+        if tune is True:
+            tune = 'animation'  # the settings toggle is Film/Animation
+        tune = None if _is_source(tune) or tune is False else str(tune).strip().lower()
+        if tune and tune not in TUNES.get(video_codec, ()):
+            raise InvalidSettings(f"Tune {tune!r} is not available for {video_codec}")
+
+        fps = s.get('fps') or s.get('frame')
+        fps = None if _is_source(fps) else _number(fps, "FPS", float, 1, 240)
+
+        reframe = s.get('reframe')
+        reframe = None if _is_source(reframe) else _number(reframe, "Reframe", int, 1, 16)
+
+        bits = s.get('bits')
+        bits = 8 if _is_source(bits) else _number(str(bits).lower().replace('bit', ''), "Bits", int)
+        if bits not in (8, 10):
+            raise InvalidSettings(f"Bits must be 8 or 10, got {s.get('bits')!r}")
+
+        target_quality = s.get('target_quality')
+        return cls(
+            video_codec=video_codec,
+            audio_codec=AUDIO_CODECS[acodec],
+            crf=crf,
+            preset=preset,
+            resolution=_resolution(s.get('resolution')),
+            fps=fps,
+            tune=tune,
+            reframe=reframe,
+            cabac=s.get('cabac') is not False,
+            bits=bits,
+            aspect=_aspect(s.get('aspect')),
+            # Unset (None in the DB defaults) means the default, "source" drops -b:a
+            audio_bitrate='192k' if s.get('audio_bitrate') is None else _bitrate(s.get('audio_bitrate')),
+            sample_rate=_sample_rate(s.get('sample_rate')),
+            channels=_channels(s.get('channels')),
+            target_quality=None if _is_source(target_quality) else str(target_quality),
+        )
+
+    def replace(self, **changes) -> "EncodeSettings":
+        values = {f.name: getattr(self, f.name) for f in fields(self)}
+        values.update(changes)
+        return EncodeSettings(**values)
+
+    @property
+    def scale(self) -> Optional[str]:
+        """scale filter size (as the CRF search expects it), None to keep the source size"""
+        if not self.resolution:
+            return None
+        return f"{self.resolution[0]}:{self.resolution[1]}"
+
+
+def encoder_threads() -> int:
+    """Threads per encode so parallel FFmpeg jobs share the CPUs instead of oversubscribing"""
+    from bot import MAX_CONCURRENT_FFMPEG
+    return max(1, (os.cpu_count() or 1) // max(1, MAX_CONCURRENT_FFMPEG))
+
+
+@lru_cache(maxsize=64)
+def compile_encode_args(settings: EncodeSettings, threads: int = 0) -> Tuple[str, ...]:
+    """
+    Output arguments for an encode, memoized per settings value.
+
+    Encoder options that have no FFmpeg-level flag (or a slower generic
+    one) go into a single -x264-params/-x265-params string; aspect is
+    container metadata instead of a filter pass.
+    """
+    s = settings
+    args = ['-c:v', s.video_codec]
+    filters = []
+
+    if s.video_codec != 'copy':
+        if s.video_codec in ('libx264', 'libx265'):
+            args += ['-crf', str(s.crf), '-preset', s.preset]
+            if s.tune:
+                args += ['-tune', s.tune]
+
+            params = []
+            if s.reframe:
+                params.append(f"ref={s.reframe}")
+            if not s.cabac and s.video_codec == 'libx264':
+                params.append("cabac=0")
+            if s.video_codec == 'libx265':
+                params.append("log-level=error")
+            if params:
+                args += [f"-{s.video_codec[3:]}-params", ':'.join(params)]
+        elif s.video_codec == 'libvpx-vp9':
+            # Constant quality mode; row-mt lets VP9 use every thread it gets
+            args += ['-crf', str(s.crf), '-b:v', '0', '-row-mt', '1']
+        elif s.video_codec == 'libaom-av1':
+            args += ['-crf', str(s.crf), '-b:v', '0', '-cpu-used', '6', '-row-mt', '1']
+
+        if s.resolution:
+            filters.append(f"scale={s.scale}")
+        if s.fps:
+            args += ['-r', f"{s.fps:g}"]
+        if s.bits == 10:
+            args += ['-pix_fmt', 'yuv420p10le']
+        if s.aspect:
+            args += ['-aspect', s.aspect]
+        if threads:
+            args += ['-threads', str(threads)]
+
+    if filters:
+        args += ['-vf', ','.join(filters)]
+
+    args += ['-c:a', s.audio_codec]
+    if s.audio_codec != 'copy':
+        if s.audio_bitrate and s.audio_codec != 'flac':
+            args += ['-b:a', s.audio_bitrate]
+        if s.sample_rate:
+            args += ['-ar', str(s.sample_rate)]
+        if s.channels:
+            args += ['-ac', str(s.channels)]
+
+    # Copy subtitles if present
+    args += ['-c:s', 'copy']
+    return tuple(args)
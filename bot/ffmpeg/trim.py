@@ -5,7 +5,8 @@ import asyncio
 import logging
 from typing import Callable, Tuple
 
-from bot.ffmpeg.core import FFmpeg
+from bot.ffmpeg.core import FFmpeg, run_ffmpeg_command
+from bot.ffmpeg.index import get_packet_index, cached_packet_index
 
 LOGGER = logging.getLogger(__name__)
 
@@ -29,22 +30,29 @@ async def trim_video(
     
     cmd = ['ffmpeg', '-y', '-hide_banner']
     
-    # Input seeking (fast)
-    if start_time:
-        cmd.extend(['-ss', str(start_time)])
+    start = parse_time(start_time) if start_time else 0.0
+    if start > 0:
+        # A stream copy can only begin on a keyframe, so start exactly on one
+        # (when the file was already indexed, a scan costs more than it saves)
+        index = cached_packet_index(input_file)
+        if index is not None:
+            start = index.keyframe_before(start)
+        # Input seeking (fast)
+        cmd.extend(['-ss', f"{start:.6f}"])
     
     cmd.extend(['-i', input_file])
     
-    # End time or duration
+    # Output timestamps restart at 0 after input seeking, so the end becomes a duration
     if end_time:
-        cmd.extend(['-to', str(end_time)])
+        cmd.extend(['-t', f"{max(0.0, parse_time(end_time) - start):.6f}"])
     elif duration:
         cmd.extend(['-t', str(duration)])
     
     # Copy without re-encoding for speed
     cmd.extend(['-c', 'copy', output])
     
-    process = await asyncio.create_subprocess_exec(
+    from bot.utils.jobs import spawn
+    process = await spawn(
         *cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE
@@ -114,7 +122,8 @@ async def split_video(
         output_pattern
     ]
     
-    process = await asyncio.create_subprocess_exec(
+    from bot.utils.jobs import spawn
+    process = await spawn(
         *cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE
@@ -136,6 +145,61 @@ async def split_video(
     return True, segments
 
 
+async def get_size_cut_points(input_file: str, max_part_bytes: int) -> list:
+    """Find keyframe timestamps that split a file into parts under max_part_bytes"""
+    index = await get_packet_index(input_file)
+    if index is None:
+        return []
+    return index.size_cut_points(max_part_bytes)
+
+
+async def split_by_size(
+    input_file: str,
+    output_pattern: str,
+    max_part_bytes: int,
+    progress_callback: Callable = None,
+    duration: float = None
+) -> Tuple[bool, list]:
+    """Split video into keyframe-aligned parts that each fit under max_part_bytes"""
+    import os
+    import glob
+    
+    # Leave headroom for container overhead of each part
+    cut_points = await get_size_cut_points(input_file, int(max_part_bytes * 0.97))
+    if not cut_points:
+        if os.path.getsize(input_file) <= max_part_bytes:
+            return True, [input_file]
+        return False, "Could not find keyframe cut points"
+    
+    ext = os.path.splitext(output_pattern)[1].lower()
+    maps = ['-map', '0:v?', '-map', '0:a?']
+    if ext == '.mkv':
+        maps += ['-map', '0:s?']
+    
+    cmd = [
+        'ffmpeg', '-y', '-hide_banner',
+        '-i', input_file,
+        *maps,
+        '-c', 'copy',
+        '-f', 'segment',
+        '-segment_times', ','.join(f"{t:.6f}" for t in cut_points),
+        '-reset_timestamps', '1',
+        output_pattern
+    ]
+    
+    success, error = await run_ffmpeg_command(cmd, progress_callback, duration)
+    if not success:
+        return False, error
+    
+    segments = sorted(glob.glob(output_pattern.replace('%03d', '[0-9][0-9][0-9]')))
+    
+    oversized = [s for s in segments if os.path.getsize(s) > max_part_bytes]
+    if oversized:
+        LOGGER.warning(f"{len(oversized)} part(s) exceed the size limit (keyframe interval too long)")
+    
+    return True, segments
+
+
 def parse_time(time_str: str) -> float:
     """Parse time string to seconds"""
     time_str = str(time_str).strip()
@@ -2,6 +2,9 @@
 """Callback query handlers for inline buttons"""
 
 import os
+import shutil
+import asyncio
+from time import time
 from types import SimpleNamespace
 from pyrogram import Client, filters
 from pyrogram.types import CallbackQuery, Message
@@ -22,13 +25,20 @@ from bot.keyboards.menus import (
     convert_menu, extract_menu, remove_menu, watermark_menu,
     watermark_position_menu, audio_format_menu, confirm_menu,
     close_button, speed_menu, rotate_menu, after_process_menu, stream_selection_menu,
-    screenshot_count_menu, sample_duration_menu, sample_start_menu
+    screenshot_count_menu, sample_duration_menu, sample_start_menu, batch_menu,
+    multi_stream_menu, preview_prompt_menu, preview_result_menu
 )
 from bot.handlers.file_handler import download_file, upload_file
 from bot.ffmpeg import *
+from bot.ffmpeg.operations import SINGLE_INPUT_OPERATIONS, run_operation
+from bot.ffmpeg.preview import PREVIEW_OPERATIONS, PREVIEW_SECONDS, preview_start, begin_preview, end_preview
 from bot.utils.progress import FFmpegProgress
-from bot.utils.helpers import sanitize_filename, get_readable_file_size
-from bot.utils.gdrive import get_gdrive, init_gdrive
+from bot.utils.helpers import sanitize_filename, get_readable_file_size, get_readable_time
+from bot.utils.disk import get_disk_manager, estimate_output_size, InsufficientDiskSpace
+from bot.utils.input_cache import get_input_cache
+from bot.utils.eta import get_eta_model, completion_times, format_eta
+from bot.utils.scheduler import get_scheduler
+from bot.utils.jobs import run_job, cancel_jobs
 
 
 @bot.on_callback_query(filters.regex(r"^close_"))
@@ -50,9 +60,12 @@ async def cancel_process_callback(client: Client, query: CallbackQuery):
     # Cancel progress
     if user_id in user_data and 'progress' in user_data[user_id]:
         user_data[user_id]['progress'].cancel()
-        
+    
     await query.answer("⏹️ Cancelling...", show_alert=True)
     
+    # Kills the job's FFmpeg/7z process groups and frees its slot and disk reservation
+    await cancel_jobs(user_id, 'process')
+    
     try:
         await query.message.edit_text("❌ <b>Cancelled by user</b>")
     except:
@@ -60,9 +73,10 @@ async def cancel_process_callback(client: Client, query: CallbackQuery):
     
     # Cleanup any partial files
     if user_id in user_data:
-        if 'file_path' in user_data[user_id] and user_data[user_id]['file_path']:
+        file_path = user_data[user_id].get('file_path')
+        if file_path and not get_input_cache().is_cached(file_path):
             try:
-                os.remove(user_data[user_id]['file_path'])
+                os.remove(file_path)
             except:
                 pass
         if 'output_path' in user_data[user_id]:
@@ -92,7 +106,8 @@ async def ffcmd_callback(client: Client, query: CallbackQuery):
         "<b>🎬 FFMPEG CMD</b>\n\n"
         "Send me the FFmpeg arguments.\n"
         "Example: <code>-c:v libx265 -crf 28 -c:a aac -b:a 128k</code>\n\n"
-        "Input file is automatically handled.",
+        "Input and output files are handled automatically; common output options "
+        "and filters are accepted; threads, presets, encoder speed and frame rates follow the bot's limits.",
         reply_markup=back_and_close_button(user_id, f"main_{user_id}")
     )
     await query.answer()
@@ -177,6 +192,139 @@ async def merge_done_callback(client: Client, query: CallbackQuery):
     await process_video(client, query, 'multi_merge', {'videos': merge_queue})
 
 
+# Batch menu key -> (operation, options); encode uses the user's saved settings
+BATCH_OPERATIONS = {
+    'encode': ('encode', None),
+    'compress': ('compress', {}),
+    'mp4': ('convert', {'format': 'mp4'}),
+    'mkv': ('convert', {'format': 'mkv'}),
+    'mp3': ('extract_audio', {'format': 'mp3'}),
+    'noaudio': ('remove_audio', {}),
+    'sample': ('generate_sample', {'duration': 30, 'start': 'random'}),
+    'thumb': ('extract_thumb', {}),
+    'merge': ('merge', {}),
+}
+
+
+@bot.on_callback_query(filters.regex(r"^batch_done_"))
+async def batch_done_callback(client: Client, query: CallbackQuery):
+    """Stop collecting batch files and pick an operation"""
+    user_id = int(query.data.split("_")[2])
+    
+    if query.from_user.id != user_id:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    batch_queue = user_data.get(user_id, {}).get('batch_queue', [])
+    if not batch_queue:
+        await query.answer("Send some files first!", show_alert=True)
+        return
+    
+    user_data[user_id]['waiting_for'] = None
+    await query.message.edit_text(
+        f"<b>📦 Batch: {len(batch_queue)} file(s)</b>\n\n"
+        "Select the operation to run on every file:",
+        reply_markup=batch_menu(user_id)
+    )
+    await query.answer()
+
+
+@bot.on_callback_query(filters.regex(r"^batchop_"))
+async def batch_operation_callback(client: Client, query: CallbackQuery):
+    """Run the chosen operation over the whole batch"""
+    from bot.utils.scheduler import run_batch
+    
+    parts = query.data.split("_")
+    key, user_id = parts[1], int(parts[2])
+    
+    if query.from_user.id != user_id:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    data = user_data.get(user_id, {})
+    batch_queue = data.get('batch_queue', [])
+    if not batch_queue or key not in BATCH_OPERATIONS:
+        await query.answer("No batch found!", show_alert=True)
+        return
+    if data.get('batch_task') and not data['batch_task'].done():
+        await query.answer("A batch is already running!", show_alert=True)
+        return
+    
+    operation, options = BATCH_OPERATIONS[key]
+    if options is None:
+        options = await load_encode_settings(user_id)
+    
+    data['batch_queue'] = []
+    await query.answer("Starting batch...")
+    status_msg = await query.message.edit_text(f"📦 Starting batch of {len(batch_queue)} file(s)...")
+    
+    task = asyncio.create_task(run_batch(
+        client, query.message.chat.id, user_id, batch_queue, operation, options, status_msg
+    ))
+    data['batch_task'] = task
+    
+    try:
+        done, failed = await task
+    except asyncio.CancelledError:
+        await status_msg.edit_text("❌ <b>Batch cancelled</b>")
+        return
+    except Exception as e:
+        LOGGER.error(f"Batch error: {e}")
+        await status_msg.edit_text(f"❌ Batch failed: {str(e)[:200]}")
+        return
+    finally:
+        data.pop('batch_task', None)
+    
+    text = f"<b>✅ Batch finished</b>\n\n<b>Done:</b> {done}\n<b>Failed:</b> {len(failed)}"
+    if failed:
+        text += "\n\n" + "\n".join(f"• <code>{name[:40]}</code>: {error[:80]}" for name, error in failed[:10])
+    await status_msg.edit_text(text, reply_markup=close_button(user_id))
+
+
+@bot.on_callback_query(filters.regex(r"^pl(all|single)_"))
+async def playlist_callback(client: Client, query: CallbackQuery):
+    """Batch a whole playlist, or process only the linked video"""
+    from bot.handlers.file_handler import handle_url_logic, queue_batch_urls
+    
+    action, user_id = query.data.split("_")[0], int(query.data.split("_")[1])
+    
+    if query.from_user.id != user_id:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    playlist = user_data.get(user_id, {}).get('playlist')
+    if not playlist:
+        await query.answer("Playlist expired, send the link again.", show_alert=True)
+        return
+    
+    await query.answer()
+    if action == 'plall':
+        await queue_batch_urls(user_id, query.message, playlist['entries'])
+        return
+    
+    user_data[user_id].pop('playlist', None)
+    user_data[user_id]['waiting_for'] = 'batch_files' if playlist['keep_batch'] else None
+    await query.message.delete()
+    await handle_url_logic(client, playlist['message'], playlist['url'], playlist=False)
+
+
+@bot.on_callback_query(filters.regex(r"^batchcancel_"))
+async def batch_cancel_callback(client: Client, query: CallbackQuery):
+    """Cancel a running batch"""
+    user_id = int(query.data.split("_")[1])
+    
+    if query.from_user.id != user_id:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    task = user_data.get(user_id, {}).get('batch_task')
+    if task and not task.done():
+        task.cancel()
+        await query.answer("⏹️ Cancelling batch...", show_alert=True)
+    else:
+        await query.answer("No batch running!", show_alert=True)
+
+
 @bot.on_callback_query(filters.regex(r"^streamswap_"))
 async def streamswap_callback(client: Client, query: CallbackQuery):
     """Handle StreamSwap"""
@@ -251,6 +399,23 @@ async def metadata_callback(client: Client, query: CallbackQuery):
     await query.answer()
 
 
+async def load_encode_settings(user_id: int) -> dict:
+    """Stored encode settings with the in-memory tweaks of this session on top"""
+    # Load encode settings from DB (if available) as authoritative source
+    from bot.utils.db_handler import get_db
+    db = get_db()
+    db_settings = {}
+    if db:
+        try:
+            db_settings = await db.get_user_settings(user_id)
+        except Exception:
+            db_settings = {}
+
+    # Merge in-memory settings over DB defaults (so runtime tweaks are visible)
+    runtime_settings = user_data.get(user_id, {}).get('settings', {})
+    return {**db_settings, **runtime_settings}
+
+
 @bot.on_callback_query(filters.regex(r"^encode_"))
 async def encode_callback(client: Client, query: CallbackQuery):
     """Handle Encode menu"""
@@ -264,20 +429,7 @@ async def encode_callback(client: Client, query: CallbackQuery):
         user_data[user_id] = {}
 
     user_data[user_id]['operation'] = 'encode'
-    
-    # Load encode settings from DB (if available) as authoritative source
-    from bot.utils.db_handler import get_db
-    db = get_db()
-    db_settings = {}
-    if db:
-        try:
-            db_settings = await db.get_user_settings(user_id)
-        except Exception:
-            db_settings = {}
-
-    # Merge in-memory settings over DB defaults (so runtime tweaks are visible)
-    runtime_settings = user_data[user_id].get('settings', {})
-    settings = {**db_settings, **runtime_settings}
+    settings = await load_encode_settings(user_id)
     
     await query.message.edit_text(
         "<b>⚙️ Encode Settings</b>\n\n"
@@ -348,6 +500,32 @@ async def crf_callback(client: Client, query: CallbackQuery):
     await query.answer()
 
 
+@bot.on_callback_query(filters.regex(r"^enc_quality_"))
+async def target_quality_callback(client: Client, query: CallbackQuery):
+    """Set target quality (CRF is then searched automatically)"""
+    user_id = int(query.data.split("_")[2])
+    
+    if query.from_user.id != user_id:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    if user_id not in user_data:
+        user_data[user_id] = {}
+
+    user_data[user_id]['waiting_for'] = 'enc_target_quality'
+    
+    from bot.keyboards.menus import back_and_close_button
+    await query.message.edit_text(
+        "<b>🎯 Set Target Quality</b>\n\n"
+        "The bot encodes a few short samples at different CRFs and picks "
+        "the highest CRF that still reaches this score.\n\n"
+        "Examples: <code>0.98</code> (SSIM), <code>psnr 42</code>, <code>vmaf 93</code> (if libvmaf is available)\n"
+        "Send <code>off</code> to use the fixed CRF again.",
+        reply_markup=back_and_close_button(user_id, f"encode_{user_id}")
+    )
+    await query.answer()
+
+
 @bot.on_callback_query(filters.regex(r"^enc_vcodec_"))
 async def vcodec_callback(client: Client, query: CallbackQuery):
     """Set video codec"""
@@ -500,9 +678,14 @@ async def encode_start_callback(client: Client, query: CallbackQuery):
         await query.answer("Not your button!", show_alert=True)
         return
     
-    await query.answer("Starting encoding...")
+    settings = await load_encode_settings(user_id)
+    try:
+        EncodeSettings.from_dict(settings)
+    except InvalidSettings as e:
+        await query.answer(f"❌ {e}", show_alert=True)
+        return
     
-    settings = user_data[user_id].get('settings', {})
+    await query.answer("Starting encoding...")
     await process_video(client, query, 'encode', settings)
 
 
@@ -740,6 +923,32 @@ async def extract_callback(client: Client, query: CallbackQuery):
     await query.answer()
 
 
+async def ensure_input_downloaded(client: Client, query: CallbackQuery, user_id: int) -> str:
+    """Return the session's input path, downloading it first if needed (None on failure)"""
+    file_path = user_data[user_id].get('file_path')
+    if file_path and os.path.exists(file_path):
+        return file_path
+    
+    status_msg = await query.message.edit_text("⏳ Downloading video to analyze streams...")
+    orig_msg_id = user_data[user_id].get('message_id')
+    if not orig_msg_id:
+        await status_msg.edit_text("❌ Original video lost!")
+        return None
+    
+    try:
+        video_msg = await client.get_messages(query.message.chat.id, orig_msg_id)
+        if not video_msg:
+            await status_msg.edit_text("❌ Video message deleted!")
+            return None
+        file_path = await download_file(video_msg, status_msg)
+        user_data[user_id]['file_path'] = file_path
+        get_input_cache().put(user_data[user_id].get('file_unique_id'), file_path, user_id)
+        return file_path
+    except Exception as e:
+        await status_msg.edit_text(f"❌ Download failed: {e}")
+        return None
+
+
 @bot.on_callback_query(filters.regex(r"^ext_audio_"))
 async def extract_audio_callback(client: Client, query: CallbackQuery):
     """Show audio format selection (and stream selection if needed)"""
@@ -755,24 +964,9 @@ async def extract_audio_callback(client: Client, query: CallbackQuery):
         return
 
     # Ensure file downloaded
-    file_path = user_data[user_id].get('file_path')
-    if not file_path or not os.path.exists(file_path):
-        status_msg = await query.message.edit_text("⏳ Downloading video to analyze streams...")
-        orig_msg_id = user_data[user_id].get('message_id')
-        if not orig_msg_id:
-            await status_msg.edit_text("❌ Original video lost!")
-            return
-        
-        try:
-            video_msg = await client.get_messages(query.message.chat.id, orig_msg_id)
-            if not video_msg:
-                 await status_msg.edit_text("❌ Video message deleted!")
-                 return
-            file_path = await download_file(video_msg, status_msg)
-            user_data[user_id]['file_path'] = file_path
-        except Exception as e:
-            await status_msg.edit_text(f"❌ Download failed: {e}")
-            return
+    file_path = await ensure_input_downloaded(client, query, user_id)
+    if not file_path:
+        return
 
     # Analyze streams
     ffmpeg = FFmpeg(file_path)
@@ -870,27 +1064,9 @@ async def extract_subs_callback(client: Client, query: CallbackQuery):
         return
     
     # Ensure file is downloaded for analysis
-    file_path = user_data[user_id].get('file_path')
-    
-    if not file_path or not os.path.exists(file_path):
-        status_msg = await query.message.edit_text("⏳ Downloading video to analyze streams...")
-        
-        orig_msg_id = user_data[user_id].get('message_id')
-        if not orig_msg_id:
-            await status_msg.edit_text("❌ Original video found!")
-            return
-            
-        try:
-            video_msg = await client.get_messages(query.message.chat.id, orig_msg_id)
-            if not video_msg:
-                await status_msg.edit_text("❌ Video message deleted!")
-                return
-                
-            file_path = await download_file(video_msg, status_msg)
-            user_data[user_id]['file_path'] = file_path
-        except Exception as e:
-            await status_msg.edit_text(f"❌ Download failed: {e}")
-            return
+    file_path = await ensure_input_downloaded(client, query, user_id)
+    if not file_path:
+        return
     
     # Analyze streams
     ffmpeg = FFmpeg(file_path)
@@ -930,6 +1106,86 @@ async def sub_select_callback(client: Client, query: CallbackQuery):
     await process_video(client, query, 'extract_subs', {'stream_index': idx})
 
 
+@bot.on_callback_query(filters.regex(r"^ext_all_"))
+async def extract_all_callback(client: Client, query: CallbackQuery):
+    """Extract every video, audio and subtitle stream in one pass"""
+    user_id = int(query.data.split("_")[2])
+    
+    if query.from_user.id != user_id:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    await query.answer("Extracting all streams...")
+    await process_video(client, query, 'extract_streams', {'streams': None})
+
+
+@bot.on_callback_query(filters.regex(r"^ext_pick_"))
+async def extract_pick_callback(client: Client, query: CallbackQuery):
+    """Show the stream picker for a single-pass extraction"""
+    user_id = int(query.data.split("_")[2])
+    
+    if query.from_user.id != user_id:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    if user_id not in user_data:
+        await query.answer("Session expired", show_alert=True)
+        return
+    
+    file_path = await ensure_input_downloaded(client, query, user_id)
+    if not file_path:
+        return
+    
+    streams = await FFmpeg(file_path).get_streams()
+    candidates = [
+        s for s in streams['video'] + streams['audio'] + streams['subtitle']
+        if not s.get('disposition', {}).get('attached_pic')
+    ]
+    if not candidates:
+        await query.message.edit_text("❌ No streams found!", reply_markup=extract_menu(user_id))
+        return
+    
+    user_data[user_id]['extract_candidates'] = candidates
+    user_data[user_id]['extract_selection'] = set()
+    await query.message.edit_text(
+        "<b>📤 Pick Streams</b>\n\n"
+        "Tap streams to select them, all are extracted in one pass:",
+        reply_markup=multi_stream_menu(user_id, candidates, set())
+    )
+    await query.answer()
+
+
+@bot.on_callback_query(filters.regex(r"^extsel_"))
+async def extract_select_callback(client: Client, query: CallbackQuery):
+    """Toggle a stream in the picker, or run the extraction"""
+    parts = query.data.split("_")
+    user_id = int(parts[2])
+    
+    if query.from_user.id != user_id:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    data = user_data.get(user_id, {})
+    candidates = data.get('extract_candidates')
+    if candidates is None:
+        await query.answer("Session expired", show_alert=True)
+        return
+    selection = data.setdefault('extract_selection', set())
+    
+    if parts[1] == 'go':
+        if not selection:
+            await query.answer("Select at least one stream!", show_alert=True)
+            return
+        await query.answer(f"Extracting {len(selection)} stream(s)...")
+        await process_video(client, query, 'extract_streams', {'streams': sorted(selection)})
+        return
+    
+    index = int(parts[1])
+    selection.symmetric_difference_update({index})
+    await query.message.edit_reply_markup(multi_stream_menu(user_id, candidates, selection))
+    await query.answer()
+
+
 @bot.on_callback_query(filters.regex(r"^ext_thumb_"))
 async def extract_thumb_callback(client: Client, query: CallbackQuery):
     """Extract thumbnail"""
@@ -1347,29 +1603,74 @@ async def process_video(
     operation: str,
     options: dict,
     queued: bool = False,
+    preview: bool = False,
+    approved: bool = False,
 ):
-    """Process video with specified operation (supports per-user queue)"""
+    """Process video with specified operation (supports per-user queue and preview clips)"""
     user_id = query.from_user.id
     
     if user_id not in user_data:
         await query.message.edit_text("❌ No video found. Send a video first.")
         return
 
+    # Long re-encodes can be checked on a short clip before committing to them
+    if operation in PREVIEW_OPERATIONS and not (queued or preview or approved) and await _offer_preview(user_id):
+        user_data[user_id]['pending_job'] = {'operation': operation, 'options': dict(options or {})}
+        await query.message.edit_text(
+            f"<b>👁 Preview first?</b>\n\n"
+            f"Render a {PREVIEW_SECONDS}s low resolution clip of <b>{operation}</b> to check how it looks "
+            f"before processing the whole video.",
+            reply_markup=preview_prompt_menu(user_id)
+        )
+        return
+
     # Initialize queue for user
     if user_id not in processing_queue:
         processing_queue[user_id] = []
     
     # If this is a fresh request and user already has an active task, enqueue it
     if not queued and 'progress' in user_data[user_id] and not user_data[user_id]['progress'].cancelled:
+        if preview:
+            try:
+                await query.answer("⚠️ Wait for your current task to finish before previewing.", show_alert=True)
+            except Exception:
+                pass
+            return
+        
         from bot import MAX_QUEUE_PER_USER
+        from bot.utils.pipeline import get_pipeline, PipelineJob
+        
+        pipeline = get_pipeline()
         # Enforce simple per-user queue cap
-        if len(processing_queue[user_id]) >= MAX_QUEUE_PER_USER:
+        if len(processing_queue[user_id]) + len(pipeline.user_jobs(user_id)) >= MAX_QUEUE_PER_USER:
             try:
                 await query.answer("⚠️ Your queue is full. Please wait for current tasks to finish.", show_alert=True)
             except Exception:
                 pass
             return
 
+        # Single-input jobs overlap with the running one and upload to the default destination
+        if operation in SINGLE_INPUT_OPERATIONS and user_data[user_id].get('message_id'):
+            video_msg = await client.get_messages(query.message.chat.id, user_data[user_id]['message_id'])
+            status_msg = await query.message.reply_text("🕒 Queued...")
+            await pipeline.submit(PipelineJob(
+                client,
+                query.message.chat.id,
+                user_id,
+                video_msg,
+                operation,
+                options,
+                status_msg,
+                file_name=user_data[user_id].get('file_name'),
+                file_size=user_data[user_id].get('file_size') or 0,
+                duration=user_data[user_id].get('duration')
+            ))
+            try:
+                await query.answer("Queued. It will be processed and uploaded to your default destination automatically.", show_alert=True)
+            except Exception:
+                pass
+            return
+
         processing_queue[user_id].append(
             {
                 "operation": operation,
@@ -1377,20 +1678,67 @@ async def process_video(
             }
         )
         position = len(processing_queue[user_id])
+        data = user_data[user_id]
+        model = get_eta_model()
+        # The user's tasks run one after another behind the current one
+        queued = [
+            model.predict(task['operation'], task.get('options'), data.get('duration'), data.get('file_size') or 0)
+            for task in processing_queue[user_id]
+        ]
+        if data.get('job_eta'):
+            started, predicted = data['job_eta']
+            _, queued_done = completion_times([max(predicted - (time() - started), 0.0)], queued, 1)
+            estimate = f"Estimated completion: {format_eta(queued_done[-1])}"
+        else:
+            # Current task is not in FFmpeg yet, so its remaining time is unknown
+            estimate = f"Estimated processing: ~{get_readable_time(int(sum(queued)))} after your current task"
         # Notify user that task has been queued
         try:
-            await query.answer(f"Queued at position #{position}. It will start automatically.", show_alert=True)
+            await query.answer(
+                f"Queued at position #{position}. It will start automatically.\n\n{estimate}",
+                show_alert=True
+            )
         except Exception:
             pass
         return
 
     # Get original message with the video
-    original_msg = user_data[user_id].get('message_id')
-    if not original_msg:
+    if not user_data[user_id].get('message_id'):
         await query.message.edit_text("❌ No video found. Send a video first.")
         return
     
-    status_msg = await query.message.edit_text("⏳ Starting process...")
+    # Its own task, so the cancel button can stop it (and kill its FFmpeg) without touching this handler
+    await run_job(user_id, _process_job(client, query, operation, options, preview))
+    
+    # If there are queued tasks for this user, start the next one
+    if processing_queue.get(user_id):
+        next_task = processing_queue[user_id].pop(0)
+        
+        # Build a minimal fake query object reusing the same message & user
+        fake_query = SimpleNamespace(
+            message=query.message,
+            from_user=query.from_user,
+        )
+        await process_video(
+            client,
+            fake_query,
+            next_task["operation"],
+            next_task.get("options", {}),
+            queued=True,
+        )
+
+
+async def _process_job(client: Client, query: CallbackQuery, operation: str, options: dict, preview: bool):
+    """Download, process and offer the upload of the user's video (runs as a job)"""
+    user_id = query.from_user.id
+    original_msg = user_data[user_id].get('message_id')
+    status_msg = await query.message.edit_text("⏳ Rendering preview..." if preview else "⏳ Starting process...")
+    disk = get_disk_manager()
+    cache = get_input_cache()
+    reservation = None
+    pinned = None
+    preview_token = None
+    ffmpeg_slot = None
     
     try:
         # Get the original message
@@ -1398,143 +1746,81 @@ async def process_video(
         
         # Check if file already downloaded
         input_path = user_data[user_id].get('file_path')
-        if not input_path or not os.path.exists(input_path):
+        downloaded = bool(input_path and os.path.exists(input_path))
+        input_size = os.path.getsize(input_path) if downloaded else (user_data[user_id].get('file_size') or 0)
+        
+        # Reserve the job's disk footprint before touching the disk
+        footprint = estimate_output_size(operation, input_size, options=options)
+        if not downloaded:
+            footprint += input_size
+        
+        async def _waiting_for_disk():
+            await status_msg.edit_text("⏳ Waiting for free disk space...")
+        
+        reservation = await disk.reserve(footprint, owner=user_id, on_wait=_waiting_for_disk)
+        
+        if not downloaded:
             # Download video
             await status_msg.edit_text("📥 Downloading video...")
             input_path = await download_file(video_msg, status_msg)
             user_data[user_id]['file_path'] = input_path
+            # Keep it for follow-up operations on the same file
+            cache.put(user_data[user_id].get('file_unique_id'), input_path, user_id)
+        cache.acquire(input_path)
+        pinned = input_path
         
         # Generate output path
         base_name = os.path.splitext(os.path.basename(input_path))[0]
         ext = os.path.splitext(input_path)[1]
         output_dir = os.path.join(OUTPUT_DIR, str(user_id))
+        if preview:
+            output_dir = os.path.join(output_dir, "preview")
         os.makedirs(output_dir, exist_ok=True)
         
         output_path = os.path.join(output_dir, f"{base_name}_processed{ext}")
         
         # Get duration for progress
         duration = await FFmpeg(input_path).get_duration()
-        progress = FFmpegProgress(status_msg, duration, f"Processing ({operation})", filename=os.path.basename(input_path))
         
+        # Input is on disk now, only the output is still outstanding
+        disk.adjust(
+            reservation,
+            estimate_output_size(operation, os.path.getsize(input_path), {'duration': duration}, options)
+        )
+        if not preview:
+            # Shown by /queue while this job runs
+            user_data[user_id]['job_eta'] = (time(), get_eta_model().predict(operation, options, duration))
+        if preview:
+            # Same commands, cut down to a short low resolution clip
+            preview_token = begin_preview(preview_start(input_path, duration))
+            progress = FFmpegProgress(status_msg, min(duration, PREVIEW_SECONDS), f"Preview ({operation})", filename=os.path.basename(input_path))
+        else:
+            progress = FFmpegProgress(status_msg, duration, f"Processing ({operation})", filename=os.path.basename(input_path))
+        
+        async def _waiting_for_ffmpeg():
+            await status_msg.edit_text("⏳ Waiting for a free FFmpeg slot...")
+        
+        # FFmpeg slots are shared fairly between users and groups
+        ffmpeg_slot = await get_scheduler().ffmpeg.acquire(user_id, query.message.chat.id, on_wait=_waiting_for_ffmpeg)
         await status_msg.edit_text(f"⚙️ Processing: {operation}...")
         
         # Execute operation
         success = False
         error = ""
         
-        if operation == 'convert':
-            fmt = options.get('format', 'mp4')
-            output_path = os.path.join(output_dir, f"{base_name}.{fmt}")
-            success, result = await convert_format(input_path, fmt, output_path, progress_callback=progress.update, duration=duration)
-            if success:
-                output_path = result
-            else:
-                error = result
-        
-        elif operation == 'extract_audio':
-            fmt = options.get('format', 'mp3')
-            idx = int(options.get('stream_index', 0))
-            output_path = os.path.join(output_dir, f"{base_name}_track{idx}.{fmt}")
-            success, result = await extract_audio(input_path, output_path, stream_index=idx, codec=fmt, progress_callback=progress.update, duration=duration)
-            if success:
-                output_path = result
-            else:
-                error = result
-        
-        elif operation == 'remove_audio':
-            success, result = await remove_audio(input_path, output_path, progress_callback=progress.update, duration=duration)
-            if success:
-                output_path = result
-            else:
-                error = result
-        
-        elif operation == 'extract_video':
-            idx = int(options.get('stream_index', 0))
-            output_path = os.path.join(output_dir, f"{base_name}_video{idx}{ext}")
-            success, result = await extract_video(input_path, output_path, stream_index=idx, progress_callback=progress.update, duration=duration)
-            if success:
-                output_path = result
-            else:
-                error = result
-        
-        elif operation == 'extract_subs':
-            idx = int(options.get('stream_index', 0))
-            output_path = os.path.join(output_dir, f"{base_name}_track{idx}.srt")
-            success, result = await extract_subtitles(input_path, output_path, stream_index=idx, progress_callback=progress.update, duration=duration)
-            if success:
-                output_path = result
-            else:
-                error = result
-        
-        elif operation == 'extract_thumb':
-            output_path = os.path.join(output_dir, f"{base_name}_thumb.jpg")
-            success, result = await extract_thumbnail(input_path, output_path)
-            if success:
-                output_path = result
-            else:
-                error = result
-        
-        elif operation == 'extract_screenshots':
-            count = int(options.get('count', 5))
-            
-            # Use specific dir to avoid clutter
-            ss_dir = os.path.join(output_dir, f"screenshots_{user_id}")
-            success, result = await extract_screenshots(input_path, ss_dir, count=count)
-            
-            if success:
-                # result is list of paths
-                # Return list directly for Media Group upload
-                output_path = result
-            else:
-                error = "Failed to extract screenshots"
-
-        elif operation == 'generate_sample':
-            duration = int(options.get('duration', 30))
-            start_opt = options.get('start', 'random')
-            
-            start = "0"
-            if start_opt == 'random':
-                # Get duration
-                ff = FFmpeg(input_path)
-                total = await ff.get_duration()
-                
-                import random
-                if total > duration:
-                    # Random start
-                    start_sec = random.randint(0, int(total - duration))
-                    start = str(start_sec)
-            else:
-                start = str(start_opt)
-                
-            output_path = os.path.join(output_dir, f"{base_name}_sample_{duration}s{ext}")
+        if operation in SINGLE_INPUT_OPERATIONS:
+            async def _search_status(text: str):
+                await status_msg.edit_text(f"🎯 <b>Finding CRF for target quality</b>\n\n{text}")
             
-            # Use trim_video
-            success, result = await trim_video(input_path, output_path, start_time=start, duration=str(duration))
-            if success:
-                output_path = result
-            else:
-                error = result
-
-        elif operation == 'metadata':
-            metadata = options.get('metadata', {})
-            success, result = await edit_metadata(input_path, output_path, metadata)
-            if success:
-                output_path = result
-            else:
-                error = result
-
-        elif operation == 'ffmpeg_cmd':
-            args = options.get('args', '')
-            success, result = await execute_custom_command(input_path, args, output_path)
-            if success:
-                pass # output_path is already set
-            else:
-                error = result
-
-        elif operation == 'trim':
-            start = options.get('start')
-            end = options.get('end')
-            success, result = await trim_video(input_path, output_path, start, end)
+            success, result = await run_operation(
+                operation,
+                input_path,
+                output_dir,
+                options,
+                progress_callback=progress.update,
+                duration=duration,
+                status_callback=_search_status
+            )
             if success:
                 output_path = result
             else:
@@ -1545,27 +1831,13 @@ async def process_video(
             new_path = os.path.join(output_dir, f"{new_name}{ext}")
             try:
                 os.rename(input_path, new_path)
+                cache.discard(input_path)
                 output_path = new_path
                 success = True
             except Exception as e:
                 success = False
                 error = str(e)
 
-        elif operation == 'sub_intro':
-            text = options.get('text', '')
-            success, result = await add_subtitle_intro(input_path, text, output_path, duration=5)
-            if success:
-                output_path = result
-            else:
-                error = result
-
-        elif operation == 'streamswap':
-            success, result = await swap_streams(input_path, output_path, progress_callback=progress.update, duration=duration)
-            if success:
-                output_path = result
-            else:
-                error = result
-
         elif operation == 'merge_video':
             # Need to download second video
             msg = user_data[user_id].get('second_video_message')
@@ -1771,58 +2043,19 @@ async def process_video(
                 else:
                     error = result
 
-        elif operation == 'speed':
-            speed = options.get('speed', 1.0)
-            success, result = await change_speed(input_path, output_path, speed, progress_callback=progress.update, duration=duration)
-            if success:
-                output_path = result
-            else:
-                error = result
-
-        elif operation == 'rotate':
-            rotation = options.get('rotation', 'right')
-            success, result = await rotate_video(input_path, output_path, rotation, progress_callback=progress.update, duration=duration)
-            if success:
-                output_path = result
-            else:
-                error = result
-        
-        elif operation == 'encode':
-            # Use encode wrapper with progress reporting
-            success, result = await encode_video(
-                input_path,
-                output_path,
-                **options,
-                progress_callback=progress.update
-            )
-            if success:
-                output_path = result
-            else:
-                error = result
-
-        elif operation == 'convert':
-            fmt = options.get('format', 'mp4')
-            # convert_format supports progress & duration
-            success, result = await convert_format(
-                input_path,
-                fmt,
-                output_path,
-                progress_callback=progress.update,
-                duration=duration
-            )
-            if success:
-                output_path = result
-            else:
-                error = result
-        
+        get_scheduler().ffmpeg.release(ffmpeg_slot)
         if not success:
             await status_msg.edit_text(f"❌ Error: {error[:500]}")
             return
         
+        if preview:
+            await _send_preview(client, query.message.chat.id, status_msg, user_id, operation, output_path)
+            return
+        
         # Check file size
         if isinstance(output_path, list):
             file_size = sum(os.path.getsize(f) for f in output_path)
-            display_name = f"Screenshots ({len(output_path)} photos)"
+            display_name = f"{len(output_path)} files"
         else:
             file_size = os.path.getsize(output_path)
             display_name = f"<code>{os.path.basename(output_path)}</code>"
@@ -1841,7 +2074,7 @@ async def process_video(
                 f"<b>📁 File:</b> {display_name}\n"
                 f"<b>💾 Size:</b> {get_readable_file_size(file_size)}\n\n"
                 f"<b>⚠️ Total size > 2GB!</b>\n"
-                f"Cannot upload to Telegram directly.\n\n"
+                f"Split it into parts for Telegram or upload elsewhere.\n\n"
                 f"Choose upload destination:"
             )
         else:
@@ -1858,32 +2091,135 @@ async def process_video(
             reply_markup=after_process_menu(user_id, file_size_mb, GDRIVE_ENABLED)
         )
         
-        # Cleanup input file
-        try:
-            os.remove(input_path)
-        except:
-            pass
+        # Cleanup input file (cached inputs stay for the next operation)
+        if not cache.is_cached(input_path):
+            try:
+                os.remove(input_path)
+            except:
+                pass
         
+    except InsufficientDiskSpace as e:
+        LOGGER.warning(f"Job rejected for {user_id}: {e}")
+        await status_msg.edit_text(f"❌ {e}\n\nPlease try again later.")
     except Exception as e:
         LOGGER.error(f"Error processing: {e}")
         await status_msg.edit_text(f"❌ Error: {str(e)[:500]}")
     finally:
-        # If there are queued tasks for this user, start the next one
-        if processing_queue.get(user_id):
-            next_task = processing_queue[user_id].pop(0)
-            
-            # Build a minimal fake query object reusing the same message & user
-            fake_query = SimpleNamespace(
-                message=status_msg,
-                from_user=query.from_user,
-            )
-            await process_video(
-                client,
-                fake_query,
-                next_task["operation"],
-                next_task.get("options", {}),
-                queued=True,
-            )
+        end_preview(preview_token)
+        get_scheduler().ffmpeg.release(ffmpeg_slot)
+        user_data[user_id].pop('job_eta', None)
+        disk.release(reservation)
+        cache.release(pinned)
+        if preview:
+            shutil.rmtree(os.path.join(OUTPUT_DIR, str(user_id), "preview"), ignore_errors=True)
+
+
+async def _offer_preview(user_id: int) -> bool:
+    """Whether the user's video is long enough to be worth a preview first"""
+    from bot import PREVIEW_MIN_DURATION
+    
+    if not PREVIEW_MIN_DURATION:
+        return False
+    duration = user_data[user_id].get('duration') or 0
+    path = user_data[user_id].get('file_path')
+    if not duration and path and os.path.exists(path):
+        duration = await FFmpeg(path).get_duration()
+    # Unknown length (documents not downloaded yet) still gets the offer
+    return not duration or duration >= PREVIEW_MIN_DURATION
+
+
+async def _send_preview(client: Client, chat_id: int, status_msg, user_id: int, operation: str, path: str):
+    """Send a rendered preview clip with buttons to approve or discard the full job"""
+    await status_msg.edit_text("📤 Sending preview...")
+    await client.send_video(
+        chat_id,
+        path,
+        caption=(
+            f"<b>👁 Preview: {operation}</b>\n\n"
+            f"Low resolution {PREVIEW_SECONDS}s clip, the full video keeps its quality settings."
+        ),
+        supports_streaming=True,
+        reply_markup=preview_result_menu(user_id)
+    )
+    try:
+        await status_msg.delete()
+    except Exception:
+        pass
+
+
+@bot.on_callback_query(filters.regex(r"^job(preview|start|drop)_"))
+async def pending_job_callback(client: Client, query: CallbackQuery):
+    """Preview, run or drop a job waiting for approval"""
+    action, user_id = query.data.split("_")
+    user_id = int(user_id)
+    
+    if query.from_user.id != user_id:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    pending = user_data.get(user_id, {}).get('pending_job')
+    if not pending:
+        await query.answer("This job is no longer available.", show_alert=True)
+        return
+    
+    if action == 'jobdrop':
+        user_data[user_id].pop('pending_job', None)
+        await query.answer("Discarded")
+        await query.message.delete()
+        return
+    
+    if action == 'jobstart':
+        user_data[user_id].pop('pending_job', None)
+    await query.answer()
+    
+    # The preview arrives as a video message, which can't be edited into a status
+    message = query.message
+    if message.video:
+        await message.edit_reply_markup(None)
+        message = await message.reply_text("⏳ Starting...")
+    job_query = SimpleNamespace(message=message, from_user=query.from_user, answer=query.answer)
+    
+    await process_video(
+        client,
+        job_query,
+        pending['operation'],
+        dict(pending['options']),
+        preview=action == 'jobpreview',
+        approved=action == 'jobstart',
+    )
+
+
+@bot.on_callback_query(filters.regex(r"^bccancel_"))
+async def broadcast_cancel_callback(client: Client, query: CallbackQuery):
+    """Stop a running broadcast (it can be resumed later)"""
+    from bot.utils.broadcast import stop_broadcast
+    
+    if query.from_user.id != OWNER_ID:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    if stop_broadcast():
+        await query.answer("⏹ Stopping broadcast...")
+    else:
+        await query.answer("No broadcast running.", show_alert=True)
+
+
+@bot.on_callback_query(filters.regex(r"^pipecancel_"))
+async def pipeline_cancel_callback(client: Client, query: CallbackQuery):
+    """Cancel a queued pipeline job"""
+    from bot.utils.pipeline import get_pipeline
+    
+    parts = query.data.split("_")
+    job_id, user_id = int(parts[1]), int(parts[2])
+    
+    if query.from_user.id != user_id:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    if get_pipeline().cancel(job_id):
+        await query.answer("⏹️ Cancelling...", show_alert=True)
+    else:
+        await query.answer("Job already finished!", show_alert=True)
 
 
 # Google Drive upload callbacks
@@ -1907,7 +2243,8 @@ async def upload_telegram_callback(client: Client, query: CallbackQuery):
         if not all(os.path.exists(f) for f in output_path):
             await query.answer("Some files not found!", show_alert=True)
             return
-        total_size = sum(os.path.getsize(f) for f in output_path)
+        # Files of a list are sent one by one, so only the largest has to fit
+        total_size = max(os.path.getsize(f) for f in output_path)
     else:
         if not os.path.exists(output_path):
             await query.answer("File not found!", show_alert=True)
@@ -1915,7 +2252,11 @@ async def upload_telegram_callback(client: Client, query: CallbackQuery):
         total_size = os.path.getsize(output_path)
     
     if total_size >= 2000 * 1024 * 1024:
-        await query.answer("Total size too large for Telegram (>2GB)!", show_alert=True)
+        if isinstance(output_path, list):
+            await query.answer("A file is too large for Telegram (>2GB)!", show_alert=True)
+            return
+        # Single oversized file: upload it as Telegram-sized parts
+        await split_upload_callback(client, query)
         return
     
     await query.answer("Uploading to Telegram...")
@@ -1973,14 +2314,11 @@ async def upload_gdrive_callback(client: Client, query: CallbackQuery):
              return
              
         try:
-            import zipfile
+            from bot.utils.archive import stream_zip
             dir_path = os.path.dirname(output_path[0])
             zip_path = os.path.join(dir_path, "screenshots.zip")
             
-            with zipfile.ZipFile(zip_path, 'w') as zf:
-                for f in output_path:
-                     if os.path.exists(f):
-                        zf.write(f, os.path.basename(f))
+            await stream_zip(output_path, zip_path)
             
             real_upload_path = zip_path
             is_zip = True
@@ -1996,6 +2334,7 @@ async def upload_gdrive_callback(client: Client, query: CallbackQuery):
     status_msg = await query.message.edit_text("☁️ Uploading to Google Drive...")
     
     try:
+        from bot.utils.gdrive import get_gdrive
         gdrive = get_gdrive()
         if not gdrive.is_ready:
             await gdrive.initialize()
@@ -2092,6 +2431,11 @@ async def cancel_upload_callback(client: Client, query: CallbackQuery):
         except:
             pass
     
+    # A zip kept after a failed upload
+    zip_path = user_data.get(user_id, {}).pop('zip_path', None)
+    if zip_path and os.path.exists(zip_path):
+        os.remove(zip_path)
+    
     await query.message.delete()
     await query.answer("Cancelled and deleted!")
 
@@ -2239,6 +2583,92 @@ async def final_rename_callback(client: Client, query: CallbackQuery):
     await query.answer()
 
 
+@bot.on_callback_query(filters.regex(r"^final_split_"))
+async def split_upload_callback(client: Client, query: CallbackQuery):
+    """Split an oversized output into Telegram-sized parts and upload them"""
+    from bot import TG_MAX_FILE_SIZE
+    from bot.handlers.file_handler import upload_parts
+    
+    user_id = int(query.data.split("_")[2])
+    
+    if query.from_user.id != user_id:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    output_path = user_data.get(user_id, {}).get('output_path')
+    if not output_path or isinstance(output_path, list) or not os.path.exists(output_path):
+        await query.answer("File not found!", show_alert=True)
+        return
+    
+    await query.answer("Splitting for Telegram...")
+    status_msg = await query.message.edit_text("✂️ Splitting into Telegram-sized parts...")
+    
+    base_name, ext = os.path.splitext(os.path.basename(output_path))
+    parts_dir = os.path.join(OUTPUT_DIR, str(user_id), f"{base_name}_parts")
+    os.makedirs(parts_dir, exist_ok=True)
+    parts = []
+    
+    try:
+        # Parts are a stream copy, so they need about as much space as the output
+        async with get_disk_manager().admit(os.path.getsize(output_path), owner=user_id):
+            duration = await FFmpeg(output_path).get_duration()
+            progress = FFmpegProgress(status_msg, duration, "Splitting", filename=os.path.basename(output_path))
+            success, parts = await split_by_size(
+                output_path,
+                os.path.join(parts_dir, f"{base_name}.part%03d{ext}"),
+                TG_MAX_FILE_SIZE * 1024 * 1024,
+                progress_callback=progress.update,
+                duration=duration
+            )
+            if not success:
+                await status_msg.edit_text(f"❌ Split failed: {str(parts)[:500]}")
+                return
+            
+            await upload_parts(client, query.message.chat.id, parts, status_msg, user_id=user_id)
+        
+        await status_msg.edit_text(f"✅ Uploaded {len(parts)} parts of <code>{base_name}{ext}</code>")
+        
+        # Cleanup
+        try:
+            os.remove(output_path)
+            del user_data[user_id]['output_path']
+        except Exception:
+            pass
+    except Exception as e:
+        LOGGER.error(f"Split upload error: {e}")
+        await status_msg.edit_text(f"❌ Upload failed: {str(e)[:200]}")
+    finally:
+        if isinstance(parts, list):
+            for part in parts:
+                if part != output_path and os.path.exists(part):
+                    os.remove(part)
+        try:
+            os.rmdir(parts_dir)
+        except OSError:
+            pass
+
+
+@bot.on_callback_query(filters.regex(r"^final_compress_"))
+async def final_compress_callback(client: Client, query: CallbackQuery):
+    """Re-encode an oversized output so it fits the Telegram limit"""
+    user_id = int(query.data.split("_")[2])
+    
+    if query.from_user.id != user_id:
+        await query.answer("Not your button!", show_alert=True)
+        return
+    
+    output_path = user_data.get(user_id, {}).get('output_path')
+    if not output_path or isinstance(output_path, list) or not os.path.exists(output_path):
+        await query.answer("File not found!", show_alert=True)
+        return
+    
+    await query.answer("Compressing to fit Telegram...")
+    
+    # The oversized output becomes the input of a two-pass compress job
+    user_data[user_id]['file_path'] = output_path
+    await process_video(client, query, 'compress', {})
+
+
 @bot.on_callback_query(filters.regex(r"^final_zip_"))
 async def final_zip_callback(client: Client, query: CallbackQuery):
     """Handle Zip & Upload (After Process)"""
@@ -2250,32 +2680,53 @@ async def final_zip_callback(client: Client, query: CallbackQuery):
         
     await query.answer("Zipping and uploading...")
     
-    # Trigger final processing with ZIP flag
-    # We can reuse the 'upload_to_telegram' flow but wrap it
-    if 'output_path' not in user_data[user_id]:
+    # A zip whose upload failed earlier is uploaded again as it is
+    zip_path = user_data.get(user_id, {}).get('zip_path')
+    if zip_path and not os.path.exists(zip_path):
+        zip_path = None
+    
+    if not zip_path and 'output_path' not in user_data.get(user_id, {}):
         await query.answer("File not found!", show_alert=True)
         return
-        
-    output_path = user_data[user_id]['output_path']
-    new_path = output_path + ".zip"
     
-    status_msg = await query.message.edit_text("⏳ Zipping file...")
+    status_msg = await query.message.edit_text("📤 Uploading zip..." if zip_path else "⏳ Zipping file...")
     
     try:
-        from bot.utils.archive import create_archive
-        zip_path = await create_archive(output_path, new_path, "zip")
+        if not zip_path:
+            output_path = user_data[user_id]['output_path']
+            if isinstance(output_path, list):
+                new_path = os.path.join(os.path.dirname(output_path[0]), "files.zip")
+            else:
+                new_path = output_path + ".zip"
+            
+            from bot.utils.archive import stream_zip
+            # Sources are consumed while zipping so the output never exists twice on disk
+            zip_path = await stream_zip(output_path, new_path, remove_sources=True)
+            # Kept (and protected from cleanup) until it is uploaded
+            user_data[user_id]['zip_path'] = zip_path
+            del user_data[user_id]['output_path']
         
-        if zip_path:
-            # Update output_path to point to zip
-            user_data[user_id]['output_path'] = zip_path
-            # Proceed to upload
-            from bot.handlers.file_handler import upload_processed_file
-            await upload_processed_file(client, user_id, status_msg, "telegram") # Defaulting to Telegram
-        else:
-            await status_msg.edit_text("❌ Zipping failed.")
+        await upload_file(client, query.message.chat.id, zip_path, status_msg, user_id=user_id)
+        await status_msg.delete()
+        
+        user_data[user_id].pop('zip_path', None)
+        try:
+            os.remove(zip_path)
+        except OSError:
+            pass
             
     except Exception as e:
-         await status_msg.edit_text(f"❌ Error: {e}")
+        if zip_path and os.path.exists(zip_path):
+            from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+            await status_msg.edit_text(
+                f"❌ Error: {e}\n\nThe zip is kept, you can retry the upload.",
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("🔁 Retry Upload", callback_data=f"final_zip_{user_id}")],
+                    [InlineKeyboardButton("Cancel & Delete", callback_data=f"cancel_upload_{user_id}")]
+                ])
+            )
+        else:
+            await status_msg.edit_text(f"❌ Error: {e}")
 
 
 @bot.on_callback_query(filters.regex(r"^set_thumb_"))
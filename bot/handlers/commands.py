@@ -3,7 +3,6 @@
 
 from pyrogram import Client, filters
 from pyrogram.types import Message
-import psutil
 import subprocess
 import sys
 import os
@@ -13,6 +12,10 @@ from time import time
 from bot import bot, OWNER_ID, AUTHORIZED_USERS, LOGGER, user_data
 from bot.keyboards.menus import close_button
 from bot.utils.db_handler import get_db
+from bot.utils.watchdog import get_watchdog
+from bot.utils.lazy import lazy_import
+
+psutil = lazy_import('psutil')
 
 
 # Helper function to check authorization
@@ -148,7 +151,9 @@ async def stats_command(client: Client, message: Message):
         "<b>💻 System Info:</b>\n"
         f"• <b>CPU:</b> {cpu}%\n"
         f"• <b>RAM:</b> {ram.percent}% ({ram.used // (1024**3):.1f}GB / {ram.total // (1024**3):.1f}GB)\n"
-        f"• <b>Disk:</b> {disk.percent}% ({disk.used // (1024**3):.1f}GB / {disk.total // (1024**3):.1f}GB)\n"
+        f"• <b>Disk:</b> {disk.percent}% ({disk.used // (1024**3):.1f}GB / {disk.total // (1024**3):.1f}GB)\n\n"
+        "<b>⏱ Stalled Jobs:</b>\n"
+        f"{get_watchdog().report()}"
     )
     
     await message.reply_text(stats_text, reply_markup=close_button(message.from_user.id))
@@ -215,7 +220,7 @@ async def vset_command(client: Client, message: Message):
     
     # Audio
     asr = s.get('sample_rate') or "Source"
-    abr = s.get('audio_bitrate') or "Source"
+    abr = s.get('audio_bitrate') or "192k"
     chn = s.get('channels') or "Source"
     
     # Subs
@@ -261,33 +266,48 @@ async def broadcast_command(client: Client, message: Message):
     if message.from_user.id != OWNER_ID:
         return
     
-    if not message.reply_to_message:
-        await message.reply_text("Reply to a message to broadcast it.")
-        return
+    from bot.utils.broadcast import active_broadcast, start_broadcast
     
     db = get_db()
     if not db:
         await message.reply_text("Database not connected.")
         return
     
-    users = await db.get_all_users()
-    sent = 0
-    failed = 0
+    if active_broadcast:
+        await message.reply_text("A broadcast is already running.")
+        return
     
-    status_msg = await message.reply_text("📢 Broadcasting...")
+    args = message.text.split()
+    action = args[1].lower() if len(args) > 1 else None
+    state = await db.get_broadcast_state()
     
-    for user in users:
-        try:
-            await message.reply_to_message.copy(user['_id'])
-            sent += 1
-        except Exception:
-            failed += 1
-    
-    await status_msg.edit_text(
-        f"<b>📢 Broadcast Complete!</b>\n\n"
-        f"✅ Sent: {sent}\n"
-        f"❌ Failed: {failed}"
-    )
+    if action == 'discard':
+        await db.clear_broadcast_state()
+        await message.reply_text("🗑 Unfinished broadcast discarded." if state else "No unfinished broadcast.")
+        return
+    
+    if action == 'resume':
+        if not state:
+            await message.reply_text("No unfinished broadcast to resume.")
+            return
+        status_msg = await message.reply_text("📢 Resuming broadcast...")
+        await start_broadcast(client, state['from_chat_id'], state['message_id'], status_msg, state)
+        return
+    
+    if not message.reply_to_message:
+        await message.reply_text("Reply to a message to broadcast it.")
+        return
+    
+    if state:
+        await message.reply_text(
+            "⚠️ An earlier broadcast did not finish.\n\n"
+            "Use <code>/broadcast resume</code> to continue it or "
+            "<code>/broadcast discard</code> to drop it first."
+        )
+        return
+    
+    status_msg = await message.reply_text("📢 Broadcasting...")
+    await start_broadcast(client, message.chat.id, message.reply_to_message.id, status_msg)
 
 
 @bot.on_message(filters.command("restart"))
@@ -433,6 +453,36 @@ async def log_command(client: Client, message: Message):
         await message.reply_text(f"❌ Error reading log: {e}")
 
 
+@bot.on_message(filters.command("importtime"))
+async def importtime_command(client: Client, message: Message):
+    """Handle /importtime command - Owner only, profiles bot startup imports"""
+    if message.from_user.id != OWNER_ID:
+        return
+    
+    from bot.utils.lazy import import_time_report, LAZY_LOAD_TIMES
+    
+    status_msg = await message.reply_text("⏱ Profiling startup imports...")
+    
+    try:
+        total, entries = await import_time_report('bot.handlers')
+        
+        text = f"<b>⏱ Cold start imports:</b> <code>{total:.2f}s</code>\n\n"
+        text += "<b>Slowest modules (cumulative / self):</b>\n"
+        for cumulative, self_time, name in entries:
+            text += f"• <code>{name}</code> {cumulative * 1000:.0f} / {self_time * 1000:.0f} ms\n"
+        
+        text += "\n<b>Lazy-loaded since start:</b>\n"
+        if LAZY_LOAD_TIMES:
+            for name, elapsed in sorted(LAZY_LOAD_TIMES.items(), key=lambda x: -x[1]):
+                text += f"• <code>{name}</code> {elapsed * 1000:.0f} ms\n"
+        else:
+            text += "None yet.\n"
+        
+        await status_msg.edit_text(text[:4000])
+    except Exception as e:
+        await status_msg.edit_text(f"❌ Error profiling imports: {e}")
+
+
 @bot.on_message(filters.command("unzip"))
 async def unzip_command(client: Client, message: Message):
     """Handle /unzip command"""
@@ -448,48 +498,49 @@ async def unzip_command(client: Client, message: Message):
         
     status_msg = await message.reply_text("⏳ Downloading file...")
     
+    import shutil
+    import tempfile
+    from contextlib import aclosing
+    from bot import DOWNLOAD_DIR
+    
+    # A private copy, like /zip: the user's own download path may be a session input
+    user_dir = os.path.join(DOWNLOAD_DIR, str(user.id))
+    os.makedirs(user_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="unzip_", dir=user_dir)
     try:
         # Download
         from bot.handlers.file_handler import download_file
-        file_path = await download_file(message.reply_to_message, status_msg)
+        file_path = await download_file(message.reply_to_message, status_msg, user.id, directory=work_dir)
         
         await status_msg.edit_text("⏳ Extracting...")
         
-        output_dir = os.path.join(os.path.dirname(file_path), "extracted_" + str(time()))
+        output_dir = os.path.join(work_dir, "extracted")
         os.makedirs(output_dir, exist_ok=True)
         
-        from bot.utils.archive import extract_archive
-        success = await extract_archive(file_path, output_dir)
+        from bot.utils.archive import iter_extract
+        from bot.handlers.file_handler import upload_file
         
-        if success:
-            await status_msg.edit_text("✅ Extracted! Uploading contents...")
-            
-            # Upload extracted files
-            files = []
-            for root, _, filenames in os.walk(output_dir):
-                for f in filenames:
-                    files.append(os.path.join(root, f))
-            
-            if not files:
-                await status_msg.edit_text("❌ Archive was empty.")
-                return
-                
-            from bot.handlers.file_handler import upload_file
-            # Upload each file (limit to reasonable amount?)
-            count = 0
-            for f in files:
+        # Upload each entry as soon as it is extracted (videos first).
+        # aclosing stops the extractor (and 7z) when we stop early.
+        count = 0
+        async with aclosing(iter_extract(file_path, output_dir)) as entries:
+            async for f in entries:
                 if count > 10:
                     await client.send_message(message.chat.id, "⚠️ Too many files, stopping upload.")
                     break
                 await upload_file(client, message.chat.id, f, status_msg, caption=f"📄 {os.path.basename(f)}")
+                os.remove(f)
                 count += 1
-                
+        
+        if count:
             await status_msg.delete()
         else:
-            await status_msg.edit_text("❌ Extraction failed.")
+            await status_msg.edit_text("❌ Archive was empty.")
             
     except Exception as e:
         await status_msg.edit_text(f"❌ Error: {e}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
 
 @bot.on_message(filters.command("zip"))
@@ -507,16 +558,24 @@ async def zip_command(client: Client, message: Message):
         
     status_msg = await message.reply_text("⏳ Downloading file...")
     
+    import shutil
+    import tempfile
+    from bot import DOWNLOAD_DIR
+    
+    # A private copy: the user's own download path may be a session or job input
+    user_dir = os.path.join(DOWNLOAD_DIR, str(user.id))
+    os.makedirs(user_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="zip_", dir=user_dir)
     try:
         from bot.handlers.file_handler import download_file
-        file_path = await download_file(message.reply_to_message, status_msg)
+        file_path = await download_file(message.reply_to_message, status_msg, user.id, directory=work_dir)
         
         await status_msg.edit_text("⏳ Archiving...")
         
         from bot.utils.archive import create_archive
         # Default name
         out_name = file_path + ".zip"
-        archive_path = await create_archive(file_path, out_name, "zip")
+        archive_path = await create_archive(file_path, out_name, "zip", remove_sources=True)
         
         if archive_path:
             await status_msg.edit_text("✅ Archived! Uploading...")
@@ -527,6 +586,34 @@ async def zip_command(client: Client, message: Message):
             
     except Exception as e:
         await status_msg.edit_text(f"❌ Error: {e}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+@bot.on_message(filters.command("batch"))
+async def batch_command(client: Client, message: Message):
+    """Handle /batch command - Run one operation over many files"""
+    user = message.from_user
+    if not user:
+        return  # Ignore channel posts or anonymous admins
+    if not is_authorized(user.id):
+        return
+    
+    from bot import MAX_BATCH_FILES
+    
+    if user.id not in user_data:
+        user_data[user.id] = {}
+    user_data[user.id]['waiting_for'] = 'batch_files'
+    user_data[user.id]['batch_queue'] = []
+    
+    await message.reply_text(
+        "<b>📦 Batch Mode</b>\n\n"
+        f"Send me up to {MAX_BATCH_FILES} videos, archives of videos or links.\n"
+        "Archives are extracted and each video inside is processed.\n"
+        "Playlist and channel links let you pick which videos to add.\n\n"
+        "Click <b>Done</b> after the first file to choose the operation.",
+        reply_markup=close_button(user.id)
+    )
 
 
 @bot.on_message(filters.command("thumb"))
@@ -590,25 +677,40 @@ async def clean_command(client: Client, message: Message):
         
     import shutil
     from bot import DOWNLOAD_DIR, OUTPUT_DIR
+    from bot.utils.disk import get_disk_manager
+    from bot.utils.helpers import is_protected_path
     
     status_msg = await message.reply_text("🧹 Cleaning cache...")
     
     try:
-        # Clean downloads
-        for item in os.listdir(DOWNLOAD_DIR):
-            item_path = os.path.join(DOWNLOAD_DIR, item)
-            if os.path.isfile(item_path):
-                os.remove(item_path)
-            elif os.path.isdir(item_path):
-                shutil.rmtree(item_path)
-                
-        # Clean outputs
-        for item in os.listdir(OUTPUT_DIR):
-            item_path = os.path.join(OUTPUT_DIR, item)
-            if os.path.isfile(item_path):
-                os.remove(item_path)
-            elif os.path.isdir(item_path):
-                shutil.rmtree(item_path)
+        # Keep files that belong to active sessions and running jobs
+        protected = get_disk_manager().protected_paths()
+        skipped = 0
+        
+        for directory in (DOWNLOAD_DIR, OUTPUT_DIR):
+            for item in os.listdir(directory):
+                item_path = os.path.join(directory, item)
+                if is_protected_path(item_path, protected):
+                    skipped += 1
+                    continue
+                if os.path.isfile(item_path):
+                    os.remove(item_path)
+                elif os.path.isdir(item_path):
+                    # Session files may live inside an otherwise idle user dir
+                    if any(is_protected_path(p, {item_path}) for p in protected):
+                        for root, dirs, files in os.walk(item_path):
+                            for f in files:
+                                f_path = os.path.join(root, f)
+                                if is_protected_path(f_path, protected):
+                                    skipped += 1
+                                else:
+                                    os.remove(f_path)
+                    else:
+                        shutil.rmtree(item_path)
+        
+        if skipped:
+            await status_msg.edit_text(f"✅ <b>Cache cleaned!</b>\n\nKept {skipped} item(s) in use by active tasks.")
+            return
                 
         await status_msg.edit_text("✅ <b>Cache cleaned successfully!</b>")
         
@@ -756,14 +858,47 @@ async def queue_command(client: Client, message: Message):
     if not is_authorized(user.id):
         return
         
-    tasks = []
-    count = 0
+    from bot import MAX_CONCURRENT_FFMPEG, processing_queue
+    from bot.utils.pipeline import get_pipeline
+    from bot.utils.eta import get_eta_model, completion_times, format_eta
+    
+    pipeline = get_pipeline()
+    model = get_eta_model()
+    now = time()
+    
+    # Running FFmpeg work first, then everything waiting for it, in dispatch order
+    running, waiting = [], []
     for uid, data in user_data.items():
         if 'progress' in data and not data['progress'].cancelled:
-             fname = data.get('file_name', 'Unknown')
-             op = data.get('operation', 'Unknown')
-             tasks.append(f"<b>{count+1}.</b> {fname}\n   └ <i>{op}</i> (User: {uid})")
-             count += 1
+            label = f"{data.get('file_name', 'Unknown')}\n   └ <i>{data.get('operation', 'Unknown')}</i> (User: {uid})"
+            if data.get('job_eta'):
+                started, predicted = data['job_eta']
+                running.append((label, max(predicted - (now - started), 0.0)))
+            else:
+                running.append((label, None))
+        for task in processing_queue.get(uid, []):
+            label = f"{data.get('file_name', 'Unknown')}\n   └ <i>{task['operation']}</i> - queued (User: {uid})"
+            waiting.append((label, model.predict(
+                task['operation'], task.get('options'), data.get('duration'), data.get('file_size') or 0
+            )))
+    
+    for job in pipeline.jobs.values():
+        if job.process_started is not None:
+            label = f"{job.file_name}\n   └ <i>{job.operation}</i> - {job.stage} (User: {job.user_id})"
+            running.append((label, job.remaining() if job.stage == 'processing' else 0.0))
+    for job in pipeline.waiting_jobs():
+        label = f"{job.file_name}\n   └ <i>{job.operation}</i> - {job.stage} (User: {job.user_id})"
+        waiting.append((label, job.predicted))
+    
+    running_done, waiting_done = completion_times(
+        [seconds or 0.0 for _, seconds in running], [seconds for _, seconds in waiting], MAX_CONCURRENT_FFMPEG
+    )
+    tasks = []
+    for (label, seconds), done in zip(running, running_done):
+        tasks.append((label, done if seconds is not None else None))
+    tasks += [(label, done) for (label, _), done in zip(waiting, waiting_done)]
+    tasks = [f"<b>{i + 1}.</b> {label}\n   ⏱ Done {format_eta(done)}" for i, (label, done) in enumerate(tasks)]
+    count = len(tasks)
              
     if not tasks:
         await message.reply_text("🥱 <b>No Active Tasks.</b>")
@@ -772,6 +907,68 @@ async def queue_command(client: Client, message: Message):
         await message.reply_text(text, reply_markup=close_button(user.id))
 
 
+@bot.on_message(filters.command("fairshare"))
+async def fairshare_command(client: Client, message: Message):
+    """Handle /fairshare command - FFmpeg usage per tenant, weights and quotas (Owner only)"""
+    if message.from_user.id != OWNER_ID:
+        return
+    
+    from bot import FAIRSHARE_WINDOW
+    from bot.utils.fairshare import parse_tenant, tenant_key
+    from bot.utils.helpers import get_readable_time
+    from bot.utils.scheduler import get_scheduler
+    
+    fair = get_scheduler().ffmpeg
+    args = message.text.split()[1:]
+    
+    if args:
+        action = args[0].lower()
+        try:
+            tenant = parse_tenant(args[1])
+            if action == 'weight':
+                weight = float(args[2])
+                if weight <= 0:
+                    raise ValueError("Weight must be positive")
+                fair.weights[tenant] = weight
+            elif action == 'quota':
+                # Hours of one core, 0 removes the quota
+                fair.quotas[tenant] = float(args[2]) * 3600
+            elif action == 'reset':
+                fair.weights.pop(tenant, None)
+                fair.quotas.pop(tenant, None)
+            else:
+                raise ValueError(f"Unknown action: {action}")
+        except (IndexError, ValueError) as e:
+            await message.reply_text(
+                f"❌ {e if str(e) and not isinstance(e, IndexError) else 'Missing arguments'}\n\n"
+                "<b>Usage:</b>\n"
+                "<code>/fairshare</code> - usage per user/group\n"
+                "<code>/fairshare weight &lt;id&gt; &lt;weight&gt;</code>\n"
+                "<code>/fairshare quota &lt;id&gt; &lt;cpu hours&gt;</code> (0 = none)\n"
+                "<code>/fairshare reset &lt;id&gt;</code>\n\n"
+                "IDs are user IDs, negative group IDs, or <code>user:ID</code> / <code>group:ID</code>."
+            )
+            return
+        await fair.save()
+        await message.reply_text(f"✅ Updated <code>{tenant_key(tenant)}</code>")
+        return
+    
+    rows = fair.report()
+    lines = []
+    for row in rows[:20]:
+        quota = f" / {get_readable_time(int(row['quota']))}" if row['quota'] else ""
+        lines.append(
+            f"• <code>{tenant_key(row['tenant'])}</code>: {get_readable_time(int(row['used']))}{quota} CPU"
+            f" | weight {row['weight']:g} | ▶️ {row['running']} ⏳ {row['waiting']}"
+        )
+    
+    await message.reply_text(
+        f"<b>⚖️ Fair Share</b> (last {get_readable_time(FAIRSHARE_WINDOW)})\n\n"
+        + ("\n".join(lines) if lines else "No FFmpeg usage yet."),
+        reply_markup=close_button(message.from_user.id)
+    )
+
+
 # ─────────────────────────────────────────────────────────────
 # Group Authorization Command
 # ─────────────────────────────────────────────────────────────
@@ -3,6 +3,7 @@
 
 import os
 import asyncio
+from typing import Callable
 from pyrogram import Client, filters
 from pyrogram.types import Message
 
@@ -11,6 +12,9 @@ from bot.keyboards.menus import main_menu, close_button
 from bot.ffmpeg.core import get_video_info, format_media_info
 from bot.utils.helpers import is_video_file, get_readable_file_size
 from bot.utils.progress import Progress
+from bot.utils.disk import get_disk_manager
+from bot.utils.input_cache import get_input_cache
+from bot.utils.watchdog import get_watchdog
 
 
 # Helper function to check authorization
@@ -105,6 +109,43 @@ async def handle_video(client: Client, message: Message):
         )
         return
 
+    # 2a. Collecting files for a batch
+    if waiting_for == 'batch_files':
+        from bot import MAX_BATCH_FILES
+        from bot.utils.scheduler import is_archive_file
+        
+        is_video = bool(message.video) or (message.document and is_video_file(fname))
+        is_archive = bool(message.document) and is_archive_file(fname)
+        
+        if not is_video and not is_archive:
+            await message.reply_text("❌ Please send a video file or an archive of videos.")
+            return
+        
+        batch_queue = user_data[user.id].setdefault('batch_queue', [])
+        if len(batch_queue) >= MAX_BATCH_FILES:
+            await message.reply_text(f"❌ Batch is full ({MAX_BATCH_FILES} files). Click <b>Done</b> to continue.")
+            return
+        
+        batch_queue.append({
+            'type': 'archive' if is_archive else 'telegram',
+            'message': message,
+            'name': fname or f"video_{message.video.file_unique_id}.mp4"
+        })
+        
+        from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Done - Choose Operation", callback_data=f"batch_done_{user.id}")],
+            [InlineKeyboardButton("❌ Cancel", callback_data=f"close_{user.id}")]
+        ])
+        
+        await message.reply_text(
+            f"✅ {'Archive' if is_archive else 'Video'} #{len(batch_queue)} added to batch!\n\n"
+            f"Send more or click <b>Done</b>.",
+            reply_markup=keyboard,
+            quote=True
+        )
+        return
+
     # 2b. Legacy second_video handler (kept for backward compat)
     if waiting_for == 'second_video':
         # Check if it's a video
@@ -134,14 +175,21 @@ async def handle_video(client: Client, message: Message):
     
     if is_video:
         file_name = fname or f"video_{message.video.file_unique_id}.mp4"
-        file_size = message.document.file_size if message.document else message.video.file_size
+        media = message.document or message.video
+        file_size = media.file_size
+        
+        # A new file ends the previous session; the same file again reuses its download
+        cache = get_input_cache()
+        cache.evict_user(user.id, keep=media.file_unique_id)
         
         # Store file info for this user
         user_data[user.id] = {
             'message_id': message.id,
             'file_name': file_name,
             'file_size': file_size,
-            'file_path': None,
+            'file_unique_id': media.file_unique_id,
+            'file_path': cache.get(media.file_unique_id),
+            'duration': getattr(message.video, 'duration', 0) or 0,
             'operation': None,
             'settings': user_data.get(user.id, {}).get('settings', {}),
         }
@@ -264,7 +312,13 @@ from bot.utils.helpers import sanitize_filename
 # NOTE: All text input handling has been consolidated into bot.handlers.message_handler
 # to avoid handler conflicts. URL handling is triggered from there via handle_url_logic.
 
-async def handle_url_logic(client, message, text):
+# Sites that need yt-dlp (and may have playlists or channels)
+VIDEO_PLATFORMS = ['youtube.com', 'youtu.be', 'vimeo.com', 'dailymotion.com', 
+                   'twitch.tv', 'twitter.com', 'x.com', 'facebook.com', 'instagram.com',
+                   'tiktok.com', 'reddit.com', 'bilibili.com']
+
+
+async def handle_url_logic(client, message, text, playlist: bool = True):
     """Refactored URL handling logic"""
     user = message.from_user
     status_msg = await message.reply_text("🔎 Processing URL...", quote=True)
@@ -274,6 +328,21 @@ async def handle_url_logic(client, message, text):
     match = re.search(r'(https?://\S+)', text)
     url = match.group(1) if match else text.strip()
     
+    from bot import ENABLE_YTDLP
+    batch_mode = user_data.get(user.id, {}).get('waiting_for') == 'batch_files'
+    
+    # Playlists and channels are listed once (titles only) and become a batch
+    if ENABLE_YTDLP and (playlist or batch_mode):
+        from bot.utils.ytdlp_handler import get_playlist_entries
+        is_video_platform = any(platform in url.lower() for platform in VIDEO_PLATFORMS)
+        entries = await get_playlist_entries(url, user.id) if playlist and is_video_platform else None
+        if entries:
+            await offer_playlist(message, status_msg, url, entries, keep_batch=batch_mode)
+            return
+        if batch_mode:
+            await add_batch_url(user.id, status_msg, url)
+            return
+    
     # 1. Try Direct Link Generator
     from bot.utils.direct_links import direct_link_generator
     direct_link = direct_link_generator(url)
@@ -298,17 +367,18 @@ async def handle_url_logic(client, message, text):
         user_dir = os.path.join(DOWNLOAD_DIR, str(user.id))
         os.makedirs(user_dir, exist_ok=True)
         
-        file_path = None
+        cache = get_input_cache()
+        cache_key = f"url:{url}"
+        cache.evict_user(user.id, keep=cache_key)
+        file_path = cache.get(cache_key)
         
         # Check if URL is from a video platform that requires yt-dlp
-        video_platforms = ['youtube.com', 'youtu.be', 'vimeo.com', 'dailymotion.com', 
-                           'twitch.tv', 'twitter.com', 'x.com', 'facebook.com', 'instagram.com',
-                           'tiktok.com', 'reddit.com', 'bilibili.com']
-        is_video_platform = any(platform in url.lower() for platform in video_platforms)
+        is_video_platform = any(platform in url.lower() for platform in VIDEO_PLATFORMS)
         
-        if is_video_platform:
+        if file_path:
+            await status_msg.edit_text("♻️ Reusing the earlier download of this link...")
+        elif is_video_platform:
             # Use yt-dlp handler for video platforms
-            from bot import ENABLE_YTDLP
             if ENABLE_YTDLP:
                 from bot.utils.ytdlp_handler import download_with_ytdlp
                 success, result = await download_with_ytdlp(
@@ -332,7 +402,6 @@ async def handle_url_logic(client, message, text):
         
         # If HTTP download failed and yt-dlp is enabled, try yt-dlp as a fallback
         if not file_path:
-            from bot import ENABLE_YTDLP
             if ENABLE_YTDLP:
                 await status_msg.edit_text(
                     "⚠️ Direct download failed.\n"
@@ -354,11 +423,13 @@ async def handle_url_logic(client, message, text):
         # Prepare for processing
         file_name = os.path.basename(file_path)
         file_size = os.path.getsize(file_path)
+        cache.put(cache_key, file_path, user.id)
         
         user_data[user.id] = {
             'message_id': message.id,
             'file_name': file_name,
             'file_size': file_size,
+            'file_unique_id': cache_key,
             'file_path': file_path, # Local path now
             'processing_file': file_path, # Set this too
             'operation': None,
@@ -383,13 +454,92 @@ async def handle_url_logic(client, message, text):
         await status_msg.edit_text(f"❌ Error downloading URL: {str(e)}")
 
 
-async def download_file(message: Message, status_msg: Message, user_id: int = None) -> str:
+async def offer_playlist(message, status_msg, url: str, entries: list, keep_batch: bool = False):
+    """Show a playlist's entries and wait for the user to pick which ones to batch"""
+    from bot import MAX_BATCH_FILES
+    from bot.keyboards.menus import playlist_menu
+    
+    user = message.from_user
+    data = user_data.setdefault(user.id, {})
+    if not keep_batch:
+        data['batch_queue'] = []
+    data['playlist'] = {'url': url, 'entries': entries, 'message': message, 'keep_batch': keep_batch}
+    data['waiting_for'] = 'playlist_range'
+    
+    lines = [f"{i + 1}. {entry['title'][:60]}" for i, entry in enumerate(entries[:10])]
+    if len(entries) > 10:
+        lines.append(f"... and {len(entries) - 10} more")
+    
+    await status_msg.edit_text(
+        f"<b>📃 Playlist: {len(entries)} video(s)</b>\n\n"
+        + "\n".join(lines) +
+        f"\n\nSend the videos to process, like <code>1-10</code>, <code>3, 5, 7</code> "
+        f"or <code>all</code> (up to {MAX_BATCH_FILES} per batch).",
+        reply_markup=playlist_menu(user.id, len(entries))
+    )
+
+
+async def add_batch_url(user_id: int, status_msg, url: str):
+    """Add a single link to the batch being collected"""
+    from bot import MAX_BATCH_FILES
+    from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+    
+    batch_queue = user_data[user_id].setdefault('batch_queue', [])
+    if len(batch_queue) >= MAX_BATCH_FILES:
+        await status_msg.edit_text(f"❌ Batch is full ({MAX_BATCH_FILES} files). Click <b>Done</b> to continue.")
+        return
+    
+    batch_queue.append({'type': 'url', 'url': url, 'name': url[:100]})
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Done - Choose Operation", callback_data=f"batch_done_{user_id}")],
+        [InlineKeyboardButton("❌ Cancel", callback_data=f"close_{user_id}")]
+    ])
+    await status_msg.edit_text(
+        f"✅ Link #{len(batch_queue)} added to batch!\n\n"
+        f"Send more or click <b>Done</b>.",
+        reply_markup=keyboard
+    )
+
+
+async def queue_batch_urls(user_id: int, status_msg, entries: list):
+    """Add yt-dlp links to the user's batch and show the batch operations"""
+    from bot import MAX_BATCH_FILES
+    from bot.keyboards.menus import batch_menu
+    
+    data = user_data.setdefault(user_id, {})
+    batch_queue = data.setdefault('batch_queue', [])
+    room = max(MAX_BATCH_FILES - len(batch_queue), 0)
+    batch_queue.extend(
+        {'type': 'url', 'url': entry['url'], 'name': entry['title'][:100]}
+        for entry in entries[:room]
+    )
+    data['waiting_for'] = None
+    data.pop('playlist', None)
+    
+    skipped = len(entries) - min(len(entries), room)
+    text = f"<b>📦 Batch: {len(batch_queue)} file(s)</b>\n\n"
+    if skipped:
+        text += f"⚠️ {skipped} video(s) skipped, batches hold up to {MAX_BATCH_FILES}.\n\n"
+    await status_msg.edit_text(
+        text + "Select the operation to run on every file:",
+        reply_markup=batch_menu(user_id)
+    )
+
+
+async def download_file(
+    message: Message,
+    status_msg: Message,
+    user_id: int = None,
+    progress_callback: Callable = None,
+    directory: str = None
+) -> str:
     """Download file from message with progress"""
     user = message.from_user
     uid = user_id or user.id
     
-    # Create user directory
-    user_dir = os.path.join(DOWNLOAD_DIR, str(uid))
+    # Create user directory (jobs that run side by side pass their own)
+    user_dir = directory or os.path.join(DOWNLOAD_DIR, str(uid))
     os.makedirs(user_dir, exist_ok=True)
     
     # Get file name
@@ -402,20 +552,29 @@ async def download_file(message: Message, status_msg: Message, user_id: int = No
     else:
         file_name = "unknown_file"
     
+    media = message.video or message.document or message.audio
+    file_size = getattr(media, 'file_size', 0) or 0
+    
     file_path = os.path.join(user_dir, file_name)
     
     # Create progress with cancel button
     progress = Progress(status_msg, "📥 Downloading", user_id=uid, filename=file_name)
     
-    # Store progress instance for cancellation
-    if uid in user_data:
+    # Store progress instance for cancellation (callers passing their own callback track it themselves)
+    if progress_callback is None and uid in user_data:
         user_data[uid]['progress'] = progress
     
+    async def _waiting_for_disk():
+        await status_msg.edit_text("⏳ Waiting for free disk space...")
+    
     try:
-        await message.download(
-            file_name=file_path,
-            progress=progress.progress_callback
-        )
+        # No-op when called from a job that already reserved its footprint
+        async with get_disk_manager().admit(file_size, owner=uid, on_wait=_waiting_for_disk):
+            # Started again if it stops moving
+            await get_watchdog().run('download', lambda heartbeat, _: message.download(
+                file_name=file_path,
+                progress=heartbeat.wrap(progress_callback or progress.progress_callback)
+            ))
     except Exception as e:
         if progress.cancelled:
             raise asyncio.CancelledError("Cancelled by user")
@@ -424,31 +583,80 @@ async def download_file(message: Message, status_msg: Message, user_id: int = No
     return file_path
 
 
-async def upload_file(client: Client, chat_id: int, file_path: str | list, status_msg: Message, caption: str = None, user_id: int = None):
+# Extensions sent as streamable videos rather than documents
+VIDEO_UPLOAD_EXTS = ('.mp4', '.mkv', '.avi', '.mov', '.webm')
+
+
+async def video_metadata(file_path: str):
+    """Duration, width, height and a thumbnail path (or None) for sending a video"""
+    duration = 0
+    width = 0
+    height = 0
+    thumb_path = None
+    
+    try:
+        from bot.ffmpeg import FFmpeg
+        ffmpeg = FFmpeg(file_path)
+        duration = int(await ffmpeg.get_duration())
+        
+        # Get resolution
+        streams = await ffmpeg.get_streams()
+        video_streams = streams.get('video', [])
+        if video_streams:
+            width = video_streams[0].get('width', 0)
+            height = video_streams[0].get('height', 0)
+        
+        # Generate thumbnail
+        thumb_dir = os.path.dirname(file_path)
+        thumb_path = os.path.join(thumb_dir, f"{os.path.splitext(os.path.basename(file_path))[0]}_thumb.jpg")
+        await ffmpeg.extract_thumbnail(thumb_path)
+        if not os.path.exists(thumb_path):
+            thumb_path = None
+    except Exception as e:
+        LOGGER.warning(f"Could not get video metadata: {e}")
+    return duration, width, height, thumb_path
+
+
+async def upload_file(
+    client: Client,
+    chat_id: int,
+    file_path: str | list,
+    status_msg: Message,
+    caption: str = None,
+    user_id: int = None,
+    progress_callback: Callable = None
+):
     """Upload file with progress"""
     
-    # Handle list of files (Media Group)
+    # Handle list of files
     if isinstance(file_path, list):
-        from pyrogram.types import InputMediaPhoto
-        media = []
-        for f in file_path:
-            # Assume photos for now (screenshots)
-            media.append(InputMediaPhoto(f))
+        image_exts = ('.jpg', '.jpeg', '.png', '.webp')
+        photos = [f for f in file_path if f.lower().endswith(image_exts)]
+        others = [f for f in file_path if not f.lower().endswith(image_exts)]
         
-        await status_msg.edit_text("📤 Uploading album...")
-        try:
-            await client.send_media_group(chat_id, media)
-        except Exception as e:
-            await status_msg.edit_text(f"❌ Upload failed: {e}")
-            raise e
+        # Screenshots go out as albums (Telegram allows 10 per group)
+        if photos:
+            from pyrogram.types import InputMediaPhoto
+            await status_msg.edit_text("📤 Uploading album...")
+            try:
+                for i in range(0, len(photos), 10):
+                    await client.send_media_group(chat_id, [InputMediaPhoto(f) for f in photos[i:i + 10]])
+            except Exception as e:
+                await status_msg.edit_text(f"❌ Upload failed: {e}")
+                raise e
+        
+        # Anything else (e.g. extracted streams) is sent file by file with progress
+        for f in others:
+            await upload_file(client, chat_id, f, status_msg, user_id=user_id, progress_callback=progress_callback)
         return
     
     file_name = os.path.basename(file_path) if isinstance(file_path, str) else "Album"
     progress = Progress(status_msg, "📤 Uploading", user_id=user_id, filename=file_name)
     
-    # Store progress for cancellation
-    if user_id and user_id in user_data:
+    # Store progress for cancellation (callers passing their own callback track it themselves)
+    if progress_callback is None and user_id and user_id in user_data:
         user_data[user_id]['progress'] = progress
+    callback = progress_callback or progress.progress_callback
     
     file_size = 0  # Will be set below or calculated
     if isinstance(file_path, str):
@@ -456,39 +664,14 @@ async def upload_file(client: Client, chat_id: int, file_path: str | list, statu
          # file_name already set
     
     # Decide upload method based on file type
-    video_exts = ['.mp4', '.mkv', '.avi', '.mov', '.webm']
     ext = os.path.splitext(file_name)[1].lower()
     
     try:
-        if ext in video_exts:
+        if ext in VIDEO_UPLOAD_EXTS:
             # Get video metadata for proper display
-            duration = 0
-            width = 0
-            height = 0
-            thumb_path = None
-            
-            try:
-                from bot.ffmpeg import FFmpeg
-                ffmpeg = FFmpeg(file_path)
-                duration = int(await ffmpeg.get_duration())
-                
-                # Get resolution
-                streams = await ffmpeg.get_streams()
-                video_streams = streams.get('video', [])
-                if video_streams:
-                    width = video_streams[0].get('width', 0)
-                    height = video_streams[0].get('height', 0)
-                
-                # Generate thumbnail
-                thumb_dir = os.path.dirname(file_path)
-                thumb_path = os.path.join(thumb_dir, f"{os.path.splitext(file_name)[0]}_thumb.jpg")
-                await ffmpeg.extract_thumbnail(thumb_path)
-                if not os.path.exists(thumb_path):
-                    thumb_path = None
-            except Exception as e:
-                LOGGER.warning(f"Could not get video metadata: {e}")
+            duration, width, height, thumb_path = await video_metadata(file_path)
             
-            await client.send_video(
+            await get_watchdog().run('upload', lambda heartbeat, _: client.send_video(
                 chat_id,
                 file_path,
                 caption=caption or f"✅ <code>{file_name}</code>",
@@ -497,8 +680,8 @@ async def upload_file(client: Client, chat_id: int, file_path: str | list, statu
                 height=height,
                 thumb=thumb_path,
                 supports_streaming=True,
-                progress=progress.progress_callback
-            )
+                progress=heartbeat.wrap(callback)
+            ))
             
             # Cleanup thumbnail
             if thumb_path and os.path.exists(thumb_path):
@@ -507,13 +690,88 @@ async def upload_file(client: Client, chat_id: int, file_path: str | list, statu
                 except:
                     pass
         else:
-            await client.send_document(
+            await get_watchdog().run('upload', lambda heartbeat, _: client.send_document(
                 chat_id,
                 file_path,
                 caption=caption or f"✅ <code>{file_name}</code>",
-                progress=progress.progress_callback
-            )
+                progress=heartbeat.wrap(callback)
+            ))
     except Exception as e:
         if progress.cancelled:
             raise asyncio.CancelledError("Cancelled by user")
         raise e
+
+
+async def upload_parts(
+    client: Client,
+    chat_id: int,
+    parts: list,
+    status_msg: Message,
+    user_id: int = None
+):
+    """Upload a series of parts side by side, then post them in order"""
+    from pyrogram import raw, utils
+    from bot.utils.scheduler import get_scheduler
+    
+    total = sum(os.path.getsize(p) for p in parts)
+    sent = [0] * len(parts)
+    
+    progress = Progress(status_msg, "📤 Uploading parts", user_id=user_id, filename=f"{len(parts)} parts")
+    if user_id and user_id in user_data:
+        user_data[user_id]['progress'] = progress
+    
+    async def _save(index: int, part: str):
+        async def callback(current: int, _total: int):
+            sent[index] = current
+            await progress.progress_callback(sum(sent), total)
+        
+        async with get_scheduler().upload:
+            return await get_watchdog().run('upload', lambda heartbeat, _: client.save_file(
+                part, progress=heartbeat.wrap(callback)
+            ))
+    
+    # send_video/send_document upload and post in one call, so parts sent
+    # side by side would land in whatever order their uploads finish.
+    # The uploads run concurrently and only the (quick) posts are in order.
+    uploads = [asyncio.create_task(_save(i, p)) for i, p in enumerate(parts)]
+    try:
+        files = await asyncio.gather(*uploads)
+    except BaseException as e:
+        for task in uploads:
+            task.cancel()
+        await asyncio.gather(*uploads, return_exceptions=True)
+        if progress.cancelled:
+            raise asyncio.CancelledError("Cancelled by user")
+        raise e
+    
+    peer = await client.resolve_peer(chat_id)
+    for index, (part, file) in enumerate(zip(parts, files)):
+        file_name = os.path.basename(part)
+        caption = f"📦 <b>Part {index + 1}/{len(parts)}</b>\n<code>{file_name}</code>"
+        attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+        thumb_path = None
+        thumb = None
+        
+        if os.path.splitext(file_name)[1].lower() in VIDEO_UPLOAD_EXTS:
+            duration, width, height, thumb_path = await video_metadata(part)
+            attributes.append(raw.types.DocumentAttributeVideo(
+                duration=duration, w=width, h=height, supports_streaming=True
+            ))
+            if thumb_path:
+                thumb = await client.save_file(thumb_path)
+        
+        try:
+            await client.invoke(raw.functions.messages.SendMedia(
+                peer=peer,
+                media=raw.types.InputMediaUploadedDocument(
+                    mime_type=client.guess_mime_type(part) or "application/octet-stream",
+                    file=file,
+                    thumb=thumb,
+                    attributes=attributes
+                ),
+                random_id=client.rnd_id(),
+                **await utils.parse_text_entities(client, caption, None, None)
+            ))
+        finally:
+            if thumb_path and os.path.exists(thumb_path):
+                os.remove(thumb_path)
@@ -130,11 +130,21 @@ async def handle_text_input(client: Client, message: Message):
         elif waiting_for == 'ffmpeg_cmd':
             # Validate command
             cmd = text.strip()
+            from bot.ffmpeg.custom import parse_custom_command, InvalidCommand
+            try:
+                command = parse_custom_command(cmd)
+            except InvalidCommand as e:
+                await message.reply_text(f"❌ {e}\n\nSend the arguments again.", quote=True)
+                return
             user_data[user_id]['ffmpeg_args'] = cmd
             user_data[user_id]['waiting_for'] = None
             
-            await message.reply_text(f"✅ Executing custom command...", quote=True)
-            await process_video(client, MockQuery(message, user), 'ffmpeg_cmd', {'args': cmd})
+            notes = "".join(f"\n• {note}" for note in command.notes)
+            await message.reply_text(f"✅ Executing custom command...{notes}", quote=True)
+            await process_video(
+                client, MockQuery(message, user), 'ffmpeg_cmd',
+                {'args': cmd, 'user_id': user_id, 'chat_id': message.chat.id}
+            )
 
         elif waiting_for == 'sub_intro_text':
             user_data[user_id]['sub_intro_text'] = text
@@ -186,7 +196,29 @@ async def handle_text_input(client: Client, message: Message):
         elif waiting_for.startswith('enc_'):
             # Encoding settings (persist both in-memory and to DB)
             setting = waiting_for.replace('enc_', '')
+            # Codec prompts store under the names the encoder and /vset read
+            setting = {'vcodec': 'video_codec', 'acodec': 'audio_codec'}.get(setting, setting)
             value = text.strip()
+            
+            if setting == 'target_quality':
+                if value.lower() in ('off', 'none', '0'):
+                    value = None
+                else:
+                    from bot.ffmpeg.quality import parse_quality_target
+                    try:
+                        await parse_quality_target(value)
+                    except ValueError as e:
+                        await message.reply_text(f"❌ {e}")
+                        return
+            else:
+                from bot.ffmpeg.settings import EncodeSettings, InvalidSettings
+                from bot.handlers.callbacks import load_encode_settings
+                # Checked with the rest of the settings, e.g. CRF limits depend on the codec
+                try:
+                    EncodeSettings.from_dict({**await load_encode_settings(user_id), setting: value})
+                except InvalidSettings as e:
+                    await message.reply_text(f"❌ {e}")
+                    return
 
             if 'settings' not in user_data[user_id]:
                 user_data[user_id]['settings'] = {}
@@ -288,6 +320,8 @@ async def handle_text_input(client: Client, message: Message):
             
             try:
                 os.rename(old_path, new_path)
+                from bot.utils.input_cache import get_input_cache
+                get_input_cache().move(old_path, new_path)
                 user_data[user_id]['file_path'] = new_path
                 user_data[user_id]['processing_file'] = new_path
                 user_data[user_id]['file_name'] = new_name
@@ -301,6 +335,22 @@ async def handle_text_input(client: Client, message: Message):
             except Exception as e:
                 await message.reply_text(f"❌ Rename failed: {e}")
 
+        elif waiting_for == 'playlist_range':
+            from bot.utils.helpers import parse_selection
+            from bot.handlers.file_handler import queue_batch_urls
+            entries = user_data[user_id].get('playlist', {}).get('entries', [])
+            try:
+                indexes = parse_selection(text, len(entries))
+            except ValueError:
+                await message.reply_text(
+                    "❌ Invalid selection. Use e.g. <code>1-10</code>, <code>3, 5, 7</code> or <code>all</code>.",
+                    quote=True
+                )
+                return
+            
+            status_msg = await message.reply_text(f"✅ {len(indexes)} video(s) selected", quote=True)
+            await queue_batch_urls(user_id, status_msg, [entries[i] for i in indexes])
+
         elif waiting_for == 'final_rename_input':
             # Handle Final Rename Input
             from bot.utils.helpers import sanitize_filename
@@ -58,10 +58,11 @@ def encode_menu(user_id: int, settings: dict = None) -> InlineKeyboardMarkup:
     # Get current values for labels
     crf = settings.get('crf', 'Default')
     preset = settings.get('preset', 'Default')
-    vcodec = settings.get('vcodec', 'Default')
-    acodec = settings.get('acodec', 'Default')
+    vcodec = settings.get('video_codec', 'Default')
+    acodec = settings.get('audio_codec', 'Default')
     res = settings.get('resolution', 'Original')
     fps = settings.get('fps', 'Original')
+    target_quality = settings.get('target_quality') or 'Off'
 
     buttons = [
         [
@@ -76,6 +77,9 @@ def encode_menu(user_id: int, settings: dict = None) -> InlineKeyboardMarkup:
             InlineKeyboardButton(f"Res: {res}", callback_data=f"enc_res_{user_id}"),
             InlineKeyboardButton(f"FPS: {fps}", callback_data=f"enc_fps_{user_id}"),
         ],
+        [
+            InlineKeyboardButton(f"Target Quality: {target_quality}", callback_data=f"enc_quality_{user_id}"),
+        ],
         [
             InlineKeyboardButton("Profiles", callback_data=f"enc_profile_{user_id}"),
         ],
@@ -154,6 +158,68 @@ def convert_menu(user_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(buttons)
 
 
+def preview_prompt_menu(user_id: int) -> InlineKeyboardMarkup:
+    """Offer a preview clip before a full-length re-encode"""
+    buttons = [
+        [InlineKeyboardButton("👁 Preview 10s Clip", callback_data=f"jobpreview_{user_id}")],
+        [InlineKeyboardButton("▶️ Process Full Video", callback_data=f"jobstart_{user_id}")],
+        [InlineKeyboardButton("Cancel", callback_data=f"jobdrop_{user_id}")],
+    ]
+    return InlineKeyboardMarkup(buttons)
+
+
+def preview_result_menu(user_id: int) -> InlineKeyboardMarkup:
+    """Approve or discard a job after watching its preview"""
+    buttons = [
+        [InlineKeyboardButton("✅ Looks Good, Process Full Video", callback_data=f"jobstart_{user_id}")],
+        [InlineKeyboardButton("❌ Discard", callback_data=f"jobdrop_{user_id}")],
+    ]
+    return InlineKeyboardMarkup(buttons)
+
+
+def batch_menu(user_id: int) -> InlineKeyboardMarkup:
+    """Operation menu for a batch of files"""
+    buttons = [
+        [
+            InlineKeyboardButton("Encode (My Settings)", callback_data=f"batchop_encode_{user_id}"),
+            InlineKeyboardButton("Compress", callback_data=f"batchop_compress_{user_id}"),
+        ],
+        [
+            InlineKeyboardButton("To .mp4", callback_data=f"batchop_mp4_{user_id}"),
+            InlineKeyboardButton("To .mkv", callback_data=f"batchop_mkv_{user_id}"),
+        ],
+        [
+            InlineKeyboardButton("Extract Audio", callback_data=f"batchop_mp3_{user_id}"),
+            InlineKeyboardButton("Remove Audio", callback_data=f"batchop_noaudio_{user_id}"),
+        ],
+        [
+            InlineKeyboardButton("Sample Video", callback_data=f"batchop_sample_{user_id}"),
+            InlineKeyboardButton("Thumbnail", callback_data=f"batchop_thumb_{user_id}"),
+        ],
+        [
+            InlineKeyboardButton("Merge All", callback_data=f"batchop_merge_{user_id}"),
+        ],
+        [
+            InlineKeyboardButton("Cancel", callback_data=f"close_{user_id}"),
+        ],
+    ]
+    return InlineKeyboardMarkup(buttons)
+
+
+def playlist_menu(user_id: int, count: int) -> InlineKeyboardMarkup:
+    """Entry selection for a playlist or channel link"""
+    buttons = [
+        [
+            InlineKeyboardButton(f"All ({count})", callback_data=f"plall_{user_id}"),
+            InlineKeyboardButton("Only This Link", callback_data=f"plsingle_{user_id}"),
+        ],
+        [
+            InlineKeyboardButton("Cancel", callback_data=f"close_{user_id}"),
+        ],
+    ]
+    return InlineKeyboardMarkup(buttons)
+
+
 def extract_menu(user_id: int) -> InlineKeyboardMarkup:
     """Stream extraction menu"""
     buttons = [
@@ -169,6 +235,10 @@ def extract_menu(user_id: int) -> InlineKeyboardMarkup:
             InlineKeyboardButton("Screenshots", callback_data=f"ext_ss_{user_id}"),
             InlineKeyboardButton("Sample Video", callback_data=f"ext_sample_{user_id}"),
         ],
+        [
+            InlineKeyboardButton("Extract All", callback_data=f"ext_all_{user_id}"),
+            InlineKeyboardButton("Pick Streams", callback_data=f"ext_pick_{user_id}"),
+        ],
         [
             InlineKeyboardButton("Back", callback_data=f"main_{user_id}"),
         ],
@@ -254,6 +324,24 @@ def stream_selection_menu(user_id: int, streams: list, stream_type: str) -> Inli
     return InlineKeyboardMarkup(buttons)
 
 
+def multi_stream_menu(user_id: int, streams: list, selected: set) -> InlineKeyboardMarkup:
+    """Menu to toggle several streams for a single-pass extraction"""
+    icons = {'video': "🎬", 'audio': "🔊", 'subtitle': "📝"}
+    buttons = []
+    
+    for stream in streams:
+        index = stream.get('index')
+        lang = stream.get('tags', {}).get('language', 'und')
+        codec = stream.get('codec_name', 'unk')
+        mark = "✅" if index in selected else "⬜"
+        label = f"{mark} {icons.get(stream.get('codec_type'), '')} #{index} {lang} ({codec})"
+        buttons.append([InlineKeyboardButton(label, callback_data=f"extsel_{index}_{user_id}")])
+    
+    buttons.append([InlineKeyboardButton(f"Extract Selected ({len(selected)})", callback_data=f"extsel_go_{user_id}")])
+    buttons.append([InlineKeyboardButton("Back", callback_data=f"extract_{user_id}")])
+    return InlineKeyboardMarkup(buttons)
+
+
 def remove_menu(user_id: int) -> InlineKeyboardMarkup:
     """Stream removal menu"""
     buttons = [
@@ -433,7 +521,10 @@ def after_process_menu(user_id: int, file_size_mb: float, gdrive_enabled: bool =
         ])
     else:
         buttons.append([
-            InlineKeyboardButton("Too large for Telegram (>2GB)", callback_data=f"none_{user_id}"),
+            InlineKeyboardButton("✂️ Split for Telegram", callback_data=f"final_split_{user_id}"),
+        ])
+        buttons.append([
+            InlineKeyboardButton("🗜 Compress to fit Telegram", callback_data=f"final_compress_{user_id}"),
         ])
     
     # Google Drive is always available if enabled
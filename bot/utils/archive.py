@@ -3,8 +3,11 @@ import os
 import shutil
 import asyncio
 import logging
+import threading
 import time
 
+from bot.utils.jobs import spawn
+
 LOGGER = logging.getLogger(__name__)
 
 async def extract_archive(file_path: str, output_dir: str, password: str = None) -> bool:
@@ -21,7 +24,7 @@ async def extract_archive(file_path: str, output_dir: str, password: str = None)
             if password:
                 cmd.append(f'-p{password}')
                 
-            process = await asyncio.create_subprocess_exec(
+            process = await spawn(
                 *cmd,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE
@@ -47,7 +50,282 @@ async def extract_archive(file_path: str, output_dir: str, password: str = None)
         LOGGER.error(f"Extraction failed: {e}")
         return False
 
-async def create_archive(input_path: str, output_path: str, type: str = "zip", password: str = None) -> str:
+def _safe_target(output_dir: str, name: str) -> str:
+    """Resolve an entry path inside output_dir, None if it would escape it"""
+    target = os.path.abspath(os.path.join(output_dir, name))
+    if not target.startswith(os.path.abspath(output_dir) + os.sep):
+        return None
+    return target
+
+
+async def list_archive(file_path: str, password: str = None) -> list:
+    """
+    List archive entries as dicts with name, size and is_dir.
+    Uses zipfile/tarfile when possible, 7z for everything else.
+    """
+    import zipfile
+    import tarfile
+    
+    if zipfile.is_zipfile(file_path) and not password:
+        def _list_zip():
+            with zipfile.ZipFile(file_path) as zf:
+                return [
+                    {'name': i.filename, 'size': i.file_size, 'is_dir': i.is_dir()}
+                    for i in zf.infolist()
+                ]
+        return await asyncio.to_thread(_list_zip)
+    
+    if tarfile.is_tarfile(file_path):
+        def _list_tar():
+            with tarfile.open(file_path) as tf:
+                return [
+                    {'name': m.name, 'size': m.size, 'is_dir': m.isdir()}
+                    for m in tf.getmembers() if m.isfile() or m.isdir()
+                ]
+        return await asyncio.to_thread(_list_tar)
+    
+    if not shutil.which('7z'):
+        return []
+    
+    cmd = ['7z', 'l', '-slt', '-ba', file_path]
+    cmd.append(f'-p{password or ""}')
+    process = await spawn(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        LOGGER.error(f"7z listing failed: {stderr.decode()}")
+        return []
+    
+    # -slt prints one "Key = Value" block per entry
+    entries = []
+    for block in stdout.decode(errors='ignore').split('\n\n'):
+        fields = {}
+        for line in block.splitlines():
+            if ' = ' in line:
+                key, value = line.split(' = ', 1)
+                fields[key.strip()] = value.strip()
+        if 'Path' not in fields:
+            continue
+        entries.append({
+            'name': fields['Path'],
+            'size': int(fields.get('Size') or 0),
+            'is_dir': fields.get('Folder') == '+' or 'D' in fields.get('Attributes', '')[:1],
+        })
+    return entries
+
+
+async def _extract_entry_7z(file_path: str, name: str, output_dir: str, password: str = None) -> bool:
+    """Extract a single entry with 7z"""
+    cmd = ['7z', 'x', file_path, f'-o{output_dir}', '-y', f'-p{password or ""}', '--', name]
+    process = await spawn(
+        *cmd,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        LOGGER.error(f"7z failed to extract {name}: {stderr.decode()}")
+        return False
+    return True
+
+
+def _extract_entry_zip(file_path: str, name: str, output_dir: str) -> bool:
+    """Extract a single zip entry (own handle per thread)"""
+    import zipfile
+    with zipfile.ZipFile(file_path) as zf:
+        zf.extract(name, output_dir)
+    return True
+
+
+async def iter_extract(
+    file_path: str,
+    output_dir: str,
+    password: str = None,
+    concurrency: int = 2
+):
+    """
+    Extract an archive entry by entry, yielding each file path as soon as it lands.
+    
+    Video entries are extracted first, individually and with bounded
+    parallelism, so consumers can start on the first episode while later
+    ones are still decompressing. An entry keeps its extraction slot until
+    the bounded queue accepts it, so at most concurrency files wait in the
+    queue and concurrency more wait for it; extraction pauses while the
+    consumer is busy instead of filling the disk.
+    """
+    import tarfile
+    import zipfile
+    from bot.utils.helpers import is_video_file
+    
+    os.makedirs(output_dir, exist_ok=True)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    stopped = threading.Event()
+    done = object()
+    
+    async def produce_tar():
+        # Tar is sequential anyway, stream members out in archive order
+        loop = asyncio.get_running_loop()
+        
+        def _extract():
+            with tarfile.open(file_path) as tf:
+                for member in tf:
+                    if stopped.is_set():
+                        break
+                    if not member.isfile():
+                        continue
+                    target = _safe_target(output_dir, member.name)
+                    if not target:
+                        continue
+                    tf.extract(member, output_dir)
+                    asyncio.run_coroutine_threadsafe(queue.put(target), loop).result()
+        
+        await asyncio.to_thread(_extract)
+    
+    async def produce_entries():
+        entries = await list_archive(file_path, password)
+        files = [
+            e['name'] for e in entries
+            if not e['is_dir'] and _safe_target(output_dir, e['name'])
+        ]
+        if not files:
+            # Unknown format or listing failed: fall back to a full extract
+            if not await extract_archive(file_path, output_dir, password):
+                raise RuntimeError("Extraction failed")
+            for root, _, names in os.walk(output_dir):
+                for n in sorted(names):
+                    await queue.put(os.path.join(root, n))
+            return
+        
+        videos = sorted(f for f in files if is_video_file(f))
+        others = sorted(f for f in files if not is_video_file(f))
+        use_zipfile = zipfile.is_zipfile(file_path) and not password
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def extract_one(name: str):
+            # The slot is held until the queue takes the file, so a busy
+            # consumer stops further extraction rather than just delaying it
+            async with semaphore:
+                if use_zipfile:
+                    ok = await asyncio.to_thread(_extract_entry_zip, file_path, name, output_dir)
+                else:
+                    ok = await _extract_entry_7z(file_path, name, output_dir, password)
+                target = _safe_target(output_dir, name)
+                if ok and os.path.exists(target):
+                    await queue.put(target)
+        
+        # Start in name order so episode 1 lands first
+        await asyncio.gather(*(extract_one(v) for v in videos))
+        
+        if others:
+            if use_zipfile:
+                await asyncio.gather(*(extract_one(o) for o in others))
+            else:
+                # One 7z call for the small stuff beats one per entry
+                cmd = ['7z', 'x', file_path, f'-o{output_dir}', '-y', f'-p{password or ""}', '--', *others]
+                process = await spawn(
+                    *cmd,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL
+                )
+                await process.wait()
+                for name in others:
+                    target = _safe_target(output_dir, name)
+                    if os.path.exists(target):
+                        await queue.put(target)
+    
+    async def producer():
+        try:
+            if tarfile.is_tarfile(file_path):
+                await produce_tar()
+            else:
+                await produce_entries()
+            await queue.put(done)
+        except Exception as e:
+            await queue.put(e)
+    
+    task = asyncio.create_task(producer())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Consumer stopped early: stop producers and unblock any pending put
+        stopped.set()
+        task.cancel()
+        while not queue.empty():
+            queue.get_nowait()
+        # Its entry tasks terminate their 7z processes as they end
+        await asyncio.gather(task, return_exceptions=True)
+
+
+# Entries worth deflating; media is already compressed and is stored as-is
+DEFLATE_EXTENSIONS = {
+    '.srt', '.ass', '.ssa', '.vtt', '.sub', '.idx', '.txt', '.json',
+    '.xml', '.nfo', '.log', '.csv', '.html', '.md'
+}
+
+
+def _zip_entries(sources: list) -> list:
+    """Expand files/directories into (path, arcname) pairs"""
+    entries = []
+    for source in sources:
+        if os.path.isdir(source):
+            root_name = os.path.basename(os.path.normpath(source))
+            for root, _, files in os.walk(source):
+                for f in sorted(files):
+                    path = os.path.join(root, f)
+                    entries.append((path, os.path.join(root_name, os.path.relpath(path, source))))
+        elif os.path.exists(source):
+            entries.append((source, os.path.basename(source)))
+    return entries
+
+
+def _write_zip(entries: list, output_path: str, remove_sources: bool):
+    """Write a zip entry by entry (runs in a worker thread)"""
+    import zipfile
+    
+    with zipfile.ZipFile(output_path, 'w', allowZip64=True) as zf:
+        for path, arcname in entries:
+            ext = os.path.splitext(path)[1].lower()
+            compress_type = zipfile.ZIP_DEFLATED if ext in DEFLATE_EXTENSIONS else zipfile.ZIP_STORED
+            zf.write(path, arcname, compress_type=compress_type)
+            if remove_sources:
+                # Free each source as soon as it's in the archive so disk use never doubles
+                os.remove(path)
+
+
+async def stream_zip(sources: str | list, output_path: str, remove_sources: bool = False) -> str:
+    """
+    Zip files/directories without blocking the event loop.
+    
+    Media entries are stored, text and subtitle entries are deflated.
+    With remove_sources each source file is deleted once it is written.
+    """
+    if isinstance(sources, str):
+        sources = [sources]
+    
+    entries = _zip_entries(sources)
+    if not entries:
+        raise FileNotFoundError("Nothing to archive")
+    
+    await asyncio.to_thread(_write_zip, entries, output_path, remove_sources)
+    
+    if remove_sources:
+        for source in sources:
+            if os.path.isdir(source):
+                shutil.rmtree(source, ignore_errors=True)
+    
+    return output_path
+
+
+async def create_archive(input_path: str, output_path: str, type: str = "zip", password: str = None, remove_sources: bool = False) -> str:
     """
     Create archive from input_path
     type: zip, tar, 7z
@@ -65,8 +343,10 @@ async def create_archive(input_path: str, output_path: str, type: str = "zip", p
             if password:
                 cmd.append(f'-p{password}')
                 cmd.append('-mhe=on') # Encrypt headers too
+            if remove_sources:
+                cmd.append('-sdel')
                 
-            process = await asyncio.create_subprocess_exec(
+            process = await spawn(
                 *cmd,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE
@@ -75,13 +355,26 @@ async def create_archive(input_path: str, output_path: str, type: str = "zip", p
             
             if process.returncode == 0:
                 return output_path
-                
-        # Shutil fallback
+        
+        if type in ('zip', '7z'):
+            # 7z fallback is a plain zip as well
+            if not output_path.endswith('.zip'):
+                output_path = os.path.splitext(output_path)[0] + '.zip'
+            return await stream_zip(input_path, output_path, remove_sources)
+        
+        # Shutil for tar variants: tar, gztar, bztar, xztar
         base_name = os.path.splitext(output_path)[0]
-        # shutil types: zip, tar, gztar, bztar, xztar
-        if type == '7z': type = 'zip' # Fallback
+        if os.path.isdir(input_path):
+            root_dir, base_dir = input_path, '.'
+        else:
+            root_dir, base_dir = os.path.dirname(input_path), os.path.basename(input_path)
         
-        created_path = shutil.make_archive(base_name, type, input_path)
+        created_path = await asyncio.to_thread(shutil.make_archive, base_name, type, root_dir, base_dir)
+        if remove_sources:
+            if os.path.isdir(input_path):
+                shutil.rmtree(input_path, ignore_errors=True)
+            else:
+                os.remove(input_path)
         return created_path
         
     except Exception as e:
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Download bandwidth budget and per-host connection limits shared by all downloaders"""
+
+import asyncio
+import logging
+import threading
+from time import monotonic, sleep
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+LOGGER = logging.getLogger(__name__)
+
+
+class BandwidthBudget:
+    """
+    Aggregate download rate shared by every transfer.
+
+    A leaky bucket: each chunk books its share of the line and waits until
+    its slot comes up. Thread-safe, so yt-dlp worker threads and asyncio
+    downloads draw from the same budget. rate <= 0 means unlimited.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._next = monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int) -> float:
+        """Book nbytes, returning the seconds to wait before using them"""
+        if self.rate <= 0 or nbytes <= 0:
+            return 0.0
+        with self._lock:
+            now = monotonic()
+            start = max(self._next, now)
+            self._next = start + nbytes / self.rate
+            return start - now
+
+    async def throttle(self, nbytes: int):
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def throttle_sync(self, nbytes: int):
+        """Blocking variant for worker threads"""
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            sleep(delay)
+
+
+class HostLimiter:
+    """Cap on open connections per remote host across all downloads"""
+
+    def __init__(self, per_host: int):
+        self.per_host = max(1, per_host)
+        self._in_use = {}
+        self._changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def connections(self, url: str, wanted: int = 1):
+        """Hold up to wanted connections to url's host, yielding how many were granted"""
+        host = (urlparse(url).hostname or '').lower()
+        count = max(1, min(wanted, self.per_host))
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._in_use.get(host, 0) + count <= self.per_host)
+            self._in_use[host] = self._in_use.get(host, 0) + count
+        try:
+            yield count
+        finally:
+            async with self._changed:
+                self._in_use[host] -= count
+                if self._in_use[host] <= 0:
+                    del self._in_use[host]
+                self._changed.notify_all()
+
+
+bandwidth: BandwidthBudget = None
+host_limiter: HostLimiter = None
+
+
+def get_bandwidth() -> BandwidthBudget:
+    """Get the shared download bandwidth budget"""
+    global bandwidth
+    if bandwidth is None:
+        from bot import DOWNLOAD_SPEED_LIMIT
+        bandwidth = BandwidthBudget(DOWNLOAD_SPEED_LIMIT * 1024 * 1024)
+    return bandwidth
+
+
+def get_host_limiter() -> HostLimiter:
+    """Get the shared per-host connection limiter"""
+    global host_limiter
+    if host_limiter is None:
+        from bot import MAX_CONNECTIONS_PER_HOST
+        host_limiter = HostLimiter(MAX_CONNECTIONS_PER_HOST)
+    return host_limiter
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Rate-limited, resumable broadcast to every bot user"""
+
+import asyncio
+import logging
+from collections import deque
+from time import time, monotonic
+
+from bot.utils.db_handler import get_db
+from bot.utils.helpers import get_readable_time
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds between status edits
+REPORT_INTERVAL = 5
+# A checkpoint is saved after this many finished sends or this many seconds
+# with finished sends, whichever comes first
+CHECKPOINT_EVERY = 50
+CHECKPOINT_INTERVAL = 5
+# Attempts per user when Telegram keeps answering with FloodWait
+MAX_FLOOD_RETRIES = 3
+
+
+class TokenBucket:
+    """Allow rate sends per second with bursts of up to capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait for a send slot"""
+        async with self._lock:
+            while True:
+                now = monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stop all sends for a while (FloodWait applies to the whole bot)"""
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+        self.tokens = 0
+
+
+class Broadcast:
+    """
+    Copy one message to every user in the database.
+
+    User IDs stream from the database in ascending order while up to
+    BROADCAST_CONCURRENCY copies are in flight under a token bucket. The
+    checkpoint is the highest ID below which every user has been handled,
+    plus the few IDs past it that finished early. A stopped broadcast saves
+    it last and resumes without sending anyone the message twice; after a
+    crash, only the sends since the last checkpoint (at most CHECKPOINT_EVERY
+    users or CHECKPOINT_INTERVAL seconds of them) are repeated.
+    """
+
+    def __init__(self, client, from_chat_id: int, message_id: int, status_msg, state: dict = None):
+        from bot import BROADCAST_RATE
+
+        state = state or {}
+        self.client = client
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+        self.status_msg = status_msg
+        self.last_id = state.get('last_id')
+        self.ahead = set(state.get('ahead', []))
+        self.dispatched = deque()  # [user_id, finished] in ID order
+        self.sent = state.get('sent', 0)
+        self.failed = state.get('failed', 0)
+        self.blocked = state.get('blocked', 0)
+        self.bucket = TokenBucket(BROADCAST_RATE)
+        self.started = time()
+        self.session_done = 0
+        self.unsaved = 0
+        self.saved_at = monotonic()
+        self._saving = asyncio.Lock()
+        self.task = None
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    def state(self) -> dict:
+        return {
+            'from_chat_id': self.from_chat_id,
+            'message_id': self.message_id,
+            'last_id': self.last_id,
+            'ahead': [user_id for user_id, finished in self.dispatched if finished] + list(self.ahead),
+            'sent': self.sent,
+            'failed': self.failed,
+            'blocked': self.blocked,
+        }
+
+    async def _checkpoint(self):
+        """Save the state once enough sends finished since the last save"""
+        due = self.unsaved >= CHECKPOINT_EVERY or monotonic() - self.saved_at >= CHECKPOINT_INTERVAL
+        if not self.unsaved or not due or self._saving.locked():
+            return
+        async with self._saving:
+            self.unsaved = 0
+            self.saved_at = monotonic()
+            try:
+                await get_db().set_broadcast_state(self.state())
+            except Exception as e:
+                LOGGER.debug(f"Broadcast checkpoint error: {e}")
+
+    async def _deliver(self, user_id: int) -> str:
+        """Copy the message to one user; returns 'sent', 'blocked' or 'failed'"""
+        from pyrogram.errors import FloodWait, UserIsBlocked, InputUserDeactivated, UserDeactivated, PeerIdInvalid
+
+        for _ in range(MAX_FLOOD_RETRIES):
+            await self.bucket.acquire()
+            try:
+                await self.client.copy_message(user_id, self.from_chat_id, self.message_id)
+                return 'sent'
+            except FloodWait as e:
+                LOGGER.warning(f"Broadcast FloodWait: sleeping {e.value}s")
+                self.bucket.pause(e.value + 1)
+            except (UserIsBlocked, InputUserDeactivated, UserDeactivated, PeerIdInvalid):
+                return 'blocked'
+            except Exception as e:
+                LOGGER.debug(f"Broadcast to {user_id} failed: {e}")
+                return 'failed'
+        return 'failed'
+
+    async def run(self) -> bool:
+        """Deliver to every remaining user; returns False if cancelled"""
+        from bot import BROADCAST_CONCURRENCY
+
+        db = get_db()
+        total = await db.get_user_count()
+        slots = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        dispatched = self.dispatched
+        tasks = set()
+
+        async def send(entry: list):
+            try:
+                result = await self._deliver(entry[0])
+            finally:
+                slots.release()
+            setattr(self, result, getattr(self, result) + 1)
+            self.session_done += 1
+            # Cancelled sends never get here, so resuming retries them
+            entry[1] = True
+            while dispatched and dispatched[0][1]:
+                self.last_id = dispatched.popleft()[0]
+            self.unsaved += 1
+            await self._checkpoint()
+
+        # Saved up front so a crash before the first checkpoint can resume
+        await db.set_broadcast_state(self.state())
+        reporter = asyncio.create_task(self._report_loop(total))
+        try:
+            async for user_id in db.iter_user_ids(after=self.last_id):
+                if user_id in self.ahead:
+                    # Already delivered before the last stop
+                    self.ahead.discard(user_id)
+                    continue
+                await slots.acquire()
+                entry = [user_id, False]
+                dispatched.append(entry)
+                task = asyncio.create_task(send(entry))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await db.set_broadcast_state(self.state())
+            await self._report(total, "⏹ <b>Broadcast Stopped</b>\nResume with /broadcast resume")
+            return False
+        except Exception:
+            await db.set_broadcast_state(self.state())
+            raise
+        finally:
+            reporter.cancel()
+
+        await db.clear_broadcast_state()
+        await self._report(total, "<b>📢 Broadcast Complete!</b>", final=True)
+        return True
+
+    async def _report_loop(self, total: int):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            try:
+                await self._report(total, "<b>📢 Broadcasting...</b>")
+            except Exception as e:
+                LOGGER.debug(f"Broadcast report error: {e}")
+
+    async def _report(self, total: int, title: str, final: bool = False):
+        from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+        from bot import OWNER_ID
+
+        elapsed = max(time() - self.started, 1e-6)
+        rate = self.session_done / elapsed
+        remaining = max(total - self.done, 0)
+        text = (
+            f"{title}\n\n"
+            f"✅ Sent: {self.sent}\n"
+            f"🚫 Blocked/Deleted: {self.blocked}\n"
+            f"❌ Failed: {self.failed}\n"
+            f"📊 Progress: {self.done}/{total}\n"
+            f"⚡ Speed: {rate:.1f} msg/s"
+        )
+        if not final and rate > 0:
+            text += f"\n⏳ ETA: {get_readable_time(int(remaining / rate))}"
+        else:
+            text += f"\n⏱ Time: {get_readable_time(int(elapsed))}"
+
+        keyboard = None if final else InlineKeyboardMarkup([[
+            InlineKeyboardButton("Stop", callback_data=f"bccancel_{OWNER_ID}")
+        ]])
+        try:
+            await self.status_msg.edit_text(text, reply_markup=keyboard)
+        except Exception as e:
+            LOGGER.debug(f"Broadcast status update error: {e}")
+
+
+# Running broadcast (one at a time)
+active_broadcast: Broadcast = None
+
+
+async def start_broadcast(client, from_chat_id: int, message_id: int, status_msg, state: dict = None) -> bool:
+    """Run a broadcast as the active one; returns False if it was stopped"""
+    global active_broadcast
+    broadcast = Broadcast(client, from_chat_id, message_id, status_msg, state)
+    # Own task, so stopping it never cancels the handler that started it
+    broadcast.task = asyncio.create_task(broadcast.run())
+    active_broadcast = broadcast
+    try:
+        await asyncio.wait({broadcast.task})
+    finally:
+        active_broadcast = None
+    if broadcast.task.cancelled():
+        return False
+    return broadcast.task.result()
+
+
+def stop_broadcast() -> bool:
+    """Stop the running broadcast, keeping its checkpoint"""
+    if active_broadcast is None or active_broadcast.task.done():
+        return False
+    active_broadcast.task.cancel()
+    return True
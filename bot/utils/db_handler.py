@@ -12,6 +12,7 @@ class Database:
         self._db = self._client[database_name]
         self._users = self._db.users
         self._settings = self._db.settings
+        self._job_stats = self._db.job_stats
         
     async def connect(self):
         """Test the database connection"""
@@ -62,6 +63,13 @@ class Database:
             users.append(user)
         return users
     
+    async def iter_user_ids(self, after: int = None, batch_size: int = 500):
+        """Yield user IDs in ascending order from a projection-only cursor (resumable via after)"""
+        query = {"_id": {"$gt": after}} if after is not None else {}
+        cursor = self._users.find(query, {"_id": 1}).sort("_id", 1).batch_size(batch_size)
+        async for user in cursor:
+            yield user["_id"]
+    
     async def get_user_count(self) -> int:
         """Get total user count"""
         return await self._users.count_documents({})
@@ -285,6 +293,38 @@ class Database:
             upsert=True
         )
 
+    # ─────────────────────────────────────────────────────────────
+    # Broadcast Checkpoint
+    # ─────────────────────────────────────────────────────────────
+    async def get_broadcast_state(self) -> dict:
+        """Get the checkpoint of an unfinished broadcast, if any."""
+        doc = await self._settings.find_one({"_id": "broadcast_state"})
+        return doc.get("value") if doc else None
+
+    async def set_broadcast_state(self, state: dict):
+        """Save broadcast progress so it can be resumed."""
+        await self._settings.update_one(
+            {"_id": "broadcast_state"},
+            {"$set": {"value": state}},
+            upsert=True
+        )
+
+    async def clear_broadcast_state(self):
+        """Forget a finished or discarded broadcast."""
+        await self._settings.delete_one({"_id": "broadcast_state"})
+
+    # ─────────────────────────────────────────────────────────────
+    # Job Statistics (throughput model history)
+    # ─────────────────────────────────────────────────────────────
+    async def add_job_stat(self, stat: dict):
+        """Store the features and timing of a finished job."""
+        await self._job_stats.insert_one(dict(stat))
+
+    async def get_job_stats(self, host: str, limit: int = 2000) -> list:
+        """Get the most recent job statistics of a host, newest first."""
+        cursor = self._job_stats.find({"host": host}, {"_id": 0}).sort("time", -1).limit(limit)
+        return [stat async for stat in cursor]
+
     # ─────────────────────────────────────────────────────────────
     # Authorized Groups Management
     # ─────────────────────────────────────────────────────────────
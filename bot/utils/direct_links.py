@@ -5,11 +5,15 @@ from base64 import standard_b64encode
 from random import choice
 from typing import Optional
 
-import cloudscraper
-import requests
-from bs4 import BeautifulSoup
 import logging
 
+from bot.utils.lazy import lazy_import
+
+# Scraping libraries are only needed once a direct link is resolved
+cloudscraper = lazy_import('cloudscraper')
+requests = lazy_import('requests')
+bs4 = lazy_import('bs4')
+
 LOGGER = logging.getLogger(__name__)
 
 class DirectDownloadLinkException(Exception):
@@ -64,7 +68,7 @@ def mediafire(url: str) -> str:
         text_url = re.findall(r'\bhttps?://.*mediafire\.com\S+', url)[0]
     except IndexError:
         return None
-    page = BeautifulSoup(requests.get(text_url).content, 'lxml')
+    page = bs4.BeautifulSoup(requests.get(text_url).content, 'lxml')
     info = page.find('a', {'aria-label': 'Download file'})
     return info.get('href')
 
@@ -74,7 +78,7 @@ def osdn(url: str) -> str:
         text_url = re.findall(r'\bhttps?://.*osdn\.net\S+', url)[0]
     except IndexError:
         return None
-    page = BeautifulSoup(requests.get(text_url, allow_redirects=True).content, 'lxml')
+    page = bs4.BeautifulSoup(requests.get(text_url, allow_redirects=True).content, 'lxml')
     info = page.find('a', {'class': 'mirror_link'})
     text_url = urllib.parse.unquote(osdn_link + info['href'])
     mirrors = page.find('form', {'id': 'mirror-select-form'}).findAll('tr')
@@ -122,7 +126,7 @@ def fichier(link: str) -> str:
     # Very basic scraping attempt
     try:
         req = requests.post(link)
-        soup = BeautifulSoup(req.content, 'lxml')
+        soup = bs4.BeautifulSoup(req.content, 'lxml')
         if soup.find("a", {"class": "ok btn-general btn-orange"}) is not None:
              return soup.find("a", {"class": "ok btn-general btn-orange"})["href"]
     except: pass
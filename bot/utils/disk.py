@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""Disk space admission control and orphaned file cleanup"""
+
+import os
+import shutil
+import asyncio
+import itertools
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict
+
+from bot.utils.helpers import clean_temp_files, is_protected_path, get_readable_file_size
+
+LOGGER = logging.getLogger(__name__)
+
+# Expected output size relative to the input size, per operation
+OUTPUT_SIZE_FACTORS = {
+    'extract_audio': 0.2,
+    'extract_subs': 0.01,
+    'extract_streams': 1.0,
+    'extract_thumb': 0.01,
+    'extract_screenshots': 0.05,
+    'generate_sample': 0.1,
+    'rename': 0.0,
+    'merge_video': 2.0,
+    'multi_merge': 2.0,
+}
+DEFAULT_OUTPUT_FACTOR = 1.1  # re-encodes can come out slightly larger than the source
+
+# Reservation held by the job running in the current task context
+_current_reservation: ContextVar = ContextVar('disk_reservation', default=None)
+
+
+class InsufficientDiskSpace(Exception):
+    pass
+
+
+def estimate_output_size(operation: str, input_size: int, info: dict = None, options: dict = None) -> int:
+    """Estimate the output size of an operation from the input size and probe info"""
+    options = options or {}
+    duration = float((info or {}).get('duration') or 0)
+
+    if duration > 0:
+        if operation == 'generate_sample':
+            sample = float(options.get('duration', 30))
+            return int(input_size * min(1.0, sample / duration))
+        if operation == 'extract_audio':
+            # Upper bound: 320 kbps for lossy formats
+            return int(duration * 320_000 / 8)
+        if operation == 'speed':
+            speed = float(options.get('speed', 1.0)) or 1.0
+            return int(input_size * max(1.0, 1 / speed))
+
+    return int(input_size * OUTPUT_SIZE_FACTORS.get(operation, DEFAULT_OUTPUT_FACTOR))
+
+
+class DiskManager:
+    """Tracks reserved disk space and admits jobs only when their footprint fits"""
+
+    def __init__(self, paths: list, margin_bytes: int = 0):
+        self.paths = paths
+        self.margin_bytes = margin_bytes
+        self._reservations: Dict[int, int] = {}
+        self._owners: Dict[int, int] = {}
+        self._counter = itertools.count(1)
+        self._changed = asyncio.Event()
+
+    def free_bytes(self) -> int:
+        """Free bytes on the fullest filesystem backing the work directories"""
+        free = []
+        for path in self.paths:
+            try:
+                free.append(shutil.disk_usage(path).free)
+            except OSError:
+                pass
+        return min(free) if free else 0
+
+    @property
+    def reserved_bytes(self) -> int:
+        return sum(self._reservations.values())
+
+    def available_bytes(self) -> int:
+        """Free bytes not yet promised to a running job"""
+        return self.free_bytes() - self.reserved_bytes - self.margin_bytes
+
+    def fits(self, nbytes: int) -> bool:
+        return nbytes <= self.available_bytes()
+
+    @property
+    def active_owners(self) -> set:
+        return set(o for o in self._owners.values() if o is not None)
+
+    async def reserve(
+        self,
+        nbytes: int,
+        owner: int = None,
+        on_wait: Callable = None,
+        timeout: float = None
+    ) -> int:
+        """
+        Reserve nbytes of disk space, waiting until it is available.
+
+        The reservation is bound to the current task context so nested
+        downloads inside the same job do not reserve twice.
+
+        Returns:
+            Reservation token for adjust()/release()
+        """
+        nbytes = max(0, int(nbytes))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+        notified = False
+
+        while not self.fits(nbytes):
+            if not self._reservations:
+                # Nobody is going to release space for us, reclaim orphans instead
+                await reclaim_space(nbytes - self.available_bytes())
+                if self.fits(nbytes):
+                    break
+                raise InsufficientDiskSpace(
+                    f"Not enough disk space: need {get_readable_file_size(nbytes)}, "
+                    f"{get_readable_file_size(max(0, self.available_bytes()))} available"
+                )
+
+            if deadline and loop.time() > deadline:
+                raise InsufficientDiskSpace("Timed out waiting for free disk space")
+
+            if on_wait and not notified:
+                notified = True
+                try:
+                    await on_wait()
+                except Exception:
+                    pass
+
+            # Disk usage also changes outside our control, so poll as well
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                pass
+
+        # No await between the check above and this insert, so admission is atomic
+        token = next(self._counter)
+        self._reservations[token] = nbytes
+        self._owners[token] = owner
+        _current_reservation.set(token)
+        LOGGER.info(f"Reserved {get_readable_file_size(nbytes)} of disk (token {token}, owner {owner})")
+        return token
+
+    def adjust(self, token: int, nbytes: int):
+        """Change the outstanding size of a reservation (e.g. once the input is on disk)"""
+        if token not in self._reservations:
+            return
+        old = self._reservations[token]
+        self._reservations[token] = max(0, int(nbytes))
+        if nbytes < old:
+            self._changed.set()
+
+    def release(self, token: int):
+        """Release a reservation"""
+        if token is None:
+            return
+        self._reservations.pop(token, None)
+        self._owners.pop(token, None)
+        if _current_reservation.get() == token:
+            _current_reservation.set(None)
+        self._changed.set()
+
+    @asynccontextmanager
+    async def admit(self, nbytes: int, owner: int = None, on_wait: Callable = None):
+        """Hold a reservation for the duration of the block (no-op inside an admitted job)"""
+        current = _current_reservation.get()
+        if current is not None and current in self._reservations:
+            yield current
+            return
+
+        token = await self.reserve(nbytes, owner=owner, on_wait=on_wait)
+        try:
+            yield token
+        finally:
+            self.release(token)
+
+    def protected_paths(self) -> set:
+        """Paths that belong to live sessions or running jobs and must not be cleaned"""
+        from bot import user_data, DOWNLOAD_DIR, OUTPUT_DIR
+
+        paths = set()
+        for uid, data in user_data.items():
+            for key in ('file_path', 'processing_file', 'output_path', 'zip_path'):
+                value = data.get(key)
+                if isinstance(value, list):
+                    paths.update(v for v in value if v)
+                elif value:
+                    paths.add(value)
+
+        for uid in self.active_owners:
+            paths.add(os.path.join(DOWNLOAD_DIR, str(uid)))
+            paths.add(os.path.join(OUTPUT_DIR, str(uid)))
+
+        # Cached inputs are evicted by the cache itself, after orphans
+        from bot.utils.input_cache import get_input_cache
+        paths.update(get_input_cache().paths())
+
+        return paths
+
+
+def _list_orphans(directories: list, protected: set) -> list:
+    """List (last_used, size, path) for unprotected files, least recently used first"""
+    files = []
+    for directory in directories:
+        for root, dirs, names in os.walk(directory):
+            if is_protected_path(root, protected):
+                dirs[:] = []
+                continue
+            for name in names:
+                path = os.path.join(root, name)
+                if is_protected_path(path, protected):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+    files.sort()
+    return files
+
+
+def _remove_empty_dirs(directory: str, protected: set):
+    """Remove empty sub-directories left behind by finished jobs"""
+    for root, dirs, names in os.walk(directory, topdown=False):
+        if os.path.abspath(root) == os.path.abspath(directory):
+            continue
+        if is_protected_path(root, protected):
+            continue
+        try:
+            if not os.listdir(root):
+                os.rmdir(root)
+        except OSError:
+            pass
+
+
+async def reclaim_space(needed_bytes: int) -> int:
+    """Delete orphaned files, least recently used first, until needed_bytes are freed"""
+    from bot import DOWNLOAD_DIR, OUTPUT_DIR
+
+    if needed_bytes <= 0:
+        return 0
+
+    protected = get_disk_manager().protected_paths()
+    orphans = await asyncio.to_thread(_list_orphans, [DOWNLOAD_DIR, OUTPUT_DIR], protected)
+
+    freed = 0
+    for _, size, path in orphans:
+        if freed >= needed_bytes:
+            break
+        try:
+            os.remove(path)
+            freed += size
+            LOGGER.info(f"Reclaimed orphaned file: {path}")
+        except OSError as e:
+            LOGGER.error(f"Error reclaiming {path}: {e}")
+
+    if freed < needed_bytes:
+        # Still short, give up inputs kept for follow-up operations
+        from bot.utils.input_cache import get_input_cache
+        freed += get_input_cache().reclaim(needed_bytes - freed)
+
+    for directory in (DOWNLOAD_DIR, OUTPUT_DIR):
+        _remove_empty_dirs(directory, protected)
+
+    if freed:
+        LOGGER.info(f"Reclaimed {get_readable_file_size(freed)} of disk space")
+    return freed
+
+
+async def janitor_loop():
+    """Periodically remove stale orphaned files and keep free-space headroom"""
+    from bot import DOWNLOAD_DIR, OUTPUT_DIR, JANITOR_INTERVAL, JANITOR_MAX_AGE_HOURS
+
+    while True:
+        try:
+            disk = get_disk_manager()
+            protected = disk.protected_paths()
+
+            from bot.utils.input_cache import get_input_cache
+            freed = get_input_cache().evict_expired()
+            for directory in (DOWNLOAD_DIR, OUTPUT_DIR):
+                freed += await clean_temp_files(directory, JANITOR_MAX_AGE_HOURS, protected)
+                _remove_empty_dirs(directory, protected)
+
+            # Restore the safety margin so new jobs are not delayed
+            shortfall = disk.margin_bytes - disk.available_bytes()
+            if shortfall > 0:
+                freed += await reclaim_space(shortfall)
+
+            if freed:
+                LOGGER.info(f"Janitor freed {get_readable_file_size(freed)}")
+        except Exception as e:
+            LOGGER.error(f"Janitor error: {e}")
+
+        await asyncio.sleep(JANITOR_INTERVAL)
+
+
+# Global instance
+disk_manager: DiskManager = None
+
+
+def get_disk_manager() -> DiskManager:
+    """Get the global disk manager instance"""
+    global disk_manager
+    if disk_manager is None:
+        from bot import DOWNLOAD_DIR, OUTPUT_DIR, DISK_RESERVE_MB
+        disk_manager = DiskManager([DOWNLOAD_DIR, OUTPUT_DIR], DISK_RESERVE_MB * 1024 * 1024)
+    return disk_manager
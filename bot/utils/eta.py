@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""Per-host throughput model learned from finished jobs, for ETAs before they start"""
+
+import os
+import socket
+import logging
+from time import time, gmtime, strftime
+from typing import List, Optional, Tuple
+
+from bot.utils.helpers import get_readable_time
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds of media processed per wall second when there is no history yet
+# (libx264 medium at 1080p for encodes)
+DEFAULT_SPEEDS = {
+    'encode': 1.0, 'compress': 0.5, 'text_watermark': 1.5, 'watermark': 1.5,
+    'hardsub': 1.2, 'sub_intro': 1.5, 'speed': 1.5, 'rotate': 1.5, 'ffmpeg_cmd': 1.0,
+    'convert': 20.0, 'remove_audio': 50.0, 'extract_audio': 30.0, 'extract_video': 50.0,
+    'extract_subs': 100.0, 'extract_streams': 50.0, 'extract_thumb': 200.0,
+    'extract_screenshots': 100.0, 'generate_sample': 200.0, 'metadata': 100.0,
+    'trim': 100.0, 'streamswap': 100.0, 'multi_merge': 20.0, 'merge_video': 20.0,
+}
+DEFAULT_SPEED = 2.0
+
+# Relative encode speed of x264/x265 presets and codecs, used until history exists
+PRESET_FACTORS = {
+    'ultrafast': 6.0, 'superfast': 4.5, 'veryfast': 3.0, 'faster': 2.0, 'fast': 1.5,
+    'medium': 1.0, 'slow': 0.5, 'slower': 0.25, 'veryslow': 0.1, 'placebo': 0.03,
+}
+CODEC_FACTORS = {'libx264': 1.0, 'libx265': 0.35, 'libvpx-vp9': 0.3, 'libaom-av1': 0.1, 'copy': 20.0}
+
+# Weight of the newest run in a key's running ratio, and runs needed before a key is trusted
+SMOOTHING = 0.3
+MIN_RUNS = 2
+HISTORY_LOAD_LIMIT = 2000
+
+# Used for the media length of files whose duration isn't known yet (~8 Mbps)
+ASSUMED_BYTES_PER_SECOND = 1024 * 1024
+
+
+def host_id() -> str:
+    """Speeds only carry over between runs on the same machine"""
+    return f"{socket.gethostname()}/{os.cpu_count() or 1}"
+
+
+def job_features(operation: str, options: dict = None) -> dict:
+    """Features of a job that change how fast it runs"""
+    from bot.ffmpeg.settings import EncodeSettings, InvalidSettings
+
+    options = options or {}
+    features = {'operation': operation, 'codec': None, 'preset': None, 'height': None}
+    if operation == 'encode':
+        try:
+            settings = EncodeSettings.from_dict(options)
+        except InvalidSettings:
+            return features
+        features['codec'] = settings.video_codec
+        features['preset'] = settings.preset
+        features['height'] = settings.resolution[1] if settings.resolution else None
+    return features
+
+
+def media_seconds(duration: float = None, file_size: int = 0) -> float:
+    """Media length of a job, estimated from its size when the duration is unknown"""
+    if duration:
+        return float(duration)
+    return (file_size or 0) / ASSUMED_BYTES_PER_SECOND
+
+
+class ThroughputModel:
+    """
+    Learned speed (media seconds per wall second) per feature set.
+
+    Each key keeps a smoothed ratio of measured speed to the built-in
+    prior, so history for one preset also corrects the estimate of others.
+    A prediction uses the most specific key with enough runs behind it:
+    operation+codec+preset+height, then operation+codec+preset, then the
+    operation alone, and finally the prior itself.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.ratios = {}  # key -> [speed / prior, runs]
+
+    @staticmethod
+    def _keys(features: dict) -> List[tuple]:
+        op = features['operation']
+        return [
+            (op, features['codec'], features['preset'], features['height']),
+            (op, features['codec'], features['preset']),
+            (op,),
+        ]
+
+    @staticmethod
+    def prior(features: dict) -> float:
+        """Speed assumed before any history"""
+        speed = DEFAULT_SPEEDS.get(features['operation'], DEFAULT_SPEED)
+        if features['operation'] == 'encode':
+            speed *= PRESET_FACTORS.get(features['preset'], 1.0) * CODEC_FACTORS.get(features['codec'], 1.0)
+            if features['height']:
+                speed *= (1080 / features['height']) ** 2
+        # Defaults assume a 4 core host
+        return speed * (os.cpu_count() or 1) / 4
+
+    def _learn(self, features: dict, speed: float):
+        ratio = speed / self.prior(features)
+        for key in self._keys(features):
+            entry = self.ratios.get(key)
+            if entry is None:
+                self.ratios[key] = [ratio, 1]
+            else:
+                entry[0] += SMOOTHING * (ratio - entry[0])
+                entry[1] += 1
+
+    def speed(self, features: dict) -> float:
+        for key in self._keys(features):
+            entry = self.ratios.get(key)
+            if entry and entry[1] >= MIN_RUNS:
+                return self.prior(features) * entry[0]
+        return self.prior(features)
+
+    def predict(self, operation: str, options: dict = None, duration: float = None, file_size: int = 0) -> float:
+        """Expected FFmpeg wall seconds for a job"""
+        return media_seconds(duration, file_size) / max(self.speed(job_features(operation, options)), 1e-3)
+
+    async def record(self, operation: str, options: dict, duration: float, wall: float):
+        """Learn from a finished run and keep it for the next start"""
+        if not duration or wall <= 0:
+            return
+        features = job_features(operation, options)
+        self._learn(features, duration / wall)
+
+        from bot.utils.db_handler import get_db
+        db = get_db()
+        if db:
+            try:
+                await db.add_job_stat({
+                    **features,
+                    'host': self.host,
+                    'cpus': os.cpu_count() or 1,
+                    'duration': duration,
+                    'wall': wall,
+                    'time': time(),
+                })
+            except Exception as e:
+                LOGGER.debug(f"Could not save job stats: {e}")
+
+    async def load(self):
+        """Replay this host's stored runs, oldest first"""
+        from bot.utils.db_handler import get_db
+        db = get_db()
+        if not db:
+            return
+        try:
+            runs = await db.get_job_stats(self.host, HISTORY_LOAD_LIMIT)
+        except Exception as e:
+            LOGGER.warning(f"Could not load job stats: {e}")
+            return
+        for run in reversed(runs):
+            if run.get('wall'):
+                self._learn(run, run['duration'] / run['wall'])
+        LOGGER.info(f"Throughput model loaded from {len(runs)} runs")
+
+
+def completion_times(running: List[float], queued: List[float], slots: int) -> Tuple[List[float], List[float]]:
+    """
+    Seconds until each running and queued job finishes, with queued jobs
+    taking the first free FFmpeg slot in order.
+    """
+    free = sorted(max(r, 0.0) for r in running)
+    running_done = [max(r, 0.0) for r in running]
+    free = free[-slots:] if len(free) > slots else free + [0.0] * (slots - len(free))
+
+    queued_done = []
+    for seconds in queued:
+        start = free.pop(0)
+        end = start + seconds
+        queued_done.append(end)
+        free.append(end)
+        free.sort()
+    return running_done, queued_done
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    """'~12m 3s (14:05 UTC)' style completion estimate"""
+    if seconds is None:
+        return "unknown"
+    return f"~{get_readable_time(int(seconds))} ({strftime('%H:%M', gmtime(time() + seconds))} UTC)"
+
+
+eta_model: ThroughputModel = None
+
+
+def get_eta_model() -> ThroughputModel:
+    """Get the throughput model of this host"""
+    global eta_model
+    if eta_model is None:
+        eta_model = ThroughputModel(host_id())
+    return eta_model
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Weighted fair sharing of the FFmpeg slots between users and groups"""
+
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from itertools import count
+from time import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+Tenant = Tuple[str, int]  # ('user', user_id) or ('group', chat_id)
+
+
+def tenant_key(tenant: Tenant) -> str:
+    """Storage form of a tenant ("user:123", "group:-100123")"""
+    return f"{tenant[0]}:{tenant[1]}"
+
+
+def parse_tenant(text: str) -> Tenant:
+    """Tenant from "user:123", "group:-100123" or a bare ID (negative IDs are groups)"""
+    kind, _, value = text.strip().rpartition(':')
+    chat_id = int(value)
+    if not kind:
+        kind = 'group' if chat_id < 0 else 'user'
+    if kind not in ('user', 'group'):
+        raise ValueError(f"Unknown tenant type: {kind}")
+    return kind, chat_id
+
+
+class _Slot:
+    __slots__ = ('id', 'tenants', 'future', 'started')
+
+    def __init__(self, slot_id: int, tenants: List[Tenant], future: asyncio.Future):
+        self.id = slot_id
+        self.tenants = tenants
+        self.future = future
+        self.started = None
+
+
+class FairShare:
+    """
+    FFmpeg slots handed out by weighted fair queuing.
+
+    Usage is CPU-seconds in a sliding window, charged to the user and (for
+    jobs from group chats) to the group. Running jobs count as they go, so
+    a long encode weighs on its owner before it ends. When a slot frees up
+    it goes to the waiting job whose most loaded tenant has the lowest
+    usage/weight; tenants over their quota only get slots nobody else
+    wants. Ties go to the job that waited longest.
+    """
+
+    def __init__(self, slots: int, window: int, cpu_per_slot: int, default_quota: float = 0):
+        self.slots = slots
+        self.window = window
+        self.cpu_per_slot = cpu_per_slot
+        self.default_quota = default_quota
+        self.weights: Dict[Tenant, float] = {}
+        self.quotas: Dict[Tenant, float] = {}
+        self._usage: Dict[Tenant, deque] = {}  # tenant -> (finished at, cpu seconds)
+        self._running: Dict[int, _Slot] = {}
+        self._waiting: Dict[int, _Slot] = {}
+        self._ids = count(1)
+
+    @staticmethod
+    def tenants_of(user_id: int, chat_id: int = None) -> List[Tenant]:
+        tenants = [('user', user_id)]
+        if chat_id is not None and chat_id < 0:
+            tenants.append(('group', chat_id))
+        return tenants
+
+    def weight(self, tenant: Tenant) -> float:
+        return self.weights.get(tenant, 1.0)
+
+    def quota(self, tenant: Tenant) -> float:
+        """CPU-seconds allowed per window (0 = unlimited)"""
+        return self.quotas.get(tenant, self.default_quota if tenant[0] == 'user' else 0)
+
+    def used(self, tenant: Tenant) -> float:
+        """CPU-seconds used in the window, including running jobs"""
+        now = time()
+        history = self._usage.get(tenant)
+        while history and history[0][0] < now - self.window:
+            history.popleft()
+        used = sum(cpu for _, cpu in history) if history else 0.0
+        for slot in self._running.values():
+            if tenant in slot.tenants:
+                used += (now - slot.started) * self.cpu_per_slot
+        return used
+
+    def over_quota(self, tenant: Tenant) -> bool:
+        quota = self.quota(tenant)
+        return bool(quota) and self.used(tenant) >= quota
+
+    def _priority(self, slot: _Slot) -> tuple:
+        over = any(self.over_quota(t) for t in slot.tenants)
+        share = max(self.used(t) / self.weight(t) for t in slot.tenants)
+        return over, share, slot.id
+
+    def _dispatch(self):
+        while len(self._running) < self.slots and self._waiting:
+            slot = min(self._waiting.values(), key=self._priority)
+            del self._waiting[slot.id]
+            slot.started = time()
+            self._running[slot.id] = slot
+            slot.future.set_result(None)
+
+    async def acquire(self, user_id: int, chat_id: int = None, on_wait: Callable = None) -> _Slot:
+        """Wait for an FFmpeg slot; on_wait() is awaited once if the job has to queue"""
+        slot = _Slot(next(self._ids), self.tenants_of(user_id, chat_id), asyncio.get_running_loop().create_future())
+        self._waiting[slot.id] = slot
+        self._dispatch()
+
+        try:
+            if not slot.future.done() and on_wait:
+                try:
+                    await on_wait()
+                except Exception:
+                    pass
+            await slot.future
+        except asyncio.CancelledError:
+            if slot.id in self._waiting:
+                del self._waiting[slot.id]
+            else:
+                # Granted while being cancelled, hand it on
+                self.release(slot)
+            raise
+        return slot
+
+    def release(self, slot: Optional[_Slot]):
+        """Give a slot back and charge its CPU time to its tenants"""
+        if slot is None or self._running.pop(slot.id, None) is None:
+            return
+        finished = time()
+        cpu = (finished - slot.started) * self.cpu_per_slot
+        for tenant in slot.tenants:
+            self._usage.setdefault(tenant, deque()).append((finished, cpu))
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, chat_id: int = None, on_wait: Callable = None):
+        slot = await self.acquire(user_id, chat_id, on_wait)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def waiting_ahead(self, user_id: int, chat_id: int = None) -> int:
+        """Jobs that would be dispatched before a new job of this tenant"""
+        probe = _Slot(next(self._ids), self.tenants_of(user_id, chat_id), None)
+        mine = self._priority(probe)
+        return sum(1 for slot in self._waiting.values() if self._priority(slot) < mine)
+
+    def report(self) -> List[dict]:
+        """Usage of every known tenant, most loaded first"""
+        tenants = set(self._usage) | set(self.weights) | set(self.quotas)
+        for slot in list(self._running.values()) + list(self._waiting.values()):
+            tenants.update(slot.tenants)
+        rows = []
+        for tenant in tenants:
+            rows.append({
+                'tenant': tenant,
+                'used': self.used(tenant),
+                'weight': self.weight(tenant),
+                'quota': self.quota(tenant),
+                'running': sum(1 for s in self._running.values() if tenant in s.tenants),
+                'waiting': sum(1 for s in self._waiting.values() if tenant in s.tenants),
+            })
+        return sorted(rows, key=lambda r: r['used'] / r['weight'], reverse=True)
+
+    def configure(self, weights: dict = None, quotas: dict = None):
+        """Apply stored {"user:123": value} weights and quotas"""
+        for key, value in (weights or {}).items():
+            self.weights[parse_tenant(key)] = float(value)
+        for key, value in (quotas or {}).items():
+            self.quotas[parse_tenant(key)] = float(value)
+
+    def settings(self) -> dict:
+        return {
+            'weights': {tenant_key(t): w for t, w in self.weights.items()},
+            'quotas': {tenant_key(t): q for t, q in self.quotas.items()},
+        }
+
+    async def load(self):
+        """Load owner-set weights and quotas"""
+        from bot.utils.db_handler import get_db
+        db = get_db()
+        if not db:
+            return
+        try:
+            self.configure(**(await db.get_bot_config('fairshare', {}) or {}))
+        except Exception as e:
+            LOGGER.warning(f"Could not load fair share settings: {e}")
+
+    async def save(self):
+        from bot.utils.db_handler import get_db
+        db = get_db()
+        if db:
+            await db.set_bot_config('fairshare', self.settings())
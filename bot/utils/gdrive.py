@@ -7,12 +7,25 @@ import logging
 import asyncio
 from typing import Callable, Tuple, Optional
 
-from google.oauth2 import service_account
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
-from googleapiclient.errors import HttpError
+from bot.utils.lazy import lazy_import
+
+# Google client libraries are slow to import, load them on first use
+service_account = lazy_import('google.oauth2.service_account')
+oauth2_credentials = lazy_import('google.oauth2.credentials')
+oauthlib_flow = lazy_import('google_auth_oauthlib.flow')
+discovery = lazy_import('googleapiclient.discovery')
+gapi_http = lazy_import('googleapiclient.http')
+errors = lazy_import('googleapiclient.errors')
+
+# Imported by the bot when GDRIVE_ENABLED so the first upload is fast
+GOOGLE_MODULES = (
+    'google.oauth2.service_account',
+    'google.oauth2.credentials',
+    'google_auth_oauthlib.flow',
+    'googleapiclient.discovery',
+    'googleapiclient.http',
+    'googleapiclient.errors',
+)
 
 LOGGER = logging.getLogger(__name__)
 
@@ -36,7 +49,7 @@ class GoogleDrive:
         
     async def generate_oauth_url(self, client_secrets: dict) -> str:
         """Generate OAuth authorization URL."""
-        flow = Flow.from_client_config(
+        flow = oauthlib_flow.Flow.from_client_config(
             client_secrets,
             scopes=SCOPES,
             redirect_uri='http://127.0.0.1'
@@ -47,7 +60,7 @@ class GoogleDrive:
     async def exchange_oauth_code(self, client_secrets: dict, code: str) -> str:
         """Exchange auth code for credentials token."""
         def _exchange():
-            flow = Flow.from_client_config(
+            flow = oauthlib_flow.Flow.from_client_config(
                 client_secrets,
                 scopes=SCOPES,
                 redirect_uri='http://127.0.0.1'
@@ -74,7 +87,7 @@ class GoogleDrive:
                     token_json = await db.get_gdrive_oauth_token()
                     if token_json:
                         info = json.loads(token_json)
-                        credentials = Credentials.from_authorized_user_info(info, SCOPES)
+                        credentials = oauth2_credentials.Credentials.from_authorized_user_info(info, SCOPES)
                         LOGGER.info("Using OAuth User Credentials from MongoDB")
                 except Exception as e:
                     LOGGER.warning(f"OAuth token load failed: {e}")
@@ -108,7 +121,7 @@ class GoogleDrive:
                 LOGGER.warning(f"No GDrive credentials found")
                 return False
             
-            self.service = build('drive', 'v3', credentials=credentials)
+            self.service = discovery.build('drive', 'v3', credentials=credentials)
             self._initialized = True
             LOGGER.info("Google Drive service initialized")
             return True
@@ -157,7 +170,7 @@ class GoogleDrive:
             mime_type = self._get_mime_type(file_path)
             
             # Create media upload
-            media = MediaFileUpload(
+            media = gapi_http.MediaFileUpload(
                 file_path,
                 mimetype=mime_type,
                 resumable=True,
@@ -193,7 +206,7 @@ class GoogleDrive:
                 'size': file_size
             }
             
-        except HttpError as e:
+        except errors.HttpError as e:
             error = str(e)
             LOGGER.error(f"Upload error: {error}")
             return False, error
@@ -110,29 +110,84 @@ def sanitize_filename(filename: str) -> str:
     return filename.strip()
 
 
-async def clean_temp_files(directory: str, max_age_hours: int = 24):
-    """Clean temporary files older than max_age_hours"""
+def parse_selection(text: str, count: int) -> list:
+    """
+    Parse a 1-based selection like "all", "5", "1-10" or "1-3, 7, 9-" into
+    sorted 0-based indexes below count. Raises ValueError on bad input.
+    """
+    text = text.strip().lower()
+    if text in ('all', '*'):
+        return list(range(count))
+
+    selected = set()
+    for part in text.replace(' ', '').split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            start = int(start) if start else 1
+            end = int(end) if end else count
+        else:
+            start = end = int(part)
+        if start < 1 or end < start:
+            raise ValueError(f"Invalid range: {part}")
+        selected.update(range(start - 1, min(end, count)))
+
+    if not selected:
+        raise ValueError("Nothing selected")
+    return sorted(selected)
+
+
+async def clean_temp_files(directory: str, max_age_hours: int = 24, protected: set = None) -> int:
+    """Clean temporary files older than max_age_hours, skipping protected paths.
+
+    Returns the number of bytes freed.
+    """
     current_time = time()
     max_age_seconds = max_age_hours * 3600
-    
+    protected = protected or set()
+    freed = 0
+
     for root, dirs, files in os.walk(directory):
+        if is_protected_path(root, protected):
+            dirs[:] = []
+            continue
         for file in files:
             file_path = os.path.join(root, file)
+            if is_protected_path(file_path, protected):
+                continue
             try:
                 file_age = current_time - os.path.getmtime(file_path)
                 if file_age > max_age_seconds:
+                    size = os.path.getsize(file_path)
                     os.remove(file_path)
+                    freed += size
                     LOGGER.info(f"Cleaned old file: {file_path}")
             except Exception as e:
                 LOGGER.error(f"Error cleaning file {file_path}: {e}")
 
+    return freed
+
+
+def is_protected_path(path: str, protected: set) -> bool:
+    """Check if path is (or lives inside) one of the protected paths"""
+    path = os.path.abspath(path)
+    for p in protected:
+        p = os.path.abspath(p)
+        if path == p or path.startswith(p + os.sep):
+            return True
+    return False
+
 import aiohttp
 from bot.utils.progress import Progress
 
 async def download_http_file(url: str, directory: str, status_msg, user_id: int):
     """Download a file from HTTP URL with progress"""
+    from bot.utils.bandwidth import get_bandwidth, get_host_limiter
+    
+    budget = get_bandwidth()
     try:
-        async with aiohttp.ClientSession() as session:
+        async with get_host_limiter().connections(url), aiohttp.ClientSession() as session:
             async with session.get(url) as response:
                 if response.status != 200:
                     LOGGER.error(f"Download failed: {response.status}")
@@ -167,6 +222,7 @@ async def download_http_file(url: str, directory: str, status_msg, user_id: int)
                             break
                         f.write(chunk)
                         downloaded += len(chunk)
+                        await budget.throttle(len(chunk))
                         if total_size > 0:
                             await progress.progress_callback(downloaded, total_size)
                             
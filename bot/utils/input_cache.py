@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Downloaded source files kept across operations on the same file"""
+
+import os
+import logging
+from time import time
+from collections import OrderedDict
+
+from bot.utils.helpers import get_readable_file_size
+
+LOGGER = logging.getLogger(__name__)
+
+
+class InputCache:
+    """
+    Downloaded inputs keyed by Telegram file_unique_id (or source URL).
+
+    Entries live until the user's session moves on to another file, the
+    TTL expires, or the disk manager needs the space back. Entries used
+    by a running job are never evicted.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> {'path', 'size', 'user_id', 'last_used'}
+        self._in_use = {}  # path -> number of jobs using it
+
+    def get(self, key: str) -> str:
+        """Cached path for key, or None"""
+        entry = self._entries.get(key) if key else None
+        if not entry:
+            return None
+        if not os.path.exists(entry['path']):
+            del self._entries[key]
+            return None
+        entry['last_used'] = time()
+        self._entries.move_to_end(key)
+        return entry['path']
+
+    def put(self, key: str, path: str, user_id: int):
+        """Remember a downloaded input"""
+        if not key or not path or not os.path.exists(path):
+            return
+        old = self._entries.get(key)
+        if old and old['path'] != path:
+            self._remove(key)
+        self._entries[key] = {
+            'path': path,
+            'size': os.path.getsize(path),
+            'user_id': user_id,
+            'last_used': time(),
+        }
+        self._entries.move_to_end(key)
+
+    def paths(self) -> set:
+        return {entry['path'] for entry in self._entries.values()}
+
+    def is_cached(self, path: str) -> bool:
+        return any(entry['path'] == path for entry in self._entries.values())
+
+    def move(self, old_path: str, new_path: str):
+        """Follow a cached input that was renamed on disk"""
+        for entry in self._entries.values():
+            if entry['path'] == old_path:
+                entry['path'] = new_path
+
+    def discard(self, path: str):
+        """Forget a path without deleting it (it was moved or consumed)"""
+        for key in [k for k, e in self._entries.items() if e['path'] == path]:
+            del self._entries[key]
+
+    def acquire(self, path: str):
+        """Pin a path while a job reads it"""
+        if path:
+            self._in_use[path] = self._in_use.get(path, 0) + 1
+
+    def release(self, path: str):
+        if path in self._in_use:
+            self._in_use[path] -= 1
+            if self._in_use[path] <= 0:
+                del self._in_use[path]
+
+    def evict_user(self, user_id: int, keep: str = None) -> int:
+        """End a user's session, deleting their cached inputs except keep"""
+        keys = [k for k, e in self._entries.items() if e['user_id'] == user_id and k != keep]
+        return sum(self._remove(k) for k in keys)
+
+    def evict_expired(self) -> int:
+        """Delete inputs unused for longer than the TTL"""
+        cutoff = time() - self.ttl
+        keys = [k for k, e in self._entries.items() if e['last_used'] < cutoff]
+        return sum(self._remove(k) for k in keys)
+
+    def reclaim(self, needed_bytes: int) -> int:
+        """Delete least recently used inputs until needed_bytes are freed"""
+        freed = 0
+        for key in list(self._entries):
+            if freed >= needed_bytes:
+                break
+            freed += self._remove(key)
+        return freed
+
+    def _remove(self, key: str) -> int:
+        """Delete an entry's file unless a job is using it; returns bytes freed"""
+        entry = self._entries.get(key)
+        if not entry or entry['path'] in self._in_use:
+            return 0
+        del self._entries[key]
+
+        from bot import user_data
+        data = user_data.get(entry['user_id'], {})
+        if data.get('file_path') == entry['path']:
+            data['file_path'] = None
+
+        try:
+            os.remove(entry['path'])
+        except OSError:
+            return 0
+        LOGGER.info(f"Evicted cached input {entry['path']} ({get_readable_file_size(entry['size'])})")
+        return entry['size']
+
+
+# Global instance
+input_cache: InputCache = None
+
+
+def get_input_cache() -> InputCache:
+    """Get the global input cache"""
+    global input_cache
+    if input_cache is None:
+        from bot import INPUT_CACHE_TTL
+        input_cache = InputCache(INPUT_CACHE_TTL)
+    return input_cache
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Job handles that own the processes a job spawns, so cancelling it kills them"""
+
+import os
+import signal
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from itertools import count
+from typing import Callable, Dict, List, Optional, Set
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds a process group gets between SIGTERM and SIGKILL
+KILL_GRACE = 5
+
+_current_job: ContextVar[Optional["Job"]] = ContextVar('current_job', default=None)
+_ids = count(1)
+_task_processes: Dict[asyncio.Task, Set[asyncio.subprocess.Process]] = {}
+jobs: Dict[int, "Job"] = {}
+
+
+def _signal_group(process: asyncio.subprocess.Process, sig: int) -> bool:
+    """Signal the process group led by process, False if it has already exited"""
+    if process.returncode is not None:
+        return False
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        return False
+    return True
+
+
+def terminate_process_group(process: asyncio.subprocess.Process, grace: float = KILL_GRACE):
+    """SIGTERM a process group now and SIGKILL it grace seconds later if it is still running"""
+    if _signal_group(process, signal.SIGTERM):
+        asyncio.get_running_loop().call_later(grace, _signal_group, process, signal.SIGKILL)
+
+
+async def kill_process_group(process: asyncio.subprocess.Process, grace: float = KILL_GRACE):
+    """SIGTERM a process group, SIGKILL it after grace seconds and wait for it to exit"""
+    if not _signal_group(process, signal.SIGTERM):
+        return
+    try:
+        await asyncio.wait_for(process.wait(), grace)
+    except asyncio.TimeoutError:
+        LOGGER.warning(f"Process {process.pid} ignored SIGTERM, killing it")
+        _signal_group(process, signal.SIGKILL)
+        await process.wait()
+
+
+def _task_done(task: asyncio.Task):
+    # A task that ends (or is cancelled) mid-communicate() would leave its processes running
+    for process in _task_processes.pop(task, ()):
+        terminate_process_group(process)
+
+
+async def spawn(*cmd, **kwargs) -> asyncio.subprocess.Process:
+    """
+    asyncio.create_subprocess_exec for job processes (FFmpeg, ffprobe, 7z).
+
+    The process leads its own process group, so it and anything it starts
+    can be signalled together. It is killed when the task that spawned it
+    ends while it still runs, and when its job is cancelled.
+    """
+    process = await asyncio.create_subprocess_exec(*cmd, start_new_session=True, **kwargs)
+
+    task = asyncio.current_task()
+    if task is not None:
+        processes = _task_processes.get(task)
+        if processes is None:
+            processes = _task_processes[task] = set()
+            task.add_done_callback(_task_done)
+        # Long-lived tasks (handler workers) spawn many short processes
+        processes.difference_update([p for p in processes if p.returncode is not None])
+        processes.add(process)
+
+    job = _current_job.get()
+    if job is not None:
+        job.processes.add(process)
+    return process
+
+
+class Job:
+    """A running job: its task, process groups, partial outputs and cancel hooks"""
+
+    def __init__(self, user_id: int, kind: str, task: asyncio.Task):
+        self.id = next(_ids)
+        self.user_id = user_id
+        self.kind = kind
+        self.task = task
+        self.processes: Set[asyncio.subprocess.Process] = set()
+        self.outputs: Set[str] = set()
+        self.callbacks: List[Callable] = []
+        self.cancelled = False
+
+    def _live(self) -> list:
+        return [p for p in self.processes if p.returncode is None]
+
+    async def cancel(self):
+        """Stop the job now: run its hooks, cancel its task and kill its process groups"""
+        if self.cancelled:
+            return
+        self.cancelled = True
+        for callback in self.callbacks:
+            try:
+                callback()
+            except Exception as e:
+                LOGGER.debug(f"Cancel hook of job {self.id} failed: {e}")
+        processes = self._live()
+        for process in processes:
+            _signal_group(process, signal.SIGTERM)
+        # The task's finally blocks give back its FFmpeg slot and disk reservation
+        if self.task and not self.task.done():
+            self.task.cancel()
+        await asyncio.gather(*(kill_process_group(p) for p in processes), return_exceptions=True)
+
+    async def close(self):
+        """Reap leftover processes and, for a cancelled job, remove its partial outputs"""
+        await asyncio.gather(*(kill_process_group(p) for p in self._live()), return_exceptions=True)
+        if not self.cancelled:
+            return
+        for path in self.outputs:
+            try:
+                if os.path.isfile(path):
+                    os.remove(path)
+                    LOGGER.info(f"Removed partial output of cancelled job {self.id}: {path}")
+            except OSError as e:
+                LOGGER.debug(f"Could not remove {path}: {e}")
+
+
+def current_job() -> Optional[Job]:
+    return _current_job.get()
+
+
+def track_output(path: str):
+    """Remember a file the current job is writing, removed if the job is cancelled"""
+    job = _current_job.get()
+    if job is not None and path and not path.startswith(('-', 'pipe:')):
+        job.outputs.add(path)
+
+
+def on_cancel(callback: Callable):
+    """Call callback() when the current job is cancelled (for work outside asyncio, e.g. threads)"""
+    job = _current_job.get()
+    if job is not None:
+        job.callbacks.append(callback)
+
+
+@asynccontextmanager
+async def job_scope(user_id: int, kind: str = 'process'):
+    """Make the current task a job; processes spawned inside belong to it"""
+    job = Job(user_id, kind, asyncio.current_task())
+    jobs[job.id] = job
+    token = _current_job.set(job)
+    try:
+        yield job
+    except asyncio.CancelledError:
+        job.cancelled = True
+        raise
+    finally:
+        _current_job.reset(token)
+        jobs.pop(job.id, None)
+        await job.close()
+
+
+async def run_job(user_id: int, coro, kind: str = 'process'):
+    """
+    Run coro as a job in its own task, so cancelling the job leaves the
+    caller (e.g. a handler worker) running. Returns the coroutine's result,
+    None if the job was cancelled.
+    """
+    async def _run():
+        async with job_scope(user_id, kind):
+            return await coro
+
+    task = asyncio.create_task(_run())
+    try:
+        await asyncio.wait({task})
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    return None if task.cancelled() else task.result()
+
+
+def user_jobs(user_id: int, kind: str = None) -> List[Job]:
+    return [job for job in jobs.values() if job.user_id == user_id and (kind is None or job.kind == kind)]
+
+
+async def cancel_jobs(user_id: int, kind: str = None) -> int:
+    """Cancel a user's running jobs, returns how many there were"""
+    running = user_jobs(user_id, kind)
+    await asyncio.gather(*(job.cancel() for job in running))
+    return len(running)
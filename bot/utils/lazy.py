@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Deferred imports for heavy optional dependencies"""
+
+import os
+import re
+import sys
+import asyncio
+import importlib
+import logging
+from time import perf_counter
+from types import ModuleType
+from typing import List, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# Module name -> seconds spent importing it on first use
+LAZY_LOAD_TIMES = {}
+
+
+class LazyModule(ModuleType):
+    """Module proxy that imports the real module on first attribute access"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__['_module'] = None
+
+    def _load(self) -> ModuleType:
+        module = self.__dict__['_module']
+        if module is None:
+            start = perf_counter()
+            module = importlib.import_module(self.__name__)
+            elapsed = perf_counter() - start
+            LAZY_LOAD_TIMES.setdefault(self.__name__, elapsed)
+            LOGGER.info(f"Lazy-loaded {self.__name__} in {elapsed * 1000:.0f} ms")
+            self.__dict__['_module'] = module
+        return module
+
+    @property
+    def loaded(self) -> bool:
+        return self.__dict__['_module'] is not None
+
+    def __getattr__(self, item):
+        return getattr(self._load(), item)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Return a module, deferring the actual import until it is first used"""
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+async def preload(*names: str):
+    """Import modules in a worker thread so the first real use is fast"""
+    for name in names:
+        module = lazy_import(name)
+        if isinstance(module, LazyModule) and not module.loaded:
+            try:
+                await asyncio.to_thread(module._load)
+            except ImportError as e:
+                LOGGER.warning(f"Could not preload {name}: {e}")
+
+
+async def import_time_report(target: str = 'bot.handlers', top: int = 15) -> Tuple[float, List[Tuple[float, float, str]]]:
+    """
+    Profile a cold import of target in a fresh interpreter (python -X importtime).
+
+    Returns:
+        (total seconds, [(cumulative s, self s, module), ...] slowest first)
+    """
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, '-X', 'importtime', '-c', f'import {target}',
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=os.getcwd()
+    )
+    _, stderr = await process.communicate()
+
+    entries = []
+    total = 0
+    for line in stderr.decode(errors='ignore').splitlines():
+        # import time: self [us] | cumulative | imported package
+        match = re.match(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)', line)
+        if not match:
+            continue
+        self_us, cumulative_us = int(match.group(1)), int(match.group(2))
+        depth = len(match.group(3)) // 2
+        if depth == 0:
+            total += cumulative_us
+        # Top-level and first-level imports say where the time goes
+        if depth <= 1:
+            entries.append((cumulative_us / 1e6, self_us / 1e6, match.group(4)))
+
+    entries.sort(reverse=True)
+    return total / 1e6, entries[:top]
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""Overlapped download, FFmpeg and upload stages for queued jobs"""
+
+import os
+import shutil
+import asyncio
+import logging
+from itertools import count
+from time import time
+
+from bot.utils.disk import get_disk_manager, estimate_output_size
+from bot.utils.scheduler import get_scheduler
+from bot.utils.input_cache import get_input_cache
+from bot.utils.eta import get_eta_model, format_eta
+
+LOGGER = logging.getLogger(__name__)
+
+
+class PipelineJob:
+    """A queued task moving through the download -> process -> upload stages"""
+
+    _ids = count(1)
+
+    def __init__(
+        self,
+        client,
+        chat_id: int,
+        user_id: int,
+        message,
+        operation: str,
+        options: dict,
+        status_msg,
+        file_name: str = None,
+        file_size: int = 0,
+        duration: float = None
+    ):
+        from bot import OUTPUT_DIR
+
+        self.id = next(self._ids)
+        self.client = client
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.message = message
+        self.operation = operation
+        self.options = dict(options or {})
+        self.status_msg = status_msg
+        self.file_name = file_name or "file"
+        self.file_size = file_size or 0
+        self.work_dir = os.path.join(OUTPUT_DIR, str(user_id), f"job_{self.id}")
+        self.stage = 'queued'
+        self.input_path = None
+        self.input_cached = False
+        self.output = None
+        self.reservation = None
+        self.task = None
+        self.cancelled = False
+        self.created = time()
+        self.predicted = get_eta_model().predict(operation, self.options, duration, self.file_size)
+        self.process_started = None
+
+    @property
+    def sort_key(self) -> tuple:
+        # Shortest job first, but a long job never waits longer than its own
+        # predicted run time for shorter jobs submitted after it
+        return (self.created + self.predicted, self.id)
+
+    def __lt__(self, other: "PipelineJob") -> bool:
+        return self.sort_key < other.sort_key
+
+    @property
+    def cancel_data(self) -> str:
+        """Callback data of the job's Cancel button"""
+        return f"pipecancel_{self.id}_{self.user_id}"
+
+    def remaining(self) -> float:
+        """Predicted FFmpeg seconds left for this job"""
+        if self.process_started is None:
+            return self.predicted
+        return max(self.predicted - (time() - self.process_started), 0.0)
+
+
+class Pipeline:
+    """
+    Three bounded stage queues with their own workers.
+
+    While job N is in FFmpeg, job N+1 can download and job N-1 upload.
+    The process and upload queues hold at most one job per worker, so a
+    slow stage stalls the stage before it instead of piling files on disk.
+    Stage work also goes through the shared scheduler slots, so pipeline
+    jobs and batches never exceed the bot-wide limits together.
+    """
+
+    def __init__(self, download_workers: int, process_workers: int, upload_workers: int):
+        # Jobs waiting to download cost nothing but memory, the rest hold files.
+        # Waiting jobs are taken shortest first (see PipelineJob.sort_key).
+        self.downloads = asyncio.PriorityQueue()
+        self.processing = asyncio.Queue(maxsize=process_workers)
+        self.uploads = asyncio.Queue(maxsize=upload_workers)
+        self.worker_counts = (download_workers, process_workers, upload_workers)
+        self.jobs = {}
+        self.workers = []
+
+    def start(self):
+        """Start stage workers (idempotent)"""
+        if self.workers:
+            return
+        download_workers, process_workers, upload_workers = self.worker_counts
+        stages = [
+            (self.downloads, self._download, self.processing, download_workers),
+            (self.processing, self._process, self.uploads, process_workers),
+            (self.uploads, self._upload, None, upload_workers),
+        ]
+        for queue, handler, next_queue, workers in stages:
+            for _ in range(workers):
+                self.workers.append(asyncio.create_task(self._worker(queue, handler, next_queue)))
+
+    async def stop(self):
+        """Stop workers and clean up unfinished jobs"""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        for job in list(self.jobs.values()):
+            self._cleanup(job)
+
+    async def submit(self, job: PipelineJob) -> PipelineJob:
+        """Queue a job for download"""
+        self.start()
+        self.jobs[job.id] = job
+        await self._status(
+            job,
+            f"🕒 <b>Queued:</b> {job.operation}\n<code>{job.file_name}</code>\n\n"
+            f"<b>Estimated processing:</b> {format_eta(job.predicted)}"
+        )
+        await self.downloads.put(job)
+        return job
+
+    def user_jobs(self, user_id: int) -> list:
+        """Unfinished jobs of a user, oldest first"""
+        return [job for job in self.jobs.values() if job.user_id == user_id]
+
+    def waiting_jobs(self) -> list:
+        """Jobs not yet in FFmpeg, in the order they will get there"""
+        return sorted(job for job in self.jobs.values() if job.process_started is None)
+
+    def cancel(self, job_id: int) -> bool:
+        """Cancel a job wherever it is in the pipeline"""
+        job = self.jobs.get(job_id)
+        if not job:
+            return False
+        job.cancelled = True
+        if job.task and not job.task.done():
+            job.task.cancel()
+        return True
+
+    async def _worker(self, queue: asyncio.Queue, handler, next_queue: asyncio.Queue):
+        while True:
+            job = await queue.get()
+            try:
+                if job.cancelled:
+                    await self._finish(job, "❌ <b>Cancelled</b>")
+                    continue
+
+                # Run the stage as its own task so cancelling a job leaves the worker alive
+                job.task = asyncio.create_task(handler(job))
+                try:
+                    await asyncio.wait({job.task})
+                except asyncio.CancelledError:
+                    job.task.cancel()
+                    raise
+
+                if job.task.cancelled() or job.cancelled:
+                    await self._finish(job, "❌ <b>Cancelled</b>")
+                elif job.task.exception():
+                    error = job.task.exception()
+                    LOGGER.error(f"Pipeline job {job.id} failed in {job.stage}: {error}")
+                    await self._finish(job, f"❌ Error: {str(error)[:500]}")
+                elif next_queue is not None:
+                    # Blocks while the next stage is full (back-pressure)
+                    await next_queue.put(job)
+                else:
+                    await self._finish(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error(f"Pipeline worker error: {e}")
+            finally:
+                queue.task_done()
+
+    async def _download(self, job: PipelineJob):
+        from bot.handlers.file_handler import download_file
+        from bot.utils.progress import Progress
+
+        disk = get_disk_manager()
+        cache = get_input_cache()
+
+        async def _waiting_for_disk():
+            await self._status(job, "⏳ Waiting for free disk space...")
+
+        media = job.message.video or job.message.document
+        cached = cache.get(getattr(media, 'file_unique_id', None))
+        if cached:
+            # Source is already on disk from an earlier operation, pin it
+            cache.acquire(cached)
+            job.input_path = cached
+            job.input_cached = True
+
+        job.stage = 'waiting'
+        job.reservation = await disk.reserve(
+            (0 if cached else job.file_size) + estimate_output_size(job.operation, job.file_size, options=job.options),
+            owner=job.user_id,
+            on_wait=_waiting_for_disk
+        )
+
+        if cached:
+            job.stage = 'downloaded'
+            return
+
+        async with get_scheduler().download:
+            job.stage = 'downloading'
+            progress = Progress(
+                job.status_msg, "📥 Downloading", user_id=job.user_id,
+                filename=job.file_name, cancel_data=job.cancel_data
+            )
+            job.input_path = await download_file(
+                job.message,
+                job.status_msg,
+                job.user_id,
+                progress_callback=progress.progress_callback,
+                directory=os.path.join(job.work_dir, "input")
+            )
+
+        job.stage = 'downloaded'
+        await self._status(job, f"⏳ <b>Downloaded, waiting for FFmpeg</b>\n<code>{job.file_name}</code>")
+
+    async def _process(self, job: PipelineJob):
+        from bot.ffmpeg.core import FFmpeg
+        from bot.ffmpeg.operations import run_operation
+        from bot.utils.progress import FFmpegProgress
+
+        disk = get_disk_manager()
+
+        async with get_scheduler().ffmpeg.slot(job.user_id, job.chat_id):
+            job.stage = 'processing'
+            job.process_started = time()
+            duration = await FFmpeg(job.input_path).get_duration()
+            job.predicted = get_eta_model().predict(job.operation, job.options, duration)
+            # Input is on disk now, only the output is still outstanding
+            disk.adjust(
+                job.reservation,
+                estimate_output_size(job.operation, os.path.getsize(job.input_path), {'duration': duration}, job.options)
+            )
+            progress = FFmpegProgress(
+                job.status_msg, duration, f"Processing ({job.operation})",
+                filename=job.file_name, cancel_data=job.cancel_data
+            )
+            success, result = await run_operation(
+                job.operation,
+                job.input_path,
+                os.path.join(job.work_dir, "output"),
+                job.options,
+                progress_callback=progress.update,
+                duration=duration
+            )
+
+        if not success:
+            raise RuntimeError(result)
+
+        job.output = result
+        if job.input_cached:
+            get_input_cache().release(job.input_path)
+        else:
+            os.remove(job.input_path)
+        job.input_path = None
+        disk.adjust(job.reservation, 0)
+
+        job.stage = 'processed'
+        await self._status(job, f"⏳ <b>Processed, waiting to upload</b>\n<code>{job.file_name}</code>")
+
+    async def _upload(self, job: PipelineJob):
+        from bot import GDRIVE_ENABLED
+        from bot.utils.db_handler import get_db
+        from bot.utils.progress import Progress
+        from bot.utils.scheduler import upload_output
+
+        dest = "telegram"
+        db = get_db()
+        if db:
+            try:
+                dest = await db.get_default_destination(job.user_id)
+            except Exception:
+                dest = "telegram"
+
+        async with get_scheduler().upload:
+            job.stage = 'uploading'
+            if dest == "gdrive" and GDRIVE_ENABLED and not isinstance(job.output, list):
+                await self._upload_gdrive(job)
+            else:
+                progress = Progress(
+                    job.status_msg, "📤 Uploading", user_id=job.user_id,
+                    filename=os.path.basename(str(job.output)), cancel_data=job.cancel_data
+                )
+                await upload_output(
+                    job.client, job.chat_id, job.output, job.status_msg, job.user_id,
+                    progress.progress_callback
+                )
+                try:
+                    await job.status_msg.delete()
+                except Exception:
+                    pass
+
+        job.stage = 'done'
+
+    async def _upload_gdrive(self, job: PipelineJob):
+        from bot import GDRIVE_FOLDER_ID
+        from bot.utils.db_handler import get_db
+        from bot.utils.gdrive import get_gdrive
+        from bot.utils.helpers import get_readable_file_size
+
+        gdrive = get_gdrive()
+        if not gdrive.is_ready:
+            await gdrive.initialize()
+        if not gdrive.is_ready:
+            raise RuntimeError("Google Drive not configured")
+
+        async def progress_callback(percent, current, total):
+            await self._status(job, f"☁️ <b>Uploading to Google Drive</b>\n\n<b>Progress:</b> {percent:.1f}%")
+
+        db = get_db()
+        folder_id = (await db.get_gdrive_folder_id() if db else None) or GDRIVE_FOLDER_ID
+        success, result = await gdrive.upload_file(
+            job.output,
+            folder_id=folder_id or None,
+            progress_callback=progress_callback
+        )
+        if not success:
+            raise RuntimeError(f"Google Drive upload failed: {result}")
+
+        await job.status_msg.edit_text(
+            f"<b>✅ Uploaded to Google Drive!</b>\n\n"
+            f"<b>📁 File:</b> <code>{result['name']}</code>\n"
+            f"<b>💾 Size:</b> {get_readable_file_size(result['size'])}\n\n"
+            f"<b>🔗 Link:</b> {result['link']}",
+            disable_web_page_preview=True
+        )
+
+    async def _status(self, job: PipelineJob, text: str):
+        from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+        keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton("Cancel", callback_data=job.cancel_data)
+        ]])
+        try:
+            await job.status_msg.edit_text(text, reply_markup=keyboard)
+        except Exception as e:
+            LOGGER.debug(f"Pipeline status update error: {e}")
+
+    async def _finish(self, job: PipelineJob, text: str = None):
+        self._cleanup(job)
+        if text:
+            try:
+                await job.status_msg.edit_text(text)
+            except Exception:
+                pass
+
+    def _cleanup(self, job: PipelineJob):
+        if job.input_cached and job.input_path:
+            get_input_cache().release(job.input_path)
+            job.input_path = None
+        get_disk_manager().release(job.reservation)
+        job.reservation = None
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+        self.jobs.pop(job.id, None)
+
+
+pipeline: Pipeline = None
+
+
+def get_pipeline() -> Pipeline:
+    """Get the shared pipeline"""
+    global pipeline
+    if pipeline is None:
+        from bot import MAX_CONCURRENT_DOWNLOADS, MAX_CONCURRENT_FFMPEG, MAX_CONCURRENT_UPLOADS
+        pipeline = Pipeline(MAX_CONCURRENT_DOWNLOADS, MAX_CONCURRENT_FFMPEG, MAX_CONCURRENT_UPLOADS)
+    return pipeline
@@ -18,7 +18,8 @@ class Progress:
         operation: str = "Processing",
         update_interval: float = 3.0,
         user_id: int = None,
-        filename: str = None
+        filename: str = None,
+        cancel_data: str = None
     ):
         self.message = message
         self.operation = operation
@@ -27,6 +28,8 @@ class Progress:
         self.start_time = time()
         self.user_id = user_id
         self.filename = filename
+        # Callback data for the Cancel button, when the owner has its own cancel path
+        self.cancel_data = cancel_data or (f"cancel_process_{user_id}" if user_id else None)
         self.cancelled = False
     
     def cancel(self):
@@ -75,8 +78,8 @@ class Progress:
         # Add cancel button (No Emoji)
         from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
         cancel_btn = InlineKeyboardMarkup([[
-            InlineKeyboardButton("Cancel", callback_data=f"cancel_process_{self.user_id or 0}")
-        ]]) if self.user_id else None
+            InlineKeyboardButton("Cancel", callback_data=self.cancel_data)
+        ]]) if self.cancel_data else None
         
         try:
             await self.message.edit_text(text, reply_markup=cancel_btn)
@@ -123,7 +126,8 @@ class FFmpegProgress:
         duration: float,
         operation: str = "Processing",
         update_interval: float = 3.0,
-        filename: str = None
+        filename: str = None,
+        cancel_data: str = None
     ):
         self.message = message
         self.duration = duration
@@ -132,6 +136,7 @@ class FFmpegProgress:
         self.last_update_time = 0
         self.start_time = time()
         self.filename = filename
+        self.cancel_data = cancel_data
     
     async def update(self, current_time: float):
         """Update progress based on current timestamp"""
@@ -168,7 +173,123 @@ class FFmpegProgress:
             f"└ <b>ETA:</b> {Progress._format_time(eta)}"
         )
         
+        from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+        cancel_btn = InlineKeyboardMarkup([[
+            InlineKeyboardButton("Cancel", callback_data=self.cancel_data)
+        ]]) if self.cancel_data else None
+        
         try:
-            await self.message.edit_text(text)
+            await self.message.edit_text(text, reply_markup=cancel_btn)
         except Exception as e:
             LOGGER.debug(f"FFmpeg progress update error: {e}")
+
+
+class BatchProgress:
+    """Single aggregated status message for a batch of files"""
+
+    # Share of an item's work done once it reaches each stage
+    STAGE_WEIGHTS = {'downloading': (0.0, 0.2), 'processing': (0.2, 0.6), 'uploading': (0.8, 0.2)}
+    STAGE_ICONS = {'downloading': "📥", 'processing': "⚙️", 'uploading': "📤"}
+
+    def __init__(
+        self,
+        message,
+        operation: str = "Processing",
+        update_interval: float = 5.0,
+        user_id: int = None
+    ):
+        self.message = message
+        self.operation = operation
+        self.update_interval = update_interval
+        self.last_update_time = 0
+        self.start_time = time()
+        self.user_id = user_id
+        self.items = []
+        self.cancelled = False
+
+    def cancel(self):
+        """Mark as cancelled"""
+        self.cancelled = True
+
+    def add(self, name: str) -> int:
+        """Register an item and return its index"""
+        self.items.append({'name': name, 'stage': 'queued', 'fraction': 0.0, 'error': None})
+        return len(self.items) - 1
+
+    async def set(self, index: int, stage: str, fraction: float = 0.0, error: str = None):
+        """Move an item to a stage (queued/downloading/processing/uploading/done/failed)"""
+        item = self.items[index]
+        item['stage'] = stage
+        item['fraction'] = max(0.0, min(fraction, 1.0))
+        if error:
+            item['error'] = error
+        await self.refresh(force=stage in ('done', 'failed'))
+
+    def stage_callback(self, index: int, stage: str) -> Callable:
+        """Pyrogram-style (current, total) callback for one item's transfer"""
+        async def callback(current: int, total: int):
+            if self.cancelled:
+                raise asyncio.CancelledError("Cancelled by user")
+            self.items[index]['stage'] = stage
+            self.items[index]['fraction'] = current / total if total else 0
+            await self.refresh()
+        return callback
+
+    def ffmpeg_callback(self, index: int, duration: float) -> Callable:
+        """FFmpeg (current_time) callback for one item"""
+        async def callback(current_time: float):
+            self.items[index]['fraction'] = min(current_time / duration, 1.0) if duration > 0 else 0
+            await self.refresh()
+        return callback
+
+    def counts(self) -> dict:
+        counts = {}
+        for item in self.items:
+            counts[item['stage']] = counts.get(item['stage'], 0) + 1
+        return counts
+
+    def percentage(self) -> float:
+        if not self.items:
+            return 0
+        done = 0.0
+        for item in self.items:
+            if item['stage'] in ('done', 'failed'):
+                done += 1
+            elif item['stage'] in self.STAGE_WEIGHTS:
+                start, share = self.STAGE_WEIGHTS[item['stage']]
+                done += start + share * item['fraction']
+        return done / len(self.items) * 100
+
+    async def refresh(self, force: bool = False):
+        """Edit the status message, at most once per update_interval"""
+        now = time()
+        if not force and now - self.last_update_time < self.update_interval:
+            return
+        self.last_update_time = now
+
+        counts = self.counts()
+        percentage = self.percentage()
+        finished = counts.get('done', 0) + counts.get('failed', 0)
+
+        active = [
+            f"├ {self.STAGE_ICONS[item['stage']]} <code>{item['name'][:40]}</code> {item['fraction'] * 100:.0f}%"
+            for item in self.items if item['stage'] in self.STAGE_ICONS
+        ]
+
+        text = (
+            f"<b>📦 Batch: {self.operation}</b> ({finished}/{len(self.items)})\n"
+            f"┃ {Progress._create_progress_bar(percentage)} {percentage:.1f}%\n"
+            + "\n".join(active[:6]) + ("\n" if active else "") +
+            f"├ <b>Queued:</b> {counts.get('queued', 0)} | <b>Done:</b> {counts.get('done', 0)} | <b>Failed:</b> {counts.get('failed', 0)}\n"
+            f"└ <b>Elapsed:</b> {Progress._format_time(now - self.start_time)}"
+        )
+
+        from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+        cancel_btn = InlineKeyboardMarkup([[
+            InlineKeyboardButton("Cancel", callback_data=f"batchcancel_{self.user_id or 0}")
+        ]]) if self.user_id else None
+
+        try:
+            await self.message.edit_text(text, reply_markup=cancel_btn)
+        except Exception as e:
+            LOGGER.debug(f"Batch progress update error: {e}")
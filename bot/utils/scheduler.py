@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""Shared stage worker pools and batch processing"""
+
+import os
+import shutil
+import asyncio
+import logging
+from contextlib import aclosing
+from time import time
+from typing import Tuple
+
+from bot.utils.helpers import is_video_file
+from bot.utils.progress import BatchProgress
+from bot.utils.disk import get_disk_manager, estimate_output_size
+from bot.utils.fairshare import FairShare
+
+LOGGER = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = ('.zip', '.rar', '.7z', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+
+def is_archive_file(filename: str) -> bool:
+    """Check if file is an archive we can extract"""
+    return (filename or '').lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+class Scheduler:
+    """
+    Bot-wide concurrency limits for the download, FFmpeg and upload stages.
+    FFmpeg slots are shared fairly between users and groups (see FairShare).
+    """
+
+    def __init__(self, downloads: int, ffmpeg: int, uploads: int):
+        from bot import FAIRSHARE_WINDOW, USER_CPU_QUOTA
+
+        self.download = asyncio.Semaphore(downloads)
+        self.ffmpeg = FairShare(
+            ffmpeg,
+            FAIRSHARE_WINDOW,
+            cpu_per_slot=max(1, (os.cpu_count() or 1) // max(1, ffmpeg)),
+            default_quota=USER_CPU_QUOTA
+        )
+        self.upload = asyncio.Semaphore(uploads)
+        # Files allowed past download but not yet uploaded, per batch.
+        # One more than the FFmpeg slots keeps FFmpeg busy without piling up inputs.
+        self.window = ffmpeg + 1
+
+
+scheduler: Scheduler = None
+
+
+def get_scheduler() -> Scheduler:
+    """Get the shared scheduler"""
+    global scheduler
+    if scheduler is None:
+        from bot import MAX_CONCURRENT_DOWNLOADS, MAX_CONCURRENT_FFMPEG, MAX_CONCURRENT_UPLOADS
+        scheduler = Scheduler(MAX_CONCURRENT_DOWNLOADS, MAX_CONCURRENT_FFMPEG, MAX_CONCURRENT_UPLOADS)
+    return scheduler
+
+
+async def upload_output(client, chat_id: int, result: str | list, status_msg, user_id: int, callback):
+    """Upload a processed output to Telegram, splitting it if it is too large"""
+    from bot import TG_MAX_FILE_SIZE
+    from bot.ffmpeg.trim import split_by_size
+    from bot.handlers.file_handler import upload_file
+
+    if isinstance(result, list) or os.path.getsize(result) <= TG_MAX_FILE_SIZE * 1024 * 1024:
+        await upload_file(client, chat_id, result, status_msg, user_id=user_id, progress_callback=callback)
+        return
+
+    base_name, ext = os.path.splitext(os.path.basename(result))
+    parts_dir = os.path.join(os.path.dirname(result), f"{base_name}_parts")
+    os.makedirs(parts_dir, exist_ok=True)
+    try:
+        success, parts = await split_by_size(
+            result,
+            os.path.join(parts_dir, f"{base_name}.part%03d{ext}"),
+            TG_MAX_FILE_SIZE * 1024 * 1024
+        )
+        if not success:
+            raise RuntimeError(f"Split failed: {str(parts)[:200]}")
+        for i, part in enumerate(parts):
+            await upload_file(
+                client, chat_id, part, status_msg,
+                caption=f"📦 <b>Part {i + 1}/{len(parts)}</b>\n<code>{os.path.basename(part)}</code>",
+                user_id=user_id,
+                progress_callback=callback
+            )
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+
+async def run_batch(
+    client,
+    chat_id: int,
+    user_id: int,
+    items: list,
+    operation: str,
+    options: dict,
+    status_msg
+) -> Tuple[int, list]:
+    """
+    Run one operation over many files through the shared stage pools.
+
+    Items are {'type': 'telegram', 'message', 'name'} or {'type': 'url',
+    'url', 'name'} (yt-dlp) entries; archives are downloaded once and
+    their videos processed as they are extracted. The 'merge' operation
+    concatenates every item into one video instead (see run_merge).
+    Each file is downloaded, processed and uploaded independently, so
+    downloads overlap with FFmpeg work and uploads of earlier files.
+
+    Returns:
+        (files done, [(name, error), ...])
+    """
+    from bot import OUTPUT_DIR
+    from bot.ffmpeg.core import FFmpeg
+    from bot.ffmpeg.operations import run_operation
+    from bot.utils.archive import iter_extract
+    from bot.handlers.file_handler import download_file
+
+    if operation == 'merge':
+        return await run_merge(client, chat_id, user_id, items, status_msg)
+
+    sched = get_scheduler()
+    disk = get_disk_manager()
+    progress = BatchProgress(status_msg, operation.replace('_', ' ').title(), user_id=user_id)
+    window = asyncio.Semaphore(sched.window)
+    work_dir = os.path.join(OUTPUT_DIR, str(user_id), f"batch_{int(time())}")
+    os.makedirs(work_dir, exist_ok=True)
+
+    async def process_and_upload(index: int, input_path: str):
+        """FFmpeg and upload stages for a file already on disk"""
+        item_dir = os.path.join(work_dir, str(index))
+        try:
+            async with sched.ffmpeg.slot(user_id, chat_id):
+                await progress.set(index, 'processing')
+                duration = await FFmpeg(input_path).get_duration()
+                success, result = await run_operation(
+                    operation, input_path, item_dir, options,
+                    progress_callback=progress.ffmpeg_callback(index, duration),
+                    duration=duration
+                )
+            if not success:
+                raise RuntimeError(str(result)[:200])
+
+            # Inputs are only needed until FFmpeg is done with them
+            if os.path.exists(input_path):
+                os.remove(input_path)
+
+            async with sched.upload:
+                await progress.set(index, 'uploading')
+                await upload_output(
+                    client, chat_id, result, status_msg, user_id,
+                    progress.stage_callback(index, 'uploading')
+                )
+            await progress.set(index, 'done', 1.0)
+        finally:
+            shutil.rmtree(item_dir, ignore_errors=True)
+
+    async def run_telegram(index: int, item: dict):
+        message = item['message']
+        media = message.document or message.video
+        size = getattr(media, 'file_size', 0) or 0
+        input_path = None
+        token = None
+        try:
+            async with window:
+                # Reserved only once the item may start, so a batch never
+                # holds more than its window's worth of disk
+                token = await disk.reserve(size + estimate_output_size(operation, size), owner=user_id)
+                async with sched.download:
+                    await progress.set(index, 'downloading')
+                    input_path = await download_file(
+                        message, status_msg, user_id,
+                        progress_callback=progress.stage_callback(index, 'downloading'),
+                        directory=os.path.join(work_dir, f"input_{index}")
+                    )
+                if not input_path:
+                    raise RuntimeError("Download failed")
+                # Input is on disk now, only the output is still outstanding
+                disk.adjust(token, estimate_output_size(operation, os.path.getsize(input_path)))
+                await process_and_upload(index, input_path)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            LOGGER.error(f"Batch item {item.get('name')} failed: {e}")
+            await progress.set(index, 'failed', error=str(e))
+        finally:
+            disk.release(token)
+            if input_path and os.path.exists(input_path):
+                os.remove(input_path)
+
+    async def run_url(index: int, item: dict):
+        from bot.utils.ytdlp_handler import download_with_ytdlp, get_video_info, download_size
+
+        input_path = None
+        token = None
+        try:
+            async with window:
+                # Extraction is cached, the download below reuses it
+                size = download_size(await get_video_info(item['url'], user_id))
+                token = await disk.reserve(size + estimate_output_size(operation, size), owner=user_id)
+                async with sched.download:
+                    await progress.set(index, 'downloading')
+                    success, result = await download_with_ytdlp(
+                        item['url'], os.path.join(work_dir, f"input_{index}"), user_id=user_id,
+                        progress_callback=progress.stage_callback(index, 'downloading')
+                    )
+                if not success:
+                    raise RuntimeError(result)
+                input_path = result
+                # Input is on disk now, only the output is still outstanding
+                disk.adjust(token, estimate_output_size(operation, os.path.getsize(input_path)))
+                await process_and_upload(index, input_path)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            LOGGER.error(f"Batch item {item.get('name')} failed: {e}")
+            await progress.set(index, 'failed', error=str(e))
+        finally:
+            disk.release(token)
+            if input_path and os.path.exists(input_path):
+                os.remove(input_path)
+
+    async def run_extracted(index: int, path: str, entry_window: asyncio.Semaphore, on_done):
+        # Counted against the archive's reservation, see run_archive
+        size = 0
+        try:
+            size = os.path.getsize(path)
+            await process_and_upload(index, path)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            LOGGER.error(f"Batch item {os.path.basename(path)} failed: {e}")
+            await progress.set(index, 'failed', error=str(e))
+        finally:
+            on_done(size)
+            entry_window.release()
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def run_archive(index: int, item: dict):
+        message = item['message']
+        size = getattr(message.document, 'file_size', 0) or 0
+        archive_path = None
+        token = None
+        extract_dir = os.path.join(work_dir, f"archive_{index}")
+        entries = []
+        # One reservation covers the archive, its extracted contents and
+        # their outputs; entries must not reserve on their own while it is
+        # held, or they would wait for the archive and the archive for them
+        outputs = estimate_output_size(operation, size)
+        reserved = size + outputs
+        # Entries get their own window: the other batch slots may be held by
+        # items waiting for the disk this archive's reservation holds
+        entry_window = asyncio.Semaphore(sched.window)
+
+        def entry_done(entry_size: int):
+            nonlocal reserved
+            reserved = max(0, reserved - entry_size - estimate_output_size(operation, entry_size))
+            disk.adjust(token, reserved)
+
+        try:
+            # The archive takes one batch slot, like any other item
+            async with window:
+                token = await disk.reserve(size * 2 + outputs, owner=user_id)
+                async with sched.download:
+                    await progress.set(index, 'downloading')
+                    archive_path = await download_file(
+                        message, status_msg, user_id,
+                        progress_callback=progress.stage_callback(index, 'downloading'),
+                        directory=os.path.join(work_dir, f"input_{index}")
+                    )
+                if not archive_path:
+                    raise RuntimeError("Download failed")
+                # The archive is on disk now, its contents and outputs are still outstanding
+                disk.adjust(token, reserved)
+                await progress.set(index, 'processing')
+
+                # Videos are handed on as they land. iter_extract only runs a few
+                # entries ahead of us, so waiting for a window slot before pulling
+                # the next entry also pauses extraction.
+                async with aclosing(iter_extract(archive_path, extract_dir)) as extracted:
+                    async for path in extracted:
+                        if not is_video_file(path):
+                            os.remove(path)
+                            continue
+                        await entry_window.acquire()
+                        entry_index = progress.add(os.path.basename(path))
+                        entries.append(asyncio.create_task(run_extracted(entry_index, path, entry_window, entry_done)))
+
+                if not entries:
+                    raise RuntimeError("No videos in archive")
+                await asyncio.gather(*entries)
+                await progress.set(index, 'done', 1.0)
+        except asyncio.CancelledError:
+            for task in entries:
+                task.cancel()
+            raise
+        except Exception as e:
+            LOGGER.error(f"Batch archive {item.get('name')} failed: {e}")
+            await progress.set(index, 'failed', error=str(e))
+        finally:
+            disk.release(token)
+            if archive_path and os.path.exists(archive_path):
+                os.remove(archive_path)
+            shutil.rmtree(extract_dir, ignore_errors=True)
+
+    tasks = []
+    for item in items:
+        index = progress.add(item.get('name') or 'file')
+        runner = {'archive': run_archive, 'url': run_url}.get(item.get('type'), run_telegram)
+        tasks.append(asyncio.create_task(runner(index, item)))
+
+    await progress.refresh(force=True)
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Archive containers count through their entries, not themselves
+    archive_indexes = {i for i, item in enumerate(items) if item.get('type') == 'archive'}
+    done = sum(
+        1 for i, item in enumerate(progress.items)
+        if item['stage'] == 'done' and i not in archive_indexes
+    )
+    failed = [(item['name'], item['error']) for item in progress.items if item['stage'] == 'failed']
+    return done, failed
+
+
+async def run_merge(
+    client,
+    chat_id: int,
+    user_id: int,
+    items: list,
+    status_msg
+) -> Tuple[int, list]:
+    """
+    Download every item in parallel (within the shared download slots)
+    and concatenate them, in order, into one uploaded video.
+
+    Returns:
+        (videos merged, [(name, error), ...])
+    """
+    from bot import OUTPUT_DIR
+    from bot.ffmpeg.core import FFmpeg
+    from bot.ffmpeg.merge import concat_videos
+    from bot.handlers.file_handler import download_file
+    from bot.utils.ytdlp_handler import download_with_ytdlp, get_video_info, download_size
+
+    sched = get_scheduler()
+    disk = get_disk_manager()
+    progress = BatchProgress(status_msg, "Merge", user_id=user_id)
+    work_dir = os.path.join(OUTPUT_DIR, str(user_id), f"merge_{int(time())}")
+    os.makedirs(work_dir, exist_ok=True)
+    paths = [None] * len(items)
+    sizes = [0] * len(items)
+    token = None
+
+    async def measure(index: int, item: dict):
+        try:
+            if item.get('type') == 'archive':
+                raise RuntimeError("Archives can't be merged")
+            if item.get('type') == 'url':
+                sizes[index] = download_size(await get_video_info(item['url'], user_id))
+            else:
+                sizes[index] = getattr(item['message'].document or item['message'].video, 'file_size', 0) or 0
+        except Exception as e:
+            LOGGER.error(f"Merge item {item.get('name')} failed: {e}")
+            await progress.set(index, 'failed', error=str(e))
+
+    async def fetch(index: int, item: dict):
+        if progress.items[index]['stage'] == 'failed':
+            return
+        directory = os.path.join(work_dir, f"input_{index}")
+        try:
+            async with sched.download:
+                await progress.set(index, 'downloading')
+                callback = progress.stage_callback(index, 'downloading')
+                if item.get('type') == 'url':
+                    success, result = await download_with_ytdlp(
+                        item['url'], directory, user_id=user_id, progress_callback=callback
+                    )
+                    if not success:
+                        raise RuntimeError(result)
+                    paths[index] = result
+                else:
+                    paths[index] = await download_file(
+                        item['message'], status_msg, user_id,
+                        progress_callback=callback, directory=directory
+                    )
+                    if not paths[index]:
+                        raise RuntimeError("Download failed")
+            await progress.set(index, 'processing')
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            LOGGER.error(f"Merge item {item.get('name')} failed: {e}")
+            await progress.set(index, 'failed', error=str(e))
+
+    for item in items:
+        progress.add(item.get('name') or 'file')
+    await progress.refresh(force=True)
+
+    try:
+        await asyncio.gather(*(measure(i, item) for i, item in enumerate(items)))
+        # One reservation for every input plus its copy in the output, taken
+        # up front so a merge too large for the disk fails instead of its
+        # downloads waiting on each other
+        token = await disk.reserve(sum(sizes) * 2, owner=user_id)
+
+        tasks = [asyncio.create_task(fetch(i, item)) for i, item in enumerate(items)]
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        merged = [i for i, path in enumerate(paths) if path]
+        # Inputs are on disk now, only the merged output is still outstanding
+        disk.adjust(token, sum(sizes[i] for i in merged))
+        failed = [(item['name'], item['error']) for item in progress.items if item['stage'] == 'failed']
+        if len(merged) < 2:
+            failed.append(("merge", "Not enough videos downloaded"))
+            return 0, failed
+
+        async def set_all(stage: str, fraction: float):
+            for i in merged:
+                progress.items[i]['stage'] = stage
+                progress.items[i]['fraction'] = fraction
+            await progress.refresh()
+
+        async def merge_callback(current_time: float):
+            await set_all('processing', min(current_time / duration, 1.0) if duration > 0 else 0)
+
+        async def upload_callback(current: int, total: int):
+            await set_all('uploading', current / total if total else 0)
+
+        durations = await asyncio.gather(*(FFmpeg(paths[i]).get_duration() for i in merged))
+        duration = sum(durations)
+        output = os.path.join(work_dir, f"merged_{len(merged)}_videos.mp4")
+        async with sched.ffmpeg.slot(user_id, chat_id):
+            success, result = await concat_videos([paths[i] for i in merged], output, merge_callback, duration)
+        if not success:
+            raise RuntimeError(str(result)[:200])
+
+        for i in merged:
+            os.remove(paths[i])
+        async with sched.upload:
+            await set_all('uploading', 0.0)
+            await upload_output(client, chat_id, result, status_msg, user_id, upload_callback)
+        for i in merged:
+            await progress.set(i, 'done', 1.0)
+
+        return len(merged), failed
+    finally:
+        disk.release(token)
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Stall watchdog for FFmpeg runs and Telegram transfers, with retries and stall metrics"""
+
+import asyncio
+import logging
+from collections import deque
+from time import time
+from typing import Callable, Dict
+
+LOGGER = logging.getLogger(__name__)
+
+# First retry waits this long, each further one twice as long
+RETRY_BACKOFF = 5
+# Stalls kept for /stats
+RECENT_STALLS = 10
+STAGE_NAMES = {'ffmpeg': "FFmpeg", 'download': "Download", 'upload': "Upload"}
+
+
+class StallDetected(Exception):
+    pass
+
+
+class Heartbeat:
+    """Last time an attempt made progress"""
+
+    def __init__(self):
+        self.last = time()
+        self.position = None
+
+    def beat(self, position=None):
+        """Record progress; with a position, only a changed one counts"""
+        if position is None or position != self.position:
+            self.position = position
+            self.last = time()
+
+    def idle(self) -> float:
+        return time() - self.last
+
+    def wrap(self, callback: Callable = None) -> Callable:
+        """Pyrogram (current, total) progress callback that also beats"""
+        async def progress(current: int, total: int):
+            self.beat(current)
+            if callback:
+                await callback(current, total)
+        return progress
+
+
+def stall_timeout(stage: str) -> float:
+    """Seconds without progress before a stage counts as stalled (0 = not watched)"""
+    from bot import FFMPEG_STALL_TIMEOUT, DOWNLOAD_STALL_TIMEOUT, UPLOAD_STALL_TIMEOUT
+    return {
+        'ffmpeg': FFMPEG_STALL_TIMEOUT,
+        'download': DOWNLOAD_STALL_TIMEOUT,
+        'upload': UPLOAD_STALL_TIMEOUT,
+    }.get(stage, 0)
+
+
+class Watchdog:
+    """Stall counters per stage"""
+
+    def __init__(self):
+        self.stalls: Dict[str, int] = {}
+        self.recovered: Dict[str, int] = {}
+        self.failed: Dict[str, int] = {}
+        self.recent = deque(maxlen=RECENT_STALLS)  # (time, stage, idle seconds, attempt)
+
+    @staticmethod
+    def _count(counter: dict, stage: str):
+        counter[stage] = counter.get(stage, 0) + 1
+
+    def record_stall(self, stage: str, idle: float, attempt: int):
+        self._count(self.stalls, stage)
+        self.recent.append((time(), stage, idle, attempt))
+        LOGGER.warning(f"{STAGE_NAMES.get(stage, stage)} stalled (no progress for {idle:.0f}s, attempt {attempt + 1})")
+
+    def record_outcome(self, stage: str, recovered: bool):
+        self._count(self.recovered if recovered else self.failed, stage)
+
+    def report(self) -> str:
+        """Stall summary for /stats"""
+        if not self.stalls:
+            return "• No stalls since start\n"
+        text = ""
+        for stage in sorted(self.stalls):
+            text += (
+                f"• <b>{STAGE_NAMES.get(stage, stage)}:</b> {self.stalls[stage]} stalls, "
+                f"{self.recovered.get(stage, 0)} recovered, {self.failed.get(stage, 0)} failed\n"
+            )
+        return text
+
+    async def run(self, stage: str, attempt: Callable, timeout: float = None, retries: int = None):
+        """
+        Run attempt(heartbeat, number) as a task until it returns.
+
+        If its heartbeat goes quiet for timeout seconds the attempt is
+        cancelled (which kills its processes) and started again after a
+        backoff, with number counting the retries so callers can switch to
+        a safer variant. Raises StallDetected once the retries are used up.
+        """
+        from bot import STALL_RETRIES
+
+        timeout = stall_timeout(stage) if timeout is None else timeout
+        retries = STALL_RETRIES if retries is None else retries
+        if not timeout:
+            return await attempt(Heartbeat(), 0)
+
+        for number in range(retries + 1):
+            heartbeat = Heartbeat()
+            task = asyncio.create_task(attempt(heartbeat, number))
+            try:
+                while not task.done() and heartbeat.idle() < timeout:
+                    await asyncio.wait({task}, timeout=max(timeout - heartbeat.idle(), 1))
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+
+            if task.done():
+                if number:
+                    self.record_outcome(stage, recovered=True)
+                return task.result()
+
+            idle = heartbeat.idle()
+            task.cancel()
+            await asyncio.wait({task})
+            self.record_stall(stage, idle, number)
+            if number < retries:
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** number)
+
+        self.record_outcome(stage, recovered=False)
+        raise StallDetected(f"{STAGE_NAMES.get(stage, stage)} stalled: no progress for {timeout:.0f}s ({retries + 1} attempts)")
+
+
+watchdog: Watchdog = None
+
+
+def get_watchdog() -> Watchdog:
+    """Get the stall watchdog"""
+    global watchdog
+    if watchdog is None:
+        watchdog = Watchdog()
+    return watchdog
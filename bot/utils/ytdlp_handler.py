@@ -2,17 +2,58 @@
 """YT-DLP Handler with cookie support and better error handling"""
 
 import os
+import copy
+import shutil
 import asyncio
+import hashlib
 import tempfile
 import logging
-from typing import Optional, Tuple
+import threading
+from time import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from bot.utils.lazy import lazy_import
+from bot.utils.bandwidth import get_bandwidth, get_host_limiter
+
+yt_dlp = lazy_import('yt_dlp')
 
 LOGGER = logging.getLogger(__name__)
 
+# Separate best video and audio streams, muxed without re-encoding
+# (falls back to the best single file when a site has no split streams)
+DEFAULT_FORMAT = "bestvideo*+bestaudio/best"
+
+# Extraction results are reused for this long (stream URLs expire eventually),
+# keyed by (URL, cookie digest) so one account's results never serve another
+INFO_CACHE_TTL = 600
+INFO_CACHE_SIZE = 64
+_info_cache: "OrderedDict[Tuple[str, str], Tuple[float, dict]]" = OrderedDict()
+
+# Cookie files written per cookie owner (user ID, 0 = global): owner -> (path, digest)
+COOKIES_DIR = os.path.join(tempfile.gettempdir(), "ffmpeg-bot-cookies")
+_cookie_files = {}
+
+# Playlists and channels are enumerated up to this many entries
+PLAYLIST_MAX_ENTRIES = 500
+
+# yt-dlp is blocking, it runs in its own small thread pool
+YTDLP_WORKERS = 4
+_executor: ThreadPoolExecutor = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=YTDLP_WORKERS, thread_name_prefix="ytdlp")
+    return _executor
+
 
 async def get_cookies_path(user_id: int = None) -> Optional[str]:
     """
-    Get cookies file path. Writes cookies from MongoDB to temp file if available.
+    Get cookies file path for a user (falling back to global cookies).
+    The file is only rewritten when the cookies stored in MongoDB change.
     Returns None if no cookies are stored.
     """
     from bot.utils.db_handler import get_db
@@ -20,182 +61,344 @@ async def get_cookies_path(user_id: int = None) -> Optional[str]:
     if not db:
         LOGGER.warning("Database not available for cookies")
         return None
-    
+
     try:
         # Try user-specific cookies first, then global
-        cookies_data = None
+        owner, cookies_data = user_id, None
         if user_id:
             cookies_data = await db.get_cookies(user_id)
-            if cookies_data:
-                LOGGER.info(f"Found user-specific cookies for {user_id}")
-        
+
         if not cookies_data:
-            cookies_data = await db.get_cookies(0)  # Global cookies (user_id=0)
-            if cookies_data:
-                LOGGER.info("Found global cookies")
-        
+            owner, cookies_data = 0, await db.get_cookies(0)  # Global cookies (user_id=0)
+
         if not cookies_data:
-            LOGGER.info("No cookies found in database")
+            _forget_cookies(0)
+            if user_id:
+                _forget_cookies(user_id)
             return None
-        
-        # Write to temp file
-        temp_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False)
-        temp_file.write(cookies_data)
-        temp_file.close()
-        LOGGER.info(f"Cookies written to temp file: {temp_file.name}")
-        return temp_file.name
+
+        digest = hashlib.sha1(cookies_data.encode()).hexdigest()
+        cached = _cookie_files.get(owner)
+        if cached and cached[1] == digest and os.path.exists(cached[0]):
+            return cached[0]
+
+        os.makedirs(COOKIES_DIR, exist_ok=True)
+        path = os.path.join(COOKIES_DIR, f"cookies_{owner}.txt")
+        with open(path, 'w') as f:
+            f.write(cookies_data)
+        _cookie_files[owner] = (path, digest)
+        LOGGER.info(f"Cookies for {owner or 'global'} written to {path}")
+        return path
     except Exception as e:
         LOGGER.error(f"Error getting cookies: {e}")
         return None
 
 
+def _forget_cookies(owner: int):
+    cached = _cookie_files.pop(owner, None)
+    if cached and os.path.exists(cached[0]):
+        try:
+            os.remove(cached[0])
+        except OSError:
+            pass
+
+
+def _base_options(cookies_path: str = None) -> dict:
+    options = {
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'noplaylist': True,            # Download single video
+        'nocheckcertificate': True,    # Bypass SSL issues
+        'extractor_retries': 3,        # Retry failed extractions
+        'retries': 3,                  # Retry failed downloads
+        'fragment_retries': 3,
+    }
+    if cookies_path:
+        options['cookiefile'] = cookies_path
+    return options
+
+
+def _cookie_identity(cookies_path: str = None) -> str:
+    """Digest of the cookies in cookies_path, '' without cookies"""
+    for path, digest in _cookie_files.values():
+        if path == cookies_path:
+            return digest
+    return ''
+
+
+def _cached_info(key: Tuple[str, str]) -> Optional[dict]:
+    entry = _info_cache.get(key)
+    if not entry:
+        return None
+    expires, info = entry
+    if expires < time():
+        del _info_cache[key]
+        return None
+    _info_cache.move_to_end(key)
+    return info
+
+
+def _cache_info(key: Tuple[str, str], info: dict):
+    _info_cache[key] = (time() + INFO_CACHE_TTL, info)
+    _info_cache.move_to_end(key)
+    while len(_info_cache) > INFO_CACHE_SIZE:
+        _info_cache.popitem(last=False)
+
+
+def _friendly_error(error_msg: str) -> str:
+    """Turn a yt-dlp error into a message for the user"""
+    if "Sign in to confirm your age" in error_msg:
+        return "⚠️ Age-restricted video. Please provide cookies from a logged-in account using /cookies command."
+    elif "Private video" in error_msg:
+        return "⚠️ This is a private video."
+    elif "Video unavailable" in error_msg:
+        return "⚠️ Video is unavailable in your region or has been removed."
+    elif "confirm you're not a bot" in error_msg or "Sign in" in error_msg:
+        return "⚠️ YouTube requires authentication. Please upload cookies using /cookies command."
+    elif "HTTP Error 429" in error_msg:
+        return "⚠️ Too many requests. Please try again later."
+    elif "Unsupported URL" in error_msg:
+        return "⚠️ This URL is not supported by yt-dlp."
+    elif "downloaded file is empty" in error_msg.lower() or "file is empty" in error_msg.lower():
+        return "⚠️ YouTube blocked the download. Please upload cookies using /cookies command.\n\n<b>How to get cookies:</b>\n1. Install 'Get cookies.txt' extension in Chrome\n2. Go to YouTube and login\n3. Export cookies and upload with /cookies set"
+    elif "no video formats" in error_msg.lower() or "Requested format is not available" in error_msg:
+        return "⚠️ No downloadable formats found. The video may be protected or region-locked."
+    else:
+        # Return last few lines of error
+        error_lines = [l for l in error_msg.split('\n') if l.strip()]
+        short_error = '\n'.join(error_lines[-3:]) if len(error_lines) > 3 else error_msg
+        return f"❌ yt-dlp error:\n<code>{short_error[:500]}</code>"
+
+
+def _extract(url: str, options: dict) -> dict:
+    with yt_dlp.YoutubeDL(options) as ydl:
+        info = ydl.extract_info(url, download=False)
+        return ydl.sanitize_info(info)
+
+
+def _media_url(info: dict) -> Optional[str]:
+    """URL of the first format yt-dlp picked (the CDN host its fragments come from)"""
+    for f in info.get('requested_formats') or [info]:
+        if f.get('url'):
+            return f['url']
+    return None
+
+
+def _download(url: str, info: Optional[dict], options: dict) -> str:
+    """Download in a worker thread, reusing an extracted info dict when there is one"""
+    with yt_dlp.YoutubeDL(options) as ydl:
+        if info is not None:
+            # Formats are picked again with this download's options, without re-extracting
+            result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+        else:
+            result = ydl.extract_info(url, download=True)
+
+        downloads = result.get('requested_downloads') or []
+        if downloads and downloads[-1].get('filepath'):
+            return downloads[-1]['filepath']
+        return ydl.prepare_filename(result)
+
+
 async def download_with_ytdlp(
     url: str,
     output_dir: str,
     user_id: int = None,
     status_msg=None,
-    format_id: str = None
+    format_id: str = None,
+    progress_callback: Callable = None
 ) -> Tuple[bool, str]:
     """
     Download video using yt-dlp with proper error handling and cookie support.
-    
+
+    Partial files, fragments and unmerged streams live in a private temp
+    directory, so concurrent downloads into the same output_dir never see
+    each other's files; the final path comes from yt-dlp itself.
+    progress_callback(current, total) replaces the status message progress
+    (batches report many downloads in one message).
+
     Returns:
         Tuple[bool, str]: (success, file_path or error_message)
     """
-    import glob
-    
-    # Prepare output template
-    out_tpl = os.path.join(output_dir, "%(title)s.%(ext)s")
-    
-    # Build command with simpler, more compatible options
-    cmd = ["yt-dlp", "-o", out_tpl]
-    
-    # Add format selection - use simpler "best" for better compatibility
-    if format_id:
-        cmd.extend(["-f", format_id])
-    else:
-        # Simpler format selection that works better with age-restricted/geo-blocked
-        cmd.extend(["-f", "best"])
-    
-    # Add cookies if available
+    from bot import YTDLP_CONCURRENT_FRAGMENTS
+    from bot.utils.jobs import on_cancel
+    from bot.utils.progress import Progress
+
+    os.makedirs(output_dir, exist_ok=True)
+    job_dir = tempfile.mkdtemp(prefix=".ytdlp_", dir=output_dir)
     cookies_path = await get_cookies_path(user_id)
-    if cookies_path:
-        cmd.extend(["--cookies", cookies_path])
-        LOGGER.info(f"Using cookies file for yt-dlp")
-    
-    # Add other useful options
-    cmd.extend([
-        "--no-playlist",      # Download single video
-        "--no-warnings",
-        "--no-check-certificates",  # Bypass SSL issues
-        "--extractor-retries", "3",  # Retry failed extractions
-        "--retries", "3",     # Retry failed downloads
-        "--fragment-retries", "3",
-        url
-    ])
-    
-    try:
-        if status_msg:
-            cookie_status = "🍪" if cookies_path else "⚠️ No cookies"
-            await status_msg.edit_text(
-                f"🎬 <b>Downloading with yt-dlp...</b>\n"
-                f"<code>{url[:50]}...</code>\n\n"
-                f"{cookie_status}"
-            )
-        
-        # Run yt-dlp
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+    cache_key = (url, _cookie_identity(cookies_path))
+
+    options = _base_options(cookies_path)
+    options.update({
+        'format': format_id or DEFAULT_FORMAT,
+        'paths': {'home': output_dir, 'temp': job_dir},
+        'outtmpl': "%(title).150B [%(id)s].%(ext)s",
+    })
+
+    loop = asyncio.get_running_loop()
+    budget = get_bandwidth()
+    progress = None
+    counted = {}  # stream file -> bytes charged to the budget
+    counted_lock = threading.Lock()
+    # Set when the awaiting task is cancelled, the worker thread stops at its next hook call
+    stop = threading.Event()
+
+    if status_msg:
+        cookie_status = "🍪" if cookies_path else "⚠️ No cookies"
+        await status_msg.edit_text(
+            f"🎬 <b>Downloading with yt-dlp...</b>\n"
+            f"<code>{url[:50]}...</code>\n\n"
+            f"{cookie_status}"
         )
-        
-        stdout, stderr = await proc.communicate()
-        
-        # Cleanup cookies temp file
-        if cookies_path and os.path.exists(cookies_path):
+        progress = Progress(status_msg, "📥 Downloading (yt-dlp)", user_id=user_id)
+
+    def progress_hook(d):
+        # Runs in yt-dlp's (fragment) threads; the message is edited on the event loop
+        if stop.is_set() or (progress and progress.cancelled):
+            raise yt_dlp.utils.DownloadCancelled("Cancelled by user")
+        if d.get('status') != 'downloading':
+            return
+
+        downloaded = d.get('downloaded_bytes') or 0
+        # Video and audio streams each count from zero
+        stream = d.get('filename') or (d.get('info_dict') or {}).get('format_id')
+        with counted_lock:
+            delta = max(0, downloaded - counted.get(stream, 0))
+            counted[stream] = max(counted.get(stream, 0), downloaded)
+        # Sleeping here slows this download down to its share of the budget
+        budget.throttle_sync(delta)
+
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        if progress_callback and total:
+            asyncio.run_coroutine_threadsafe(progress_callback(downloaded, total), loop)
+        elif progress and total:
+            progress.filename = os.path.basename(d.get('filename') or '') or None
+            asyncio.run_coroutine_threadsafe(progress.progress_callback(downloaded, total), loop)
+
+    def postprocessor_hook(d):
+        # Don't start a merge/convert FFmpeg run for a download that was cancelled meanwhile
+        if stop.is_set():
+            raise yt_dlp.utils.DownloadCancelled("Cancelled by user")
+
+    options['progress_hooks'] = [progress_hook]
+    options['postprocessor_hooks'] = [postprocessor_hook]
+    # Stop the worker thread as soon as the job owning this download is cancelled
+    on_cancel(stop.set)
+
+    try:
+        info = _cached_info(cache_key)
+        if info is None:
+            # Extract first, so the connection cap applies to the host serving the media
+            info = await loop.run_in_executor(_get_executor(), _extract, url, _base_options(cookies_path))
+            _cache_info(cache_key, info)
+        async with get_host_limiter().connections(_media_url(info) or url, YTDLP_CONCURRENT_FRAGMENTS) as connections:
+            options['concurrent_fragment_downloads'] = connections
+            download = loop.run_in_executor(_get_executor(), _download, url, info, options)
             try:
-                os.remove(cookies_path)
-            except:
-                pass
-        
-        # Get combined output for error checking
-        output_text = stdout.decode('utf-8', errors='ignore') + stderr.decode('utf-8', errors='ignore')
-        
-        if proc.returncode == 0:
-            # Find the downloaded file (newest file in output_dir)
-            candidates = glob.glob(os.path.join(output_dir, "*"))
-            if candidates:
-                file_path = max(candidates, key=os.path.getmtime)
-                # Check if file is not empty
-                if os.path.getsize(file_path) > 0:
-                    return True, file_path
-                else:
-                    os.remove(file_path)
-                    return False, "⚠️ Downloaded file is empty. YouTube may require cookies.\n\nUse /cookies set to upload your cookies.txt file."
-            else:
-                return False, "Download completed but file not found"
-        else:
-            # Parse error message
-            error_msg = output_text.strip()
-            
-            # Extract meaningful error
-            if "Sign in to confirm your age" in error_msg:
-                return False, "⚠️ Age-restricted video. Please provide cookies from a logged-in account using /cookies command."
-            elif "Private video" in error_msg:
-                return False, "⚠️ This is a private video."
-            elif "Video unavailable" in error_msg:
-                return False, "⚠️ Video is unavailable in your region or has been removed."
-            elif "confirm you're not a bot" in error_msg or "Sign in" in error_msg:
-                return False, "⚠️ YouTube requires authentication. Please upload cookies using /cookies command."
-            elif "HTTP Error 429" in error_msg:
-                return False, "⚠️ Too many requests. Please try again later."
-            elif "Unsupported URL" in error_msg:
-                return False, "⚠️ This URL is not supported by yt-dlp."
-            elif "downloaded file is empty" in error_msg.lower() or "file is empty" in error_msg.lower():
-                return False, "⚠️ YouTube blocked the download. Please upload cookies using /cookies command.\n\n<b>How to get cookies:</b>\n1. Install 'Get cookies.txt' extension in Chrome\n2. Go to YouTube and login\n3. Export cookies and upload with /cookies set"
-            elif "no video formats" in error_msg.lower():
-                return False, "⚠️ No downloadable formats found. The video may be protected or region-locked."
-            else:
-                # Return last few lines of error
-                error_lines = error_msg.split('\n')
-                # Filter out empty lines
-                error_lines = [l for l in error_lines if l.strip()]
-                short_error = '\n'.join(error_lines[-3:]) if len(error_lines) > 3 else error_msg
-                return False, f"❌ yt-dlp error:\n<code>{short_error[:500]}</code>"
-                
+                file_path = await asyncio.shield(download)
+            except asyncio.CancelledError:
+                # The worker thread only stops at its next hook call, it keeps
+                # its connections and temp directory until then
+                stop.set()
+                await asyncio.wait({download})
+                raise
+    except asyncio.CancelledError:
+        stop.set()
+        raise
     except Exception as e:
-        LOGGER.error(f"yt-dlp exception: {e}")
-        return False, f"❌ Error running yt-dlp: {str(e)}"
+        if type(e).__name__ == 'DownloadCancelled':
+            return False, "❌ Download cancelled."
+        LOGGER.error(f"yt-dlp error: {e}")
+        return False, _friendly_error(str(e))
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+    if not file_path or not os.path.exists(file_path):
+        return False, "Download completed but file not found"
+
+    # Check if file is not empty
+    if os.path.getsize(file_path) == 0:
+        os.remove(file_path)
+        return False, "⚠️ Downloaded file is empty. YouTube may require cookies.\n\nUse /cookies set to upload your cookies.txt file."
+
+    return True, file_path
 
 
 async def get_video_info(url: str, user_id: int = None) -> Optional[dict]:
-    """Get video info without downloading"""
-    cmd = ["yt-dlp", "--dump-json", "--no-download", "--no-warnings", url]
-    
+    """Get video info without downloading (cached per URL and cookies for a few minutes)"""
     cookies_path = await get_cookies_path(user_id)
-    if cookies_path:
-        cmd.insert(1, "--cookies")
-        cmd.insert(2, cookies_path)
-    
+    key = (url, _cookie_identity(cookies_path))
+    info = _cached_info(key)
+    if info is not None:
+        return info
+
     try:
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.DEVNULL,
+        info = await asyncio.get_running_loop().run_in_executor(
+            _get_executor(), _extract, url, _base_options(cookies_path)
         )
-        stdout, _ = await proc.communicate()
-        
-        if cookies_path and os.path.exists(cookies_path):
-            try:
-                os.remove(cookies_path)
-            except:
-                pass
-        
-        if proc.returncode == 0:
-            import json
-            return json.loads(stdout.decode('utf-8'))
     except Exception as e:
         LOGGER.error(f"Error getting video info: {e}")
-    
-    return None
+        return None
+
+    _cache_info(key, info)
+    return info
+
+
+def download_size(info: dict) -> int:
+    """Approximate size of the formats yt-dlp picked for an info dict (0 if unknown)"""
+    if not info:
+        return 0
+    formats = info.get('requested_formats') or [info]
+    return sum(int(f.get('filesize') or f.get('filesize_approx') or 0) for f in formats)
+
+
+def _extract_entries(url: str, options: dict, identity: str) -> Optional[List[dict]]:
+    options = dict(options, noplaylist=False, extract_flat='in_playlist', playlistend=PLAYLIST_MAX_ENTRIES)
+    with yt_dlp.YoutubeDL(options) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        # A single video is extracted in full, keep it for the download
+        _cache_info((url, identity), ydl.sanitize_info(info))
+        return None
+
+    entries = []
+    for entry in info.get('entries') or []:
+        entry_url = entry and (entry.get('webpage_url') or entry.get('url'))
+        if entry_url:
+            entries.append({
+                'url': entry_url,
+                'title': entry.get('title') or entry.get('id') or entry_url,
+                'duration': entry.get('duration'),
+            })
+    return entries
+
+
+async def get_playlist_entries(url: str, user_id: int = None) -> Optional[List[dict]]:
+    """
+    Enumerate a playlist or channel once with flat extraction.
+
+    Only titles and URLs are fetched, not each video's formats. Returns
+    [{'url', 'title', 'duration'}, ...], or None when url is a single
+    video (its full info is cached for the download) or extraction fails.
+    """
+    cookies_path = await get_cookies_path(user_id)
+    identity = _cookie_identity(cookies_path)
+    key = (f"playlist:{url}", identity)
+    cached = _cached_info(key)
+    if cached is not None:
+        return cached['entries']
+
+    try:
+        entries = await asyncio.get_running_loop().run_in_executor(
+            _get_executor(), _extract_entries, url, _base_options(cookies_path), identity
+        )
+    except Exception as e:
+        LOGGER.error(f"Error listing playlist: {e}")
+        return None
+
+    if entries is None:
+        return None
+    _cache_info(key, {'entries': entries})
+    return entries